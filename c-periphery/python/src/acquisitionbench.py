@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2018 Steven P. Goldsmith
+# See LICENSE.md for details.
+
+"""
+Multi-bus acquisition benchmark
+-------------
+Simulated devices free run on 1 to N buses and aggregate samples/sec is
+reported for each bus count. No hardware is needed.
+
+sleep mode models a transfer that blocks in the kernel (time.sleep releases
+the GIL like a CFFI call). cpu mode burns CPU in C with the GIL released
+(hashlib on a large buffer) to show scaling across cores.
+"""
+
+import hashlib, os, time
+from argparse import *
+from libperiphery import acquisition
+
+
+class simdevice:
+    """Simulated bus read.
+    """
+
+    def __init__(self, mode, transferUs):
+        self.mode = mode
+        self.secs = transferUs / 1000000
+        # Roughly 1 us of sha256 per 300 bytes on a Cortex-A7, scaled to transferUs
+        self.data = os.urandom(max(4096, int(transferUs * 300)))
+
+    def execute(self):
+        if self.mode == "sleep":
+            time.sleep(self.secs)
+        else:
+            hashlib.sha256(self.data).digest()
+        return b"\x00" * 14
+
+
+class acquisitionbench:
+
+    def run(self, buses, devices, mode, transferUs, secs):
+        """Return aggregate samples/sec and the slowest device's samples/sec
+        for buses.
+        """
+        acq = acquisition.acquisition()
+        for b in range(buses):
+            for d in range(devices):
+                acq.add("/dev/i2c-%d" % b, "dev%d.%d" % (b, d), simdevice(mode, transferUs), 0)
+        acq.start()
+        count = 0
+        last = 0
+        end = time.monotonic() + secs
+        while time.monotonic() < end:
+            time.sleep(0.01)
+            samples = acq.merge()
+            # Stream must come out in order
+            if samples and samples[0][0] < last:
+                raise RuntimeError("Samples out of order")
+            if samples:
+                last = samples[-1][0]
+            count += len(samples)
+        acq.stop()
+        count += len(acq.merge(final=True))
+        slowest = min(s["rate"] for s in acq.stats().values())
+        return count / secs, slowest
+
+    def main(self, maxBuses, devices, mode, transferUs, secs):
+        print("Mode: %s, transfer: %d us, devices per bus: %d, cpus: %d" % (mode, transferUs, devices, os.cpu_count()))
+        base = None
+        for buses in range(1, maxBuses + 1):
+            rate, slowest = self.run(buses, devices, mode, transferUs, secs)
+            if base is None:
+                base = rate
+            print("Buses: %d, samples/sec: %10.1f, scaling: %.2fx, slowest device/sec: %10.1f" % (buses, rate, rate / base,
+                                                                                               slowest))
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--buses", help="Maximum number of buses (default 4)", type=int, default=4)
+    parser.add_argument("--devices", help="Devices per bus (default 2)", type=int, default=2)
+    parser.add_argument("--mode", help="Simulation mode sleep or cpu (default cpu)", type=str, default="cpu")
+    parser.add_argument("--transfer_us", help="Simulated transfer time in us (default 200)", type=int, default=200)
+    parser.add_argument("--secs", help="Seconds per run (default 3)", type=int, default=3)
+    args = parser.parse_args()
+    obj = acquisitionbench()
+    obj.main(args.buses, args.devices, args.mode, args.transfer_us, args.secs)
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2018 Steven P. Goldsmith
+# See LICENSE.md for details.
+
+"""
+Activity adaptive data rate demo
+-------------
+Samples an ADXL345 or MPU-6050 through libperiphery.adaptive and prints every
+rate change, then compares bus transfers and wakeups with a fixed active rate.
+--sim runs against a simulated device that is still except for a few seconds
+of motion every --cycle seconds. --line is the GPIO line wired to the activity
+interrupt (INT1, or INT2 with --int2 on the ADXL345), so idle steps do not poll
+the interrupt flags over I2C.
+"""
+
+import sys, threading, time
+from argparse import *
+from libperiphery import adaptive, instrument, libperipheryi2c, sim
+from mpu6050 import mpu6050
+from adxl345 import adxl345
+
+
+class adaptiverate:
+
+    def __init__(self, device, simulated):
+        self.simLib = None
+        if simulated:
+            self.simLib = sim.i2clib()
+            i2c = libperipheryi2c.libperipheryi2c(lib=self.simLib)
+        else:
+            i2c = libperipheryi2c.libperipheryi2c()
+        self.i2c = i2c
+        self.device = device
+        self.model = None
+
+    def open(self, driver, address, int2):
+        if self.simLib is not None:
+            if driver == "adxl345":
+                self.model = sim.adxl345model(noise=0.002)
+            else:
+                self.model = sim.mpu6050model(noise=0.002)
+            self.simLib.add(self.device, address, self.model)
+        self.tracker = instrument.instrument()
+        self.tracker.enable(self.i2c)
+        handle = self.i2c.open(self.device)
+        if driver == "adxl345":
+            dev = adxl345(self.i2c)
+            # Measure, full resolution +/- 2g
+            self.i2c.writeReg(handle, address, 0x2d, 0x08)
+            dev.setRange(handle, address, 0x00)
+            profile = adaptive.adxl345profile(dev, handle, address, int2=int2)
+        else:
+            dev = mpu6050(self.i2c)
+            profile = adaptive.mpu6050profile(dev, handle, address)
+        return handle, profile
+
+    def interrupt(self, chip, line):
+        """Activity interrupt line requested for rising edge events.
+        """
+        import gpiod
+        self.chip = gpiod.Chip(chip, gpiod.Chip.OPEN_BY_PATH)
+        gpioLine = self.chip.get_line(line)
+        gpioLine.request(consumer=sys.argv[0][:-3], type=gpiod.LINE_REQ_EV_RISING_EDGE)
+        return gpioLine
+
+    def shake(self, stopped, cycle, moveSecs):
+        """Simulated motion for moveSecs every cycle seconds.
+        """
+        start = time.monotonic()
+        while not stopped.is_set():
+            moving = (time.monotonic() - start) % cycle >= cycle - moveSecs
+            self.model.noise = 0.3 if moving else 0.002
+            stopped.wait(0.05)
+
+    def main(self, driver, address, duration, cycle, moveSecs, chip, line, int2):
+        handle, profile = self.open(driver, address, int2)
+        gpioLine = None
+        if line is not None:
+            gpioLine = self.interrupt(chip, line)
+        ctl = adaptive.controller(profile, line=gpioLine)
+        stopped = threading.Event()
+        if self.model is not None:
+            threading.Thread(target=self.shake, args=(stopped, cycle, moveSecs), daemon=True).start()
+        started = time.monotonic()
+
+        def callback(timestamp, sample, state):
+            if state != callback.state:
+                print("%7.2f s %-6s %7.2f Hz" % (time.monotonic() - started, state, ctl.rate))
+                callback.state = state
+
+        callback.state = None
+        ctl.run(callback, duration)
+        stopped.set()
+        elapsed = time.monotonic() - started
+        stats = ctl.stats()
+        transfers = sum(s.calls for key, s in self.tracker.stats.items() if key[1] == "i2c_transfer")
+        steps = stats["steps"]["active"] + stats["steps"]["idle"]
+        fixed = profile.rates["active"] * elapsed
+        print("Idle %.0f%% of %.1f s, %d transitions" % (stats["idleShare"] * 100, elapsed, stats["transitions"]))
+        print("Wakeups %d (fixed %.0f, %.1fx fewer), bus transfers %d" % (steps, fixed, fixed / max(1, steps), transfers))
+        self.tracker.disable(self.i2c)
+        self.i2c.close(handle)
+        if gpioLine is not None:
+            gpioLine.release()
+            self.chip.close()
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--device", help="I2C device name (default '/dev/i2c-0')", type=str, default="/dev/i2c-0")
+    parser.add_argument("--driver", help="adxl345 or mpu6050 (default adxl345)", type=str, default="adxl345")
+    parser.add_argument("--address", help="Device address (default 0x53 ADXL345, 0x68 MPU-6050)", type=str)
+    parser.add_argument("--duration", help="Seconds to run (default 60)", type=float, default=60.0)
+    parser.add_argument("--sim", help="Use simulated device", action="store_true")
+    parser.add_argument("--chip", help="GPIO chip name for activity INT pin (default '/dev/gpiochip0')", type=str,
+                        default="/dev/gpiochip0")
+    parser.add_argument("--line", help="GPIO line number for activity INT pin (default none, poll flags)", type=int)
+    parser.add_argument("--int2", help="Route ADXL345 activity to INT2", action="store_true")
+    parser.add_argument("--cycle", help="Simulated motion cycle seconds (default 30)", type=float, default=30.0)
+    parser.add_argument("--move", help="Simulated motion seconds per cycle (default 3)", type=float, default=3.0)
+    args = parser.parse_args()
+    if args.address is None:
+        address = 0x53 if args.driver == "adxl345" else 0x68
+    else:
+        address = int(args.address, 16)
+    obj = adaptiverate(args.device, args.sim)
+    obj.main(args.driver, address, args.duration, args.cycle, args.move, args.chip, args.line, args.int2)
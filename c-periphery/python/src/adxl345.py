@@ -9,66 +9,192 @@ I'm using I2C to communicate with the ADXL345 although SPI is supported as
 well.
 """
 
-import sys, time
+import math, sys, time
 from argparse import *
 from cffi import FFI
-from libperiphery import libperipheryi2c
-from libgpiod import libgpiod
+from libperiphery import libperipheryi2c, regmap, samples
+
+# ADXL345 data sheet Rev. E, Table 19. Data is little endian and full
+# resolution keeps 3.9 mg/LSB at every range.
+registers = regmap.devicemap("adxl345", [
+    regmap.register("DEVID", 0x00),
+    # 62.5 mg/LSB, 1 s/LSB
+    regmap.register("THRESH_ACT", 0x24, scale=0.0625),
+    regmap.register("THRESH_INACT", 0x25, scale=0.0625),
+    regmap.register("TIME_INACT", 0x26),
+    regmap.register("ACT_INACT_CTL", 0x27),
+    regmap.register("BW_RATE", 0x2c, fields=[regmap.field("RATE", 0, 4), regmap.field("LOW_POWER", 4)]),
+    regmap.register("POWER_CTL", 0x2d, fields=[regmap.field("WAKEUP", 0, 2), regmap.field("SLEEP", 2),
+                                               regmap.field("MEASURE", 3), regmap.field("AUTO_SLEEP", 4),
+                                               regmap.field("LINK", 5)]),
+    regmap.register("INT_ENABLE", 0x2e, fields=[regmap.field("DATA_READY", 7), regmap.field("ACTIVITY", 4),
+                                                regmap.field("INACTIVITY", 3)]),
+    regmap.register("INT_MAP", 0x2f, fields=[regmap.field("DATA_READY", 7), regmap.field("ACTIVITY", 4),
+                                             regmap.field("INACTIVITY", 3)]),
+    regmap.register("INT_SOURCE", 0x30, readClear=True, fields=[regmap.field("DATA_READY", 7),
+                                                                regmap.field("ACTIVITY", 4),
+                                                                regmap.field("INACTIVITY", 3)]),
+    regmap.register("DATA_FORMAT", 0x31, fields=[regmap.field("RANGE", 0, 2), regmap.field("JUSTIFY", 2),
+                                                 regmap.field("FULL_RES", 3)]),
+    regmap.register("DATAX", 0x32, 2, True, "<", samples.ADXL345_SCALE),
+    regmap.register("DATAY", 0x34, 2, True, "<", samples.ADXL345_SCALE),
+    regmap.register("DATAZ", 0x36, 2, True, "<", samples.ADXL345_SCALE),
+])
+
+# One 6 byte burst from DATAX0
+DATA = ("DATAX", "DATAY", "DATAZ")
 
 
 class adxl345:
     
-    def __init__(self):
-        """Create library interface.
+    def __init__(self, i2c=None):
+        """Create library interface. i2c can be any libperipheryi2c compatible
+        object (shared bus client, simulated backend, etc.).
         """    
-        self.i2c = libperipheryi2c.libperipheryi2c()
-        self.gpiod = libgpiod.libgpiod()
-        self.lib = self.gpiod.lib
-        self.ffi = self.gpiod.ffi        
+        if i2c is None:
+            i2c = libperipheryi2c.libperipheryi2c()
+        self.i2c = i2c
+        # Compiled bursts per (handle, addr)
+        self.regs = regmap.regdriver(registers, i2c)
+        self.bursts = {}
+        # calibration.calibration per (handle, addr)
+        self.calibrations = {}
             
     def getRange(self, handle, addr):
         """Retrieve the current range of the accelerometer. See setRange for
         the possible range constant values that will be returned.
         """
-        return self.i2c.readReg(handle, addr, 0x31) & 0x03
+        return self.regs.getField(handle, addr, "DATA_FORMAT", "RANGE")
 
     def setRange(self, handle, addr, value):
         """Set the range of the accelerometer to the provided value. Read the data
         format register to preserve bits. Update the data rate, make sure that the
         FULL-RES bit is enabled for range scaling.
         """
-        regVal = self.i2c.readReg(handle, addr, 0x31) & ~0x0f
+        regVal = self.regs.readReg(handle, addr, "DATA_FORMAT") & ~0x0f
         regVal |= value
-        regVal |= 0x08  # FULL-RES bit enabled
+        regVal |= registers.fieldOf("DATA_FORMAT", "FULL_RES").mask
         # Write the updated format register
-        self.i2c.writeReg(handle, addr, 0x31, regVal)
+        self.regs.write(handle, addr, "DATA_FORMAT", regVal)
     
     def getDataRate(self, handle, addr):
         """Retrieve the current data rate.
         """
-        return self.i2c.readReg(handle, addr, 0x2c) & 0x0f
+        return self.regs.getField(handle, addr, "BW_RATE", "RATE")
     
     def setDataRate(self, handle, addr, rate):
         """Set the data rate of the accelerometer. Note: The LOW_POWER bits are
         currently ignored, we always keep the device in 'normal' mode.
         """
-        self.i2c.writeReg(handle, addr, 0x2c, rate & 0x0f)
+        self.regs.write(handle, addr, "BW_RATE", rate & 0x0f)
     
+    def setRate(self, handle, addr, hz):
+        """Nearest BW_RATE code to hz (0.1 to 3200 Hz, each code doubles the
+        rate) in normal mode. Returns the rate set.
+        """
+        code = max(0, min(15, int(round(15 + math.log2(max(hz, 0.1) / 3200.0)))))
+        self.setDataRate(handle, addr, code)
+        return 3200.0 / (1 << (15 - code))
+
+    def setLowPower(self, handle, addr, rate):
+        """Set data rate with LOW_POWER where the part supports it (12.5 to
+        400 Hz, codes 0x07 - 0x0c). Slower rates run in normal mode, which
+        already draws about as little.
+        """
+        rate &= 0x0f
+        if 0x07 <= rate <= 0x0c:
+            rate |= registers.fieldOf("BW_RATE", "LOW_POWER").mask
+        self.regs.write(handle, addr, "BW_RATE", rate)
+
+    def setActivityDetection(self, handle, addr, threshAct, threshInact, timeInact, int2=False):
+        """Enable AC coupled activity and inactivity detection on all axes.
+        Thresholds are in g (62.5 mg/LSB), timeInact in seconds. Other enabled
+        interrupts are kept.
+        """
+        self.regs.write(handle, addr, "THRESH_ACT", max(1, min(255, int(round(threshAct / 0.0625)))))
+        self.regs.write(handle, addr, "THRESH_INACT", max(1, min(255, int(round(threshInact / 0.0625)))))
+        self.regs.write(handle, addr, "TIME_INACT", max(0, min(255, int(round(timeInact)))))
+        # ACT ac/dc, ACT x/y/z, INACT ac/dc, INACT x/y/z all set
+        self.regs.write(handle, addr, "ACT_INACT_CTL", 0xff)
+        mask = registers.fieldOf("INT_ENABLE", "ACTIVITY").mask | registers.fieldOf("INT_ENABLE", "INACTIVITY").mask
+        intMap = self.regs.readReg(handle, addr, "INT_MAP") & ~mask
+        self.regs.write(handle, addr, "INT_MAP", intMap | mask if int2 else intMap)
+        self.regs.write(handle, addr, "INT_ENABLE", self.regs.readReg(handle, addr, "INT_ENABLE") | mask)
+
+    def getActivity(self, handle, addr):
+        """(activity, inactivity) since last call (reading INT_SOURCE clears
+        them).
+        """
+        source = self.regs.readReg(handle, addr, "INT_SOURCE")
+        return (bool(source & registers.fieldOf("INT_SOURCE", "ACTIVITY").mask),
+                bool(source & registers.fieldOf("INT_SOURCE", "INACTIVITY").mask))
+
+    def enableDataReady(self, handle, addr, int2=False):
+        """Enable DATA_READY interrupt on INT1 (or INT2 if int2 is True). The
+        interrupt is cleared when the data registers are read (see trigger.py).
+        """
+        dataReady = registers.fieldOf("INT_ENABLE", "DATA_READY").mask
+        # INT_MAP bit 7 routes DATA_READY to INT2
+        self.regs.write(handle, addr, "INT_MAP", dataReady if int2 else 0x00)
+        self.regs.write(handle, addr, "INT_ENABLE", dataReady)
+
+    def disableDataReady(self, handle, addr):
+        """Disable all interrupts.
+        """
+        self.regs.write(handle, addr, "INT_ENABLE", 0x00)
+
     def read(self, handle, addr):
         """Retrieve x, y, z 16 bit data in 6 bytes.
         """
-        retVal = self.i2c.readArray(handle, addr, 0x32, 6)
-        # Convert to tuple of 16 bit integers x, y, z
-        x = retVal[0] | (retVal[1] << 8)
-        if(x & (1 << 16 - 1)):
-            x = x - (1 << 16)
-        y = retVal[2] | (retVal[3] << 8)
-        if(y & (1 << 16 - 1)):
-            y = y - (1 << 16)
-        z = retVal[4] | (retVal[5] << 8)
-        if(z & (1 << 16 - 1)):
-            z = z - (1 << 16)    
-        return (x, y, z)
+        # Tuple of little endian 16 bit integers x, y, z
+        return self.burst(handle, addr).readRaw()
+
+    def setCalibration(self, handle, addr, calib):
+        """Correct every scaled read and readBatch with calib
+        (calibration.calibration, None to remove).
+        """
+        if calib is None:
+            self.calibrations.pop((handle, addr), None)
+            self.regs.setAffine(handle, addr, None)
+        else:
+            self.calibrations[(handle, addr)] = calib
+            self.regs.setAffine(handle, addr, calib.corrections(DATA))
+
+    def getCalibration(self, handle, addr):
+        return self.calibrations.get((handle, addr))
+
+    def burst(self, handle, addr):
+        """Compiled sample burst.
+        """
+        key = (handle, addr)
+        b = self.bursts.get(key)
+        if b is None:
+            b = self.regs.burst(handle, addr, DATA)
+            self.bursts[key] = b
+        return b
+
+    def reader(self, handle, addr):
+        """Block reader of the 6 byte data burst.
+        """
+        return self.burst(handle, addr).spans[0].reader
+
+    def readSample(self, handle, addr):
+        """Acceleration in g (full resolution, see setRange).
+        """
+        x, y, z = self.burst(handle, addr).read()
+        return samples.accelsample(time.monotonic_ns(), x, y, z)
+
+    def readBatch(self, handle, addr, batch, count=None, interval=0.0):
+        """Fill samplebatch (samples.acceldtype, block size 6) with count
+        samples (default capacity) and return the decoded samples.
+        """
+        if count is None:
+            count = batch.capacity
+        data = batch.data[:count]
+        self.reader(handle, addr).readInto(batch.raw, data["timestamp"], count, interval)
+        samples.decodeAdxl345(batch.raw[:count], out=data, calib=self.calibrations.get((handle, addr)))
+        batch.count = count
+        return data
 
     def waitForStable(self, handle, addr, maxReads, maxDiff, maxInRange, sleepTime):
         """Wait for unit to become stable or hit maxReads.
@@ -95,6 +221,11 @@ class adxl345:
         return count < maxReads, (curX, curY, curZ)        
 
     def main(self, device, address, chip, line):
+        # Status LED through the libgpiod CFFI bindings, only the demo needs them
+        from libgpiod import libgpiod
+        self.gpiod = libgpiod.libgpiod()
+        self.lib = self.gpiod.lib
+        self.ffi = self.gpiod.ffi
         print ("libgpiod version %s" % self.ffi.string(self.lib.gpiod_version_string()).decode('utf-8'))
         gpiod_chip = self.lib.gpiod_chip_open_by_number(chip)
         # Verify the chip was opened
@@ -108,9 +239,9 @@ class adxl345:
                 if self.lib.gpiod_line_request_output(gpiod_line, consumer.encode('utf-8'), 1) == 0:
                     handle = self.i2c.open(device)
                     # ADXL345 wired up on port 0x53?
-                    if self.i2c.readReg(handle, address, 0x00) == 0xe5:
+                    if self.regs.readReg(handle, address, "DEVID") == 0xe5:
                         # Enable the accelerometer
-                        self.i2c.writeReg(handle, address, 0x2d, 0x08)
+                        self.regs.write(handle, address, "POWER_CTL", registers.fieldOf("POWER_CTL", "MEASURE").mask)
                         # +/- 2g
                         self.setRange(handle, address, 0x00)
                         # 100 Hz
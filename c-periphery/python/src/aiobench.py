@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2018 Steven P. Goldsmith
+# See LICENSE.md for details.
+
+"""
+asyncio front end benchmark
+-------------
+Compares awaited operations/sec of the aio module against wrapping the
+blocking call in loop.run_in_executor. No hardware is needed.
+
+bus: simulated bus transfer on an aiobus vs run_in_executor.
+fd: pipe ping-pong waiting with add_reader vs a blocking os.read in the
+executor (models serial_read/event_wait).
+"""
+
+import asyncio, os, time
+from argparse import *
+from concurrent.futures import ThreadPoolExecutor
+from libperiphery import aio
+
+
+class aiobench:
+
+    def __init__(self, transferUs):
+        self.secs = transferUs / 1000000
+
+    def transfer(self):
+        """Simulated bus transfer.
+        """
+        if self.secs:
+            time.sleep(self.secs)
+        return b"\x00" * 6
+
+    async def busExecutor(self, loop, executor, ops, concurrency):
+        async def client(n):
+            for i in range(n):
+                await loop.run_in_executor(executor, self.transfer)
+        await asyncio.gather(*[client(ops // concurrency) for i in range(concurrency)])
+
+    async def busBatched(self, bus, ops, concurrency):
+        async def client(n):
+            for i in range(n):
+                await bus.submit(self.transfer)
+        await asyncio.gather(*[client(ops // concurrency) for i in range(concurrency)])
+
+    async def fdExecutor(self, loop, executor, ops):
+        r, w = os.pipe()
+        for i in range(ops):
+            os.write(w, b"x")
+            await loop.run_in_executor(executor, os.read, r, 1)
+        os.close(r)
+        os.close(w)
+
+    async def fdReader(self, loop, ops):
+        r, w = os.pipe()
+        for i in range(ops):
+            os.write(w, b"x")
+            await aio.readable(loop, r)
+            os.read(r, 1)
+        os.close(r)
+        os.close(w)
+
+    def timeit(self, loop, coro, ops):
+        start = time.perf_counter()
+        loop.run_until_complete(coro)
+        return ops / (time.perf_counter() - start)
+
+    def main(self, ops, concurrency):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        # One worker per bus to match aiobus, so only the hop and batching differ
+        executor = ThreadPoolExecutor(max_workers=1)
+        bus = aio.aiobus("bench", loop)
+        print("Ops: %d, concurrency: %d, transfer: %.0f us" % (ops, concurrency, self.secs * 1000000))
+        rate = self.timeit(loop, self.busExecutor(loop, executor, ops, concurrency), ops)
+        print("bus run_in_executor  %10.1f ops/sec" % rate)
+        rate = self.timeit(loop, self.busBatched(bus, ops, concurrency), ops)
+        print("bus aiobus           %10.1f ops/sec (%.1f calls/batch)" % (rate, bus.calls / max(1, bus.batches)))
+        rate = self.timeit(loop, self.fdExecutor(loop, executor, ops), ops)
+        print("fd run_in_executor   %10.1f ops/sec" % rate)
+        rate = self.timeit(loop, self.fdReader(loop, ops), ops)
+        print("fd add_reader        %10.1f ops/sec" % rate)
+        bus.close()
+        executor.shutdown()
+        loop.close()
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--ops", help="Operations per test (default 20000)", type=int, default=20000)
+    parser.add_argument("--concurrency", help="Concurrent coroutines for bus tests (default 8)", type=int, default=8)
+    parser.add_argument("--transfer_us", help="Simulated transfer time in us (default 0)", type=int, default=0)
+    args = parser.parse_args()
+    obj = aiobench(args.transfer_us)
+    obj.main(args.ops, args.concurrency)
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2018 Steven P. Goldsmith
+# See LICENSE.md for details.
+
+"""
+Peripheral broker benchmark
+-------------
+Starts a broker on simulated devices in another process and compares a 14
+byte MPU-6050 register read called directly, through the broker one request
+per read and batched, plus subscription delivery. Latency is per request. No
+hardware is needed.
+"""
+
+import multiprocessing, os, signal, tempfile, time
+from argparse import *
+from libperiphery import broker, instrument, libperipheryi2c, sim
+import brokerd
+
+
+def serve(path):
+    server = brokerd.simServer(path)
+    signal.signal(signal.SIGTERM, lambda signum, frame: server.stop())
+    server.serve()
+
+
+class brokerbench:
+
+    def __init__(self, path):
+        self.path = path
+
+    def measure(self, name, func, ops, opsPerCall=1):
+        hist = instrument.histogram()
+        func()
+        start = time.perf_counter()
+        for i in range(ops // opsPerCall):
+            t = time.perf_counter_ns()
+            func()
+            hist.record(time.perf_counter_ns() - t)
+        elapsed = time.perf_counter() - start
+        print("%-26s %12.1f ops/sec  p50 %8.1f us  p99 %8.1f us" % (name, ops / elapsed, hist.percentile(50) / 1000,
+                                                                    hist.percentile(99) / 1000))
+
+    def main(self, ops, batchSize, rate, secs):
+        i2cLib = sim.i2clib()
+        i2cLib.add("/dev/i2c-0", 0x68, sim.mpu6050model())
+        i2c = libperipheryi2c.libperipheryi2c(lib=i2cLib)
+        handle = i2c.open("/dev/i2c-0")
+        self.measure("direct readArray", lambda: i2c.readArray(handle, 0x68, 0x3b, 14), ops)
+        i2c.close(handle)
+        c = broker.client(self.path)
+        h = c.openI2c("/dev/i2c-0")
+        c.i2cWrite(h, 0x68, 0x6b, b"\x00")
+        self.measure("broker i2cRead", lambda: c.i2cRead(h, 0x68, 0x3b, 14), ops)
+        b = c.batch()
+        for i in range(batchSize):
+            b.i2cRead(h, 0x68, 0x3b, 14)
+        self.measure("broker batch of %d" % batchSize, b.execute, ops, batchSize)
+        sub = c.subscribeI2c(h, 0x68, 0x3b, 14, rate)
+        count = 0
+        hist = instrument.histogram()
+        end = time.monotonic() + secs
+        while time.monotonic() < end:
+            frame = c.receive(0.1)
+            if frame:
+                for timestamp, data in frame[1]:
+                    hist.record(max(0, time.monotonic_ns() - timestamp))
+                    count += 1
+        c.unsubscribe(sub)
+        print("%-26s %12.1f samples/sec (asked %d)  p50 %6.1f us  p99 %6.1f us" % ("broker subscription", count / secs, rate,
+              hist.percentile(50) / 1000, hist.percentile(99) / 1000))
+        c.close(h)
+        c.close()
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--ops", help="Reads per measurement (default 20000)", type=int, default=20000)
+    parser.add_argument("--batch", help="Reads per batched request (default 16)", type=int, default=16)
+    parser.add_argument("--rate", help="Subscription rate in Hz (default 1000)", type=int, default=1000)
+    parser.add_argument("--secs", help="Subscription seconds (default 2.0)", type=float, default=2.0)
+    args = parser.parse_args()
+    path = os.path.join(tempfile.mkdtemp(), "broker.sock")
+    proc = multiprocessing.Process(target=serve, args=(path,), daemon=True)
+    proc.start()
+    while not os.path.exists(path):
+        time.sleep(0.01)
+    try:
+        brokerbench(path).main(args.ops, args.batch, args.rate, args.secs)
+    finally:
+        proc.terminate()
+        proc.join()
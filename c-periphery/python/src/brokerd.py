@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2018 Steven P. Goldsmith
+# See LICENSE.md for details.
+
+"""
+Peripheral broker daemon
+-------------
+Owns the I2C, SPI, serial, GPIO and PWM handles and serves them to clients
+over a Unix domain socket (see libperiphery/broker.py). --sim serves simulated
+MPU-6050 (0x68) and ADXL345 (0x53) on /dev/i2c-0 and loopback SPI instead of
+hardware.
+"""
+
+import signal
+from argparse import *
+from libperiphery import broker, libperipheryi2c, libperipheryspi, libperipheryserial, sim
+
+
+def simServer(path):
+    """Broker on simulated devices.
+    """
+    i2cLib = sim.i2clib()
+    i2cLib.add("/dev/i2c-0", 0x68, sim.mpu6050model())
+    i2cLib.add("/dev/i2c-0", 0x53, sim.adxl345model())
+    return broker.server(path, i2c=libperipheryi2c.libperipheryi2c(lib=i2cLib),
+                         spi=libperipheryspi.libperipheryspi(lib=sim.spilib()),
+                         serial=libperipheryserial.libperipheryserial(lib=sim.seriallib()))
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--socket", help="Unix socket path (default %s)" % broker.DEFAULT_PATH, type=str, default=broker.DEFAULT_PATH)
+    parser.add_argument("--sim", help="Serve simulated devices", action="store_true")
+    args = parser.parse_args()
+    if args.sim:
+        server = simServer(args.socket)
+    else:
+        server = broker.server(args.socket)
+    signal.signal(signal.SIGTERM, lambda signum, frame: server.stop())
+    signal.signal(signal.SIGINT, lambda signum, frame: server.stop())
+    server.serve()
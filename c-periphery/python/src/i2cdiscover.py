@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2018 Steven P. Goldsmith
+# See LICENSE.md for details.
+
+"""
+I2C discovery
+-------------
+Scan all /dev/i2c-* buses in parallel and identify devices by WHO_AM_I. The
+result is cached, so only buses that changed, lost a cached device or are older
+than --max_age are probed on the next run.
+"""
+
+import time
+from argparse import *
+from libperiphery import discovery
+
+
+class i2cdiscover:
+
+    def main(self, cachePath, force, maxAge):
+        d = discovery.discovery(cachePath=cachePath, maxAge=maxAge)
+        start = time.perf_counter()
+        devices = d.scan(force)
+        print("Scanned %d buses in %.3f seconds" % (len(devices), time.perf_counter() - start))
+        for path, found in devices.items():
+            for addr, name in sorted(found.items()):
+                print("%s 0x%02x %s" % (path, addr, name or "unknown"))
+        for path, error in d.failed.items():
+            print("%s failed: %s" % (path, error))
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--cache", help="Cache file (default %s)" % discovery.DEFAULT_CACHE, type=str, default=discovery.DEFAULT_CACHE)
+    parser.add_argument("--force", help="Probe all buses even if cached", action="store_true")
+    parser.add_argument("--max_age", help="Seconds a cached bus is trusted (default 86400)", type=float, default=86400.0)
+    args = parser.parse_args()
+    obj = i2cdiscover()
+    obj.main(args.cache, args.force, args.max_age)
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2018 Steven P. Goldsmith
+# See LICENSE.md for details.
+
+"""
+IMU calibration demo
+-------------
+Calibrates an MPU-6050 or ADXL345 through libperiphery.calibration and caches
+the result. The first run samples the device (keep it still and level), later
+runs load the cached calibration. --poses asks for six orientations to fit
+accel scale as well as offset. --sim uses a simulated device with known bias.
+"""
+
+import time
+from argparse import *
+import numpy as np
+from libperiphery import calibration, libperipheryi2c, samples, sim
+from mpu6050 import mpu6050
+from adxl345 import adxl345
+
+# Name and gravity direction in device axes
+POSES = (("Z up", (0, 0, 1)), ("Z down", (0, 0, -1)), ("X up", (1, 0, 0)), ("X down", (-1, 0, 0)),
+         ("Y up", (0, 1, 0)), ("Y down", (0, -1, 0)))
+# Simulated accel offset and gain (g)
+SIM_OFFSET = (0.05, -0.03, 0.02)
+SIM_GAIN = (1.02, 0.97, 1.01)
+
+
+class imucalibrate:
+
+    def __init__(self, device, simulated):
+        self.simLib = None
+        self.model = None
+        if simulated:
+            self.simLib = sim.i2clib()
+            self.i2c = libperipheryi2c.libperipheryi2c(lib=self.simLib)
+        else:
+            self.i2c = libperipheryi2c.libperipheryi2c()
+        self.device = device
+
+    def open(self, driver, address):
+        if self.simLib is not None:
+            if driver == "adxl345":
+                self.model = sim.adxl345model(noise=0.002)
+            else:
+                self.model = sim.mpu6050model(gyro=(1.5, -0.7, 0.2), noise=0.002)
+            self.turn((0, 0, 1))
+            self.simLib.add(self.device, address, self.model)
+        handle = self.i2c.open(self.device)
+        if driver == "adxl345":
+            dev = adxl345(self.i2c)
+            # Measure, full resolution +/- 2g
+            self.i2c.writeReg(handle, address, 0x2d, 0x08)
+            dev.setRange(handle, address, 0x00)
+        else:
+            dev = mpu6050(self.i2c)
+            # Wake up
+            self.i2c.writeReg(handle, address, 0x6b, 0x00)
+        return dev, handle
+
+    def turn(self, gravity):
+        """Point the simulated device's gravity vector and let the output data
+        rate catch up.
+        """
+        self.model.accel = [g * gain + offset for g, gain, offset in zip(gravity, SIM_GAIN, SIM_OFFSET)]
+        time.sleep(0.1)
+
+    def poses(self, dev, handle, address, count, interval):
+        """Mean accel of each pose, the device is turned by hand.
+        """
+        means = []
+        for name, gravity in POSES:
+            if self.model is not None:
+                self.turn(gravity)
+            else:
+                input("Hold the device still %s and press Enter " % name)
+            data = calibration.collect(dev, handle, address, count, interval)
+            means.append(data["accel"].mean(axis=0))
+        if self.model is not None:
+            self.turn((0, 0, 1))
+        return np.array(means)
+
+    def main(self, driver, address, cachePath, count, interval, force, poses):
+        dev, handle = self.open(driver, address)
+        start = time.monotonic()
+        if poses:
+            calib = calibration.calibrate(dev, handle, address, count, interval,
+                                          poses=self.poses(dev, handle, address, count, interval))
+            calibration.cache(cachePath).put(dev.regs.map.name, self.device, address, calib,
+                                             calibration.identity(dev, handle, address))
+            dev.setCalibration(handle, address, calib)
+        else:
+            calib = calibration.startup(dev, self.device, handle, address, cachePath, count, interval, force)
+        print("%s in %.3f s" % (calib, time.monotonic() - start))
+        batchSize = 200
+        if driver == "adxl345":
+            batch = samples.samplebatch(samples.acceldtype, 6, batchSize)
+        else:
+            batch = samples.samplebatch(samples.imudtype, 14, batchSize)
+        data = dev.readBatch(handle, address, batch, interval=interval)
+        accel = data["accel"].mean(axis=0)
+        print("Corrected accel mean x: %+.4f, y: %+.4f, z: %+.4f g" % tuple(accel))
+        if "gyro" in data.dtype.names:
+            print("Corrected gyro mean  x: %+.4f, y: %+.4f, z: %+.4f º/s" % tuple(data["gyro"].mean(axis=0)))
+        self.i2c.close(handle)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--device", help="I2C device name (default '/dev/i2c-0')", type=str, default="/dev/i2c-0")
+    parser.add_argument("--driver", help="mpu6050 or adxl345 (default mpu6050)", type=str, default="mpu6050")
+    parser.add_argument("--address", help="Device address (default 0x68 MPU-6050, 0x53 ADXL345)", type=str)
+    parser.add_argument("--cache", help="Calibration cache (default %s)" % calibration.DEFAULT_CACHE, type=str,
+                        default=calibration.DEFAULT_CACHE)
+    parser.add_argument("--count", help="Samples per batch (default 500)", type=int, default=500)
+    parser.add_argument("--interval", help="Seconds between samples (default 0.002)", type=float, default=0.002)
+    parser.add_argument("--force", help="Calibrate even if cached", action="store_true")
+    parser.add_argument("--poses", help="Fit accel scale from six orientations", action="store_true")
+    parser.add_argument("--sim", help="Use simulated device", action="store_true")
+    args = parser.parse_args()
+    if args.address is None:
+        address = 0x53 if args.driver == "adxl345" else 0x68
+    else:
+        address = int(args.address, 16)
+    obj = imucalibrate(args.device, args.sim)
+    obj.main(args.driver, address, args.cache, args.count, args.interval, args.force, args.poses)
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2018 Steven P. Goldsmith
+# See LICENSE.md for details.
+
+"""
+Parallel multi-bus acquisition
+-------------
+
+One worker thread per bus (/dev/i2c-0, /dev/i2c-1, /dev/spidev1.0, etc.) runs
+the periodic reads for the devices on that bus. CFFI releases the GIL while a
+C function runs, so transfers on different buses overlap and throughput scales
+with the number of buses.
+
+Each worker produces samples in timestamp order, so merge() only has to
+interleave per bus queues up to the oldest worker's progress (watermark) to
+give one ordered stream.
+"""
+
+import collections, heapq, threading, time
+
+
+class task:
+    """Periodic read of one device.
+    """
+
+    def __init__(self, name, read, rate, decode=None):
+        """read is an object with execute() (i.e. trigger.i2cread) or a
+        callable. rate is reads per second, 0 = as fast as possible (free
+        running tasks on one bus take turns).
+        """
+        self.name = name
+        if hasattr(read, "execute"):
+            self.read = read.execute
+        else:
+            self.read = read
+        self.rate = rate
+        if rate > 0:
+            self.period = int(1000000000 / rate)
+        else:
+            self.period = 0
+        self.decode = decode
+        self.due = 0
+        self.count = 0
+        self.errors = 0
+        self.overruns = 0
+        # Thread CPU time spent in read and decode
+        self.cpuNs = 0
+
+
+class worker:
+    """Runs all tasks for one bus on its own thread.
+    """
+
+    def __init__(self, bus, maxQueue):
+        self.bus = bus
+        self.tasks = []
+        self.queue = collections.deque(maxlen=maxQueue)
+        # Every sample this worker produces from now on is newer than this
+        self.latest = 0
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def run(self):
+        tasks = self.tasks
+        queue = self.queue
+        now = time.monotonic_ns
+        cpu = time.thread_time_ns
+        start = now()
+        for t in tasks:
+            t.due = start
+        while not self.stopped.is_set():
+            # Earliest due task
+            t = min(tasks, key=lambda t: t.due)
+            current = now()
+            if t.due > current:
+                self.latest = current
+                time.sleep((t.due - current) / 1000000000)
+                current = now()
+            elif t.period and current - t.due > t.period:
+                # Missed at least one period
+                t.overruns += 1
+                t.due = current
+            cpuStart = cpu()
+            try:
+                data = t.read()
+            except RuntimeError:
+                t.errors += 1
+                t.due = t.due + t.period if t.period else current
+                t.cpuNs += cpu() - cpuStart
+                continue
+            if t.decode:
+                data = t.decode(data)
+            t.cpuNs += cpu() - cpuStart
+            t.count += 1
+            # Free running tasks go behind every other due task on the bus
+            t.due = t.due + t.period if t.period else current
+            queue.append((current, t.name, data))
+            self.latest = current
+
+    def start(self):
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run, name="acq-%s" % self.bus, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+
+class acquisition:
+    """Multi-bus acquisition engine.
+    """
+
+    def __init__(self, maxQueue=100000):
+        """maxQueue limits samples buffered per bus if merge() is not called
+        often enough (oldest are dropped).
+        """
+        self.maxQueue = maxQueue
+        self.workers = collections.OrderedDict()
+        self.startedAt = 0
+        self.stoppedAt = 0
+
+    def add(self, bus, name, read, rate, decode=None):
+        """Add periodic read of device name on bus.
+        """
+        w = self.workers.get(bus)
+        if w is None:
+            w = worker(bus, self.maxQueue)
+            self.workers[bus] = w
+        t = task(name, read, rate, decode)
+        w.tasks.append(t)
+        return t
+
+    def start(self):
+        self.startedAt = time.monotonic_ns()
+        self.stoppedAt = 0
+        for w in self.workers.values():
+            w.start()
+
+    def stop(self):
+        for w in self.workers.values():
+            w.stop()
+        self.stoppedAt = time.monotonic_ns()
+
+    def merge(self, final=False):
+        """Return list of (timestamp, name, data) in timestamp order. Only
+        samples no newer than every worker's progress are returned unless final
+        is True (use after stop()).
+        """
+        workers = list(self.workers.values())
+        if not workers:
+            # Nothing periodic (i.e. only triggered devices)
+            return []
+        if final:
+            watermark = None
+        else:
+            watermark = min(w.latest for w in workers)
+        streams = []
+        for w in workers:
+            queue = w.queue
+            out = []
+            while queue and (watermark is None or queue[0][0] <= watermark):
+                out.append(queue.popleft())
+            streams.append(out)
+        return list(heapq.merge(*streams, key=lambda s: s[0]))
+
+    def stats(self):
+        """Per device count, errors, overruns, achieved rate and CPU share
+        (fraction of one core spent in read and decode).
+        """
+        result = {}
+        end = self.stoppedAt or time.monotonic_ns()
+        elapsedNs = max(1, end - self.startedAt)
+        elapsed = elapsedNs / 1000000000
+        for w in self.workers.values():
+            for t in w.tasks:
+                result[t.name] = {"bus": w.bus, "count": t.count, "errors": t.errors, "overruns": t.overruns,
+                                  "rate": t.count / elapsed, "cpu": t.cpuNs / elapsedNs}
+        return result
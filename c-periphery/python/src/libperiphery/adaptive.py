@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2018 Steven P. Goldsmith
+# See LICENSE.md for details.
+
+"""
+Activity adaptive output data rate
+-------------
+
+Runs an accelerometer fast while it moves and slow, in its low power mode,
+while it is idle. Two signals decide the state:
+
+* the sensor's own activity/inactivity (ADXL345) or motion (MPU-6050)
+  interrupt flags
+* variance of the acceleration magnitude over a short window
+
+Going active is immediate (hardware activity or variance over activeVar).
+Going idle needs hardware inactivity or variance under idleVar for idleSecs,
+and never sooner than minActiveSecs after going active, so a signal near one
+threshold does not flap between rates:
+
+    adxl = adxl345.adxl345(i2c)
+    profile = adaptive.adxl345profile(adxl, handle, 0x53)
+    ctl = adaptive.controller(profile)
+    ctl.run(callback, 60.0)
+
+The loop sleeps one sample period per step, so bus transfers and wakeups
+follow the current rate (100 Hz -> 12.5 Hz low power by default is 8x fewer).
+Pass the sensor's activity interrupt as a gpiod line requested for rising edge
+events and the flags are only read when it fires, so each step is one sample
+transfer. Without it the flags are polled every eventSecs:
+
+    ctl = adaptive.controller(profile, line=line)
+"""
+
+import collections, math, time
+
+ACTIVE = "active"
+IDLE = "idle"
+
+
+def adxl345Rate(code):
+    """BW_RATE code to Hz.
+    """
+    return 3200.0 / (1 << (0x0f - (code & 0x0f)))
+
+
+class adxl345profile:
+    """ADXL345 rates and activity detection. Rates are BW_RATE codes (0x0a =
+    100 Hz, 0x07 = 12.5 Hz, the slowest with LOW_POWER), thresholds in g and
+    timeInact in seconds.
+    """
+
+    def __init__(self, driver, handle, addr, activeRate=0x0a, idleRate=0x07, threshAct=0.1875, threshInact=0.125,
+                 timeInact=5, int2=False):
+        self.driver = driver
+        self.handle = handle
+        self.addr = addr
+        self.activeRate = activeRate
+        self.idleRate = idleRate
+        self.threshAct = threshAct
+        self.threshInact = threshInact
+        self.timeInact = timeInact
+        self.int2 = int2
+        self.rates = {ACTIVE: adxl345Rate(activeRate), IDLE: adxl345Rate(idleRate)}
+
+    def configure(self):
+        self.driver.setActivityDetection(self.handle, self.addr, self.threshAct, self.threshInact, self.timeInact,
+                                         self.int2)
+
+    def setActive(self):
+        self.driver.setDataRate(self.handle, self.addr, self.activeRate)
+
+    def setIdle(self):
+        self.driver.setLowPower(self.handle, self.addr, self.idleRate)
+
+    def events(self):
+        """(activity, inactivity) flags from the sensor.
+        """
+        return self.driver.getActivity(self.handle, self.addr)
+
+    def read(self):
+        """(x, y, z) in g.
+        """
+        sample = self.driver.readSample(self.handle, self.addr)
+        return (sample.x, sample.y, sample.z)
+
+
+class mpu6050profile:
+    """MPU-6050 at activeRate Hz (nearest SMPLRT_DIV) when active and
+    accelerometer only cycle mode when idle (wakeCtrl is LP_WAKE_CTRL).
+    Threshold is in g and duration in ms. The part has a motion but no
+    inactivity interrupt, so idle comes from variance only.
+    """
+
+    # LP_WAKE_CTRL 0 - 3
+    wakeRates = (1.25, 5.0, 20.0, 40.0)
+
+    def __init__(self, driver, handle, addr, activeRate=200.0, wakeCtrl=1, threshold=0.04, duration=1):
+        self.driver = driver
+        self.handle = handle
+        self.addr = addr
+        self.activeRate = activeRate
+        self.wakeCtrl = wakeCtrl
+        self.threshold = threshold
+        self.duration = duration
+        self.rates = {ACTIVE: activeRate, IDLE: self.wakeRates[wakeCtrl]}
+
+    def configure(self):
+        self.driver.enableMotionDetect(self.handle, self.addr, self.threshold, self.duration)
+
+    def setActive(self):
+        self.driver.setNormalMode(self.handle, self.addr)
+        gyroRate = self.driver.getGyroRate(self.handle, self.addr)
+        div = max(0, min(255, int(round(gyroRate / self.activeRate)) - 1))
+        self.driver.setSampleRate(self.handle, self.addr, div)
+        self.rates[ACTIVE] = gyroRate / (1 + div)
+
+    def setIdle(self):
+        self.driver.setCycleMode(self.handle, self.addr, self.wakeCtrl)
+
+    def events(self):
+        return (self.driver.motionDetected(self.handle, self.addr), False)
+
+    def read(self):
+        sample = self.driver.readSample(self.handle, self.addr)
+        return (sample.ax, sample.ay, sample.az)
+
+
+class controller:
+    """Adaptive rate state machine for a profile. Variances are of the
+    acceleration magnitude in g^2 over window samples, activeVar must be above
+    idleVar. Sensor flags are read when line (the activity interrupt, optional)
+    has an edge or else every eventSecs.
+    """
+
+    def __init__(self, profile, window=32, activeVar=0.0004, idleVar=0.0001, idleSecs=5.0, minActiveSecs=2.0,
+                 eventSecs=0.5, line=None):
+        if activeVar <= idleVar:
+            raise ValueError("activeVar must be greater than idleVar")
+        self.profile = profile
+        self.window = window
+        self.activeVar = activeVar
+        self.idleVar = idleVar
+        self.idleSecs = idleSecs
+        self.minActiveSecs = minActiveSecs
+        self.eventSecs = eventSecs
+        self.line = line
+        self.interrupted = False
+        self.magnitudes = collections.deque()
+        self.sum = 0.0
+        self.sumSquares = 0.0
+        self.state = None
+        self.changedAt = 0.0
+        self.quietSince = None
+        self.eventsAt = 0.0
+        self.steps = {ACTIVE: 0, IDLE: 0}
+        self.seconds = {ACTIVE: 0.0, IDLE: 0.0}
+        self.transitions = 0
+
+    def start(self):
+        """Configure detection and start active.
+        """
+        self.profile.configure()
+        # Clear latched flags so the interrupt line can see the next edge
+        self.profile.events()
+        self.enter(ACTIVE, time.monotonic())
+
+    def enter(self, state, now):
+        if state == ACTIVE:
+            self.profile.setActive()
+        else:
+            self.profile.setIdle()
+        if self.state is not None:
+            self.seconds[self.state] += now - self.changedAt
+            self.transitions += 1
+        self.state = state
+        self.changedAt = now
+        self.quietSince = None
+        # Variance restarts at the new rate
+        self.magnitudes.clear()
+        self.sum = 0.0
+        self.sumSquares = 0.0
+
+    @property
+    def rate(self):
+        return self.profile.rates[self.state]
+
+    @property
+    def period(self):
+        return 1.0 / self.profile.rates[self.state]
+
+    def variance(self):
+        """Magnitude variance over the window, None until it is full.
+        """
+        n = len(self.magnitudes)
+        if n < self.window:
+            return None
+        mean = self.sum / n
+        return max(0.0, self.sumSquares / n - mean * mean)
+
+    def add(self, x, y, z):
+        magnitude = math.sqrt(x * x + y * y + z * z)
+        self.magnitudes.append(magnitude)
+        self.sum += magnitude
+        self.sumSquares += magnitude * magnitude
+        if len(self.magnitudes) > self.window:
+            old = self.magnitudes.popleft()
+            self.sum -= old
+            self.sumSquares -= old * old
+
+    def update(self, sample, now=None):
+        """Feed one (x, y, z) sample in g and change state if needed. Returns
+        True on a state change.
+        """
+        if now is None:
+            now = time.monotonic()
+        self.steps[self.state] += 1
+        self.add(*sample)
+        activity = inactivity = False
+        if self.line is not None:
+            if self.interrupted:
+                self.interrupted = False
+                activity, inactivity = self.profile.events()
+        elif now - self.eventsAt >= self.eventSecs:
+            activity, inactivity = self.profile.events()
+            self.eventsAt = now
+        variance = self.variance()
+        if self.state == IDLE:
+            if activity or (variance is not None and variance > self.activeVar):
+                self.enter(ACTIVE, now)
+                return True
+            return False
+        if now - self.changedAt < self.minActiveSecs:
+            return False
+        if variance is not None and variance < self.idleVar:
+            if self.quietSince is None:
+                self.quietSince = now
+        else:
+            self.quietSince = None
+        if inactivity or (self.quietSince is not None and now - self.quietSince >= self.idleSecs):
+            self.enter(IDLE, now)
+            return True
+        return False
+
+    def step(self):
+        """Read and feed one sample. Returns the (x, y, z) sample.
+        """
+        sample = self.profile.read()
+        self.update(sample)
+        return sample
+
+    def wait(self, delay):
+        """Sleep delay seconds. Returns early if the interrupt line has an
+        edge.
+        """
+        if self.line is None:
+            time.sleep(delay)
+            return
+        sec = int(delay)
+        if self.line.event_wait(sec=sec, nsec=int((delay - sec) * 1000000000)):
+            self.line.event_read()
+            self.interrupted = True
+
+    def run(self, callback=None, duration=0.0):
+        """Sample at the current rate until duration seconds pass (0 = until
+        Ctrl-C). callback(timestamp, sample, state) gets every sample.
+        """
+        if self.state is None:
+            self.start()
+        end = time.monotonic() + duration if duration else None
+        due = time.monotonic()
+        try:
+            while end is None or due < end:
+                sample = self.step()
+                if callback:
+                    callback(time.monotonic_ns(), sample, self.state)
+                due += self.period
+                delay = due - time.monotonic()
+                if delay > 0:
+                    self.wait(delay)
+                    if self.interrupted:
+                        # Step now so activity is seen without waiting a period
+                        due = time.monotonic()
+                else:
+                    due = time.monotonic()
+        except KeyboardInterrupt:
+            pass
+
+    def stats(self):
+        """Time, steps and share of time per state.
+        """
+        now = time.monotonic()
+        seconds = dict(self.seconds)
+        if self.state is not None:
+            seconds[self.state] += now - self.changedAt
+        total = max(1e-9, sum(seconds.values()))
+        return {"state": self.state, "transitions": self.transitions, "steps": dict(self.steps),
+                "seconds": seconds, "idleShare": seconds[IDLE] / total}
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2018 Steven P. Goldsmith
+# See LICENSE.md for details.
+
+"""
+Incremental windowed aggregation
+-------------
+
+Reduce a sample stream (timestamps ns, N x channels values) to min, max, mean,
+RMS and count per time window without keeping the window's samples:
+
+    agg = aggregate.tumbling(1000000000, channels=7, sink=producer.write)
+    agg.update(timestamps, values)
+
+tumbling keeps one running state and reduces each batch with reduceat.
+sliding splits time into hop sized panes, keeps running sums over the panes in
+the window and monotonic deques of pane min/max, so each update is O(1)
+amortized per pane.
+"""
+
+import collections
+import numpy as np
+
+
+def summarydtype(channels):
+    return np.dtype([("start", "<i8"), ("end", "<i8"), ("count", "<i8"), ("min", "<f4", (channels,)),
+                     ("max", "<f4", (channels,)), ("mean", "<f4", (channels,)), ("rms", "<f4", (channels,))])
+
+
+class tumbling:
+    """Fixed, non overlapping windows of width ns aligned to multiples of
+    width.
+    """
+
+    def __init__(self, width, channels=1, sink=None):
+        """sink is called with each non empty array of closed windows.
+        """
+        self.width = int(width)
+        self.channels = channels
+        self.sink = sink
+        self.dtype = summarydtype(channels)
+        self.id = None
+        self.count = 0
+        self.min = np.full(channels, np.inf)
+        self.max = np.full(channels, -np.inf)
+        self.sum = np.zeros(channels)
+        self.sumsq = np.zeros(channels)
+
+    def reduce(self, timestamps, values):
+        """Window ids and per window count, min, max, sum, sum of squares for
+        batch.
+        """
+        ids = timestamps // self.width
+        starts = np.flatnonzero(np.diff(ids)) + 1
+        starts = np.concatenate(([0], starts))
+        counts = np.diff(np.append(starts, len(ids)))
+        return (ids[starts], counts, np.minimum.reduceat(values, starts, axis=0),
+                np.maximum.reduceat(values, starts, axis=0), np.add.reduceat(values, starts, axis=0),
+                np.add.reduceat(values * values, starts, axis=0))
+
+    def panes(self, timestamps, values):
+        """Merge batch into running state and return closed windows as
+        (ids, counts, mins, maxs, sums, sumsqs).
+        """
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        values = np.asarray(values, dtype=np.float64).reshape(-1, self.channels)
+        if len(timestamps) == 0:
+            return None
+        ids, counts, mins, maxs, sums, sumsqs = self.reduce(timestamps, values)
+        if self.id is not None:
+            if ids[0] == self.id:
+                # First segment continues the open window
+                counts[0] += self.count
+                np.minimum(mins[0], self.min, out=mins[0])
+                np.maximum(maxs[0], self.max, out=maxs[0])
+                sums[0] += self.sum
+                sumsqs[0] += self.sumsq
+            else:
+                ids = np.concatenate(([self.id], ids))
+                counts = np.concatenate(([self.count], counts))
+                mins = np.vstack((self.min, mins))
+                maxs = np.vstack((self.max, maxs))
+                sums = np.vstack((self.sum, sums))
+                sumsqs = np.vstack((self.sumsq, sumsqs))
+        # Last segment stays open
+        self.id = int(ids[-1])
+        self.count = int(counts[-1])
+        self.min = mins[-1].copy()
+        self.max = maxs[-1].copy()
+        self.sum = sums[-1].copy()
+        self.sumsq = sumsqs[-1].copy()
+        return ids[:-1], counts[:-1], mins[:-1], maxs[:-1], sums[:-1], sumsqs[:-1]
+
+    def summaries(self, starts, width, counts, mins, maxs, sums, sumsqs):
+        result = np.empty(len(counts), dtype=self.dtype)
+        result["start"] = starts
+        result["end"] = starts + width
+        result["count"] = counts
+        result["min"] = mins
+        result["max"] = maxs
+        result["mean"] = sums / counts[:, None]
+        result["rms"] = np.sqrt(sumsqs / counts[:, None])
+        if self.sink is not None and len(result):
+            self.sink(result)
+        return result
+
+    def update(self, timestamps, values):
+        """Add batch and return closed windows.
+        """
+        closed = self.panes(timestamps, values)
+        if closed is None:
+            return np.empty(0, dtype=self.dtype)
+        ids, counts, mins, maxs, sums, sumsqs = closed
+        return self.summaries(ids * self.width, self.width, counts, mins, maxs, sums, sumsqs)
+
+    def flush(self):
+        """Close and return the open window.
+        """
+        if self.id is None:
+            return np.empty(0, dtype=self.dtype)
+        result = self.summaries(np.array([self.id * self.width]), self.width, np.array([self.count]),
+                                self.min[None], self.max[None], self.sum[None], self.sumsq[None])
+        self.id = None
+        return result
+
+
+class sliding(tumbling):
+    """Windows of width ns emitted every hop ns (width a multiple of hop).
+    """
+
+    def __init__(self, width, hop, channels=1, sink=None):
+        if width % hop:
+            raise ValueError("width must be a multiple of hop")
+        tumbling.__init__(self, hop, channels, sink)
+        self.panesPerWindow = width // hop
+        self.windowWidth = int(width)
+        # (pane id, count, sum, sumsq) in window and running totals
+        self.window = collections.deque()
+        self.windowCount = 0
+        self.windowSum = np.zeros(channels)
+        self.windowSumsq = np.zeros(channels)
+        # Monotonic deques of (pane id, value) per channel
+        self.mins = [collections.deque() for i in range(channels)]
+        self.maxs = [collections.deque() for i in range(channels)]
+
+    def push(self, id, count, mins, maxs, s, sq):
+        """Add closed pane and evict panes that left the window.
+        """
+        oldest = id - self.panesPerWindow
+        window = self.window
+        while window and window[0][0] <= oldest:
+            old = window.popleft()
+            self.windowCount -= old[1]
+            self.windowSum -= old[2]
+            self.windowSumsq -= old[3]
+        window.append((id, count, s, sq))
+        self.windowCount += count
+        self.windowSum += s
+        self.windowSumsq += sq
+        for c in range(self.channels):
+            low = self.mins[c]
+            value = mins[c]
+            while low and low[-1][1] >= value:
+                low.pop()
+            low.append((id, value))
+            while low[0][0] <= oldest:
+                low.popleft()
+            high = self.maxs[c]
+            value = maxs[c]
+            while high and high[-1][1] <= value:
+                high.pop()
+            high.append((id, value))
+            while high[0][0] <= oldest:
+                high.popleft()
+
+    def update(self, timestamps, values):
+        """Add batch and return one summary per closed pane (window ending at
+        the pane's end).
+        """
+        closed = self.panes(timestamps, values)
+        if closed is None or len(closed[0]) == 0:
+            return np.empty(0, dtype=self.dtype)
+        ids, counts, mins, maxs, sums, sumsqs = closed
+        n = len(ids)
+        outCounts = np.empty(n, dtype=np.int64)
+        outMins = np.empty((n, self.channels))
+        outMaxs = np.empty((n, self.channels))
+        outSums = np.empty((n, self.channels))
+        outSumsqs = np.empty((n, self.channels))
+        for i in range(n):
+            self.push(int(ids[i]), int(counts[i]), mins[i].tolist(), maxs[i].tolist(), sums[i], sumsqs[i])
+            outCounts[i] = self.windowCount
+            outMins[i] = [low[0][1] for low in self.mins]
+            outMaxs[i] = [high[0][1] for high in self.maxs]
+            outSums[i] = self.windowSum
+            outSumsqs[i] = self.windowSumsq
+        starts = (ids + 1) * self.width - self.windowWidth
+        return self.summaries(starts, self.windowWidth, outCounts, outMins, outMaxs, outSums, outSumsqs)
+
+    def flush(self):
+        """Sliding windows are only emitted on pane close, the open pane is
+        dropped.
+        """
+        self.id = None
+        return np.empty(0, dtype=self.dtype)
@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2018 Steven P. Goldsmith
+# See LICENSE.md for details.
+
+"""
+asyncio front ends for serial, GPIO events and bus transfers
+-------------
+
+Serial reads and GPIO events wait with loop.add_reader on serial_fd and the
+line event fd, so no thread is involved. Every coroutine waiting on the same
+fd shares one reader callback. Serial writes block in c-periphery until the
+data is queued, so they run in the loop's default executor. I2C/SPI transfers
+go to one worker thread per bus that drains everything queued, runs it back to
+back and hands all results to the loop with a single call_soon_threadsafe.
+"""
+
+import asyncio, collections, threading
+
+# (loop, fd) -> futures waiting for the fd to become readable
+waiting = {}
+
+
+def wake(key):
+    """Runs in loop thread. Wakes every waiter on the fd.
+    """
+    loop, fd = key
+    loop.remove_reader(fd)
+    for future in waiting.pop(key):
+        if not future.done():
+            future.set_result(True)
+
+
+async def readable(loop, fd, timeout=None):
+    """Wait until fd is readable. Returns False on timeout.
+    """
+    key = (loop, fd)
+    future = loop.create_future()
+    if key not in waiting:
+        waiting[key] = []
+        loop.add_reader(fd, wake, key)
+    waiting[key].append(future)
+    try:
+        if timeout is None:
+            return await future
+        done, pending = await asyncio.wait([future], timeout=timeout)
+        return bool(done)
+    finally:
+        futures = waiting.get(key)
+        if futures is not None and future in futures:
+            futures.remove(future)
+            if not futures:
+                del waiting[key]
+                loop.remove_reader(fd)
+
+
+class aioserial:
+    """Async serial on top of libperipheryserial.
+    """
+
+    def __init__(self, serial, handle, loop=None):
+        """serial is a libperipheryserial instance and handle an open serial_t.
+        """
+        self.serial = serial
+        self.lib = serial.lib
+        self.ffi = serial.ffi
+        self.handle = handle
+        self.fd = self.lib.serial_fd(handle)
+        self.loop = loop or asyncio.get_event_loop()
+        self.writing = asyncio.Lock()
+
+    def error(self):
+        return RuntimeError(self.ffi.string(self.lib.serial_errmsg(self.handle)).decode('utf-8'))
+
+    async def read(self, length, timeout=None):
+        """Read up to length bytes. Returns early with what has arrived when
+        timeout seconds have passed since the call.
+        """
+        buf = self.ffi.new("uint8_t[]", length)
+        got = 0
+        deadline = None if timeout is None else self.loop.time() + timeout
+        while got < length:
+            remaining = None if deadline is None else deadline - self.loop.time()
+            if remaining is not None and remaining <= 0:
+                break
+            if not await readable(self.loop, self.fd, remaining):
+                break
+            # Data is waiting so a 0 ms timeout never blocks
+            rc = self.lib.serial_read(self.handle, buf + got, length - got, 0)
+            if rc < 0:
+                raise self.error()
+            got += rc
+        return self.ffi.buffer(buf, got)[:]
+
+    def writeAll(self, data):
+        """Runs in executor. Queue data and wait for it to be transmitted.
+        """
+        rc = self.lib.serial_write(self.handle, self.ffi.from_buffer("uint8_t[]", data), len(data))
+        if rc < 0 or self.lib.serial_flush(self.handle) < 0:
+            raise self.error()
+        return rc
+
+    async def write(self, data):
+        """Write bytes and wait until the output buffer drains. Writes are
+        serialized so concurrent callers do not interleave.
+        """
+        async with self.writing:
+            return await self.loop.run_in_executor(None, self.writeAll, bytes(data))
+
+
+class aiogpio:
+    """Async edge events for a libgpiod line requested for events.
+    """
+
+    def __init__(self, line, loop=None):
+        self.line = line
+        self.fd = line.event_get_fd()
+        self.loop = loop or asyncio.get_event_loop()
+
+    async def event(self, timeout=None):
+        """Return next gpiod.LineEvent or None on timeout.
+        """
+        if not await readable(self.loop, self.fd, timeout):
+            return None
+        return self.line.event_read()
+
+    async def events(self):
+        """Async iterator of events.
+        """
+        while True:
+            yield await self.event()
+
+
+class aiobus:
+    """Dedicated executor for one bus. Queued calls are run as a batch and
+    results are delivered to the loop in one hop.
+    """
+
+    def __init__(self, name, loop=None):
+        self.name = name
+        self.loop = loop or asyncio.get_event_loop()
+        self.pending = collections.deque()
+        self.cond = threading.Condition()
+        self.stopped = False
+        self.batches = 0
+        self.calls = 0
+        self.thread = threading.Thread(target=self.run, name="aiobus-%s" % name, daemon=True)
+        self.thread.start()
+
+    def submit(self, func, *args):
+        """Queue func(*args) and return asyncio future for the result.
+        """
+        future = self.loop.create_future()
+        with self.cond:
+            self.pending.append((future, func, args))
+            self.cond.notify()
+        return future
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.pending and not self.stopped:
+                    self.cond.wait()
+                if self.stopped and not self.pending:
+                    return
+                batch = self.pending
+                self.pending = collections.deque()
+            results = []
+            for future, func, args in batch:
+                try:
+                    results.append((future, func(*args), None))
+                except Exception as e:
+                    results.append((future, None, e))
+            self.batches += 1
+            self.calls += len(results)
+            self.loop.call_soon_threadsafe(self.deliver, results)
+
+    def deliver(self, results):
+        """Runs in loop thread.
+        """
+        for future, result, error in results:
+            if future.cancelled():
+                continue
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+    def close(self):
+        with self.cond:
+            self.stopped = True
+            self.cond.notify()
+        self.thread.join()
+
+
+class aioi2c:
+    """Async libperipheryi2c helpers on an aiobus.
+    """
+
+    def __init__(self, i2c, handle, bus):
+        self.i2c = i2c
+        self.handle = handle
+        self.bus = bus
+
+    def writeReg(self, addr, reg, value):
+        return self.bus.submit(self.i2c.writeReg, self.handle, addr, reg, value)
+
+    def readReg(self, addr, reg):
+        return self.bus.submit(self.i2c.readReg, self.handle, addr, reg)
+
+    def readArray(self, addr, reg, length):
+        """Result is bytes since the cdata buffer belongs to the bus thread.
+        """
+        return self.bus.submit(lambda: self.i2c.ffi.buffer(self.i2c.readArray(self.handle, addr, reg, length))[:])
+
+    def execute(self, transaction):
+        """Run prepared transaction (i.e. trigger.i2cread).
+        """
+        return self.bus.submit(transaction.execute)
+
+
+class aiospi:
+    """Async libperipheryspi transfer on an aiobus.
+    """
+
+    def __init__(self, spi, handle, bus):
+        self.spi = spi
+        self.ffi = spi.ffi
+        self.handle = handle
+        self.bus = bus
+
+    def transfer(self, data):
+        """Full duplex transfer of bytes, result is bytes received.
+        """
+
+        def run():
+            txbuf = self.ffi.from_buffer("uint8_t[]", data)
+            rxbuf = self.ffi.new("uint8_t[]", len(data))
+            self.spi.transfer(self.handle, txbuf, rxbuf)
+            return self.ffi.buffer(rxbuf)[:]
+
+        return self.bus.submit(run)
+
+    def execute(self, transaction):
+        """Run prepared transaction (i.e. trigger.spiread).
+        """
+        return self.bus.submit(transaction.execute)
@@ -0,0 +1,946 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2018 Steven P. Goldsmith
+# See LICENSE.md for details.
+
+"""
+Local peripheral broker
+-------------
+
+A long running server owns the I2C, SPI, serial, GPIO and PWM handles and
+serves them over a Unix domain socket, so device opens and FFI startup are paid
+once and several processes can share a bus (requests run one at a time on the
+broker's loop). Clients send any number of operations in one frame and get all
+results back in one frame, or subscribe to periodic reads and GPIO edges that
+are pushed as they happen:
+
+    c = broker.client()
+    h = c.openI2c("/dev/i2c-0")
+    data, = c.batch().i2cWrite(h, 0x68, 0x6b, b"\\x00").i2cRead(h, 0x68, 0x3b, 14).execute()[1:]
+    sub = c.subscribeI2c(h, 0x68, 0x3b, 14, rate=100)
+    subId, samples = c.receive()
+
+Wire format (little endian):
+
+    frame   <I payload length, I id, H item count> then items
+    request <B opcode, H handle, I args length> then args
+    result  <i rc, I data length> then data (utf-8 message when rc < 0)
+
+Pushed frames use the subscription id (high bit set) and each item's data is a
+<q ns timestamp followed by the read data. Timestamps are CLOCK_MONOTONIC
+(time.monotonic_ns() in any process on the host), the clock the kernel stamps
+GPIO edges with on Linux 5.7 and later. Handles are 16 bit on the wire, closed
+ones are reused.
+
+Nothing blocks the loop: a serial read with a timeout that has no data yet
+parks its frame until the port is readable or the timeout passes (later frames
+of that connection wait behind it, other connections carry on).
+"""
+
+import collections, errno, heapq, itertools, os, selectors, socket, struct, time
+
+DEFAULT_PATH = "/tmp/userspaceio.sock"
+
+FRAME = struct.Struct("<IIH")
+OP = struct.Struct("<BHI")
+RESULT = struct.Struct("<iI")
+STAMP = struct.Struct("<q")
+SUB_FLAG = 0x80000000
+# Handles are H in OP
+MAX_HANDLE = 0xffff
+# Drop pushes to clients that have this much unsent
+MAX_BACKLOG = 1048576
+
+OPEN_I2C = 1
+OPEN_SPI = 2
+OPEN_SERIAL = 3
+OPEN_GPIO = 4
+OPEN_PWM = 5
+CLOSE = 6
+I2C_READ = 10
+I2C_WRITE = 11
+SPI_TRANSFER = 12
+SERIAL_READ = 13
+SERIAL_WRITE = 14
+GPIO_GET = 15
+GPIO_SET = 16
+PWM_SET = 17
+PWM_ENABLE = 18
+SUBSCRIBE = 20
+UNSUBSCRIBE = 21
+
+# OPEN_GPIO request types
+GPIO_IN = 0
+GPIO_OUT = 1
+GPIO_RISING = 2
+GPIO_FALLING = 3
+GPIO_BOTH = 4
+
+SPI_OPEN_ARGS = struct.Struct("<BI")
+SERIAL_OPEN_ARGS = struct.Struct("<I")
+GPIO_OPEN_ARGS = struct.Struct("<HB")
+PWM_OPEN_ARGS = struct.Struct("<HH")
+I2C_ARGS = struct.Struct("<HBH")
+SERIAL_READ_ARGS = struct.Struct("<HI")
+PWM_SET_ARGS = struct.Struct("<ii")
+BYTE = struct.Struct("<B")
+SUB_ARGS = struct.Struct("<Q")
+ID = struct.Struct("<I")
+
+
+class device:
+    """Open device shared by all connections.
+    """
+
+    def __init__(self, kind, key, handle):
+        self.kind = kind
+        self.key = key
+        self.handle = handle
+        self.refs = 0
+
+
+class i2cstate:
+    """I2C handle with preallocated register read messages.
+    """
+
+    def __init__(self, i2c, handle):
+        self.handle = handle
+        self.msgs = i2c.ffi.new("struct i2c_msg[2]")
+        self.reg = i2c.ffi.new("uint8_t[1]")
+        self.rx = i2c.ffi.new("uint8_t[]", 32)
+
+
+class subscription:
+
+    def __init__(self, id, conn, dev, opcode, args, period):
+        self.id = id
+        self.conn = conn
+        self.dev = dev
+        self.opcode = opcode
+        self.args = args
+        self.period = period
+        self.due = time.monotonic_ns()
+        self.active = True
+
+
+class watch:
+    """Readable fd shared by GPIO event subscriptions to one line or by frames
+    waiting on one serial port.
+    """
+
+    def __init__(self, fd):
+        self.fd = fd
+        self.waiters = []
+
+
+class pendingframe:
+    """Request frame being executed. It stops at a serial read that has to
+    wait and resumes from the same item.
+    """
+
+    def __init__(self, conn, id, count, data):
+        self.conn = conn
+        self.id = id
+        self.count = count
+        self.data = data
+        self.offset = 0
+        self.index = 0
+        self.parts = []
+        # Serial read being waited on
+        self.handle = 0
+        self.length = 0
+        self.received = b""
+        self.due = 0
+        self.fd = None
+        self.active = False
+
+
+class connection:
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.inbuf = bytearray()
+        self.outbuf = bytearray()
+        # handle -> refs held by this connection
+        self.handles = collections.Counter()
+        self.subs = {}
+        self.dropped = 0
+        self.writing = False
+        # Frame waiting on a serial read, later frames stay in inbuf
+        self.pending = None
+
+
+class server:
+    """Broker. Bindings default to the real libraries, created on first use.
+    """
+
+    def __init__(self, path=DEFAULT_PATH, i2c=None, spi=None, serial=None, pwm=None, gpio=None):
+        self.path = path
+        self.bindings = {"i2c": i2c, "spi": spi, "serial": serial, "pwm": pwm, "gpio": gpio}
+        self.devices = {}
+        self.keys = {}
+        self.handles = itertools.count(1)
+        # Closed handles to reuse before taking a new one
+        self.freeHandles = []
+        self.subIds = itertools.count(1)
+        self.timers = []
+        self.timerSeq = itertools.count()
+        # fd -> watch
+        self.watches = {}
+        self.sel = selectors.DefaultSelector()
+        self.running = False
+        self.wakeRead, self.wakeWrite = os.pipe()
+        self.ops = {OPEN_I2C: self.openI2c, OPEN_SPI: self.openSpi, OPEN_SERIAL: self.openSerial,
+                    OPEN_GPIO: self.openGpio, OPEN_PWM: self.openPwm, CLOSE: self.closeHandle,
+                    I2C_READ: self.i2cRead, I2C_WRITE: self.i2cWrite, SPI_TRANSFER: self.spiTransfer,
+                    SERIAL_READ: self.serialRead, SERIAL_WRITE: self.serialWrite, GPIO_GET: self.gpioGet,
+                    GPIO_SET: self.gpioSet, PWM_SET: self.pwmSet, PWM_ENABLE: self.pwmEnable,
+                    SUBSCRIBE: self.subscribe, UNSUBSCRIBE: self.unsubscribe}
+
+    def binding(self, kind):
+        binding = self.bindings[kind]
+        if binding is None:
+            if kind == "i2c":
+                from libperiphery import libperipheryi2c
+                binding = libperipheryi2c.libperipheryi2c()
+            elif kind == "spi":
+                from libperiphery import libperipheryspi
+                binding = libperipheryspi.libperipheryspi()
+            elif kind == "serial":
+                from libperiphery import libperipheryserial
+                binding = libperipheryserial.libperipheryserial()
+            elif kind == "pwm":
+                from libpwmio import libpwmio
+                binding = libpwmio.libpwmio()
+            else:
+                import gpiod
+                binding = gpiod
+            self.bindings[kind] = binding
+        return binding
+
+    def acquire(self, conn, kind, key, open):
+        """Handle for key, opening the device only if nobody has it open.
+        """
+        handle = self.keys.get(key)
+        if handle is None:
+            if self.freeHandles:
+                handle = heapq.heappop(self.freeHandles)
+            else:
+                handle = next(self.handles)
+                if handle > MAX_HANDLE:
+                    raise RuntimeError("Too many open devices")
+            try:
+                dev = device(kind, key, open())
+            except Exception:
+                heapq.heappush(self.freeHandles, handle)
+                raise
+            self.devices[handle] = dev
+            self.keys[key] = handle
+        self.devices[handle].refs += 1
+        conn.handles[handle] += 1
+        return handle, b""
+
+    def release(self, handle):
+        dev = self.devices[handle]
+        dev.refs -= 1
+        if dev.refs > 0:
+            return
+        del self.devices[handle]
+        del self.keys[dev.key]
+        heapq.heappush(self.freeHandles, handle)
+        if dev.kind == "gpio":
+            dev.handle.release()
+        elif dev.kind == "pwm":
+            self.binding("pwm").close(dev.key[1])
+        elif dev.kind == "i2c":
+            self.binding("i2c").close(dev.handle.handle)
+        else:
+            self.binding(dev.kind).close(dev.handle)
+
+    def lookup(self, handle, kind):
+        dev = self.devices.get(handle)
+        if dev is None or dev.kind != kind:
+            raise RuntimeError("Handle %d is not an open %s device" % (handle, kind))
+        return dev
+
+    def openI2c(self, conn, handle, args):
+        path = bytes(args).decode('utf-8')
+        i2c = self.binding("i2c")
+
+        return self.acquire(conn, "i2c", ("i2c", path), lambda: i2cstate(i2c, i2c.open(path)))
+
+    def openSpi(self, conn, handle, args):
+        mode, speed = SPI_OPEN_ARGS.unpack_from(args)
+        path = bytes(args[SPI_OPEN_ARGS.size:]).decode('utf-8')
+        spi = self.binding("spi")
+        return self.acquire(conn, "spi", ("spi", path, mode, speed), lambda: spi.open(path, mode, speed))
+
+    def openSerial(self, conn, handle, args):
+        baud, = SERIAL_OPEN_ARGS.unpack_from(args)
+        path = bytes(args[SERIAL_OPEN_ARGS.size:]).decode('utf-8')
+        serial = self.binding("serial")
+        return self.acquire(conn, "serial", ("serial", path, baud), lambda: serial.open(path, baud))
+
+    def openGpio(self, conn, handle, args):
+        line, type = GPIO_OPEN_ARGS.unpack_from(args)
+        path = bytes(args[GPIO_OPEN_ARGS.size:]).decode('utf-8')
+        gpiod = self.binding("gpio")
+        types = (gpiod.LINE_REQ_DIR_IN, gpiod.LINE_REQ_DIR_OUT, gpiod.LINE_REQ_EV_RISING_EDGE,
+                 gpiod.LINE_REQ_EV_FALLING_EDGE, gpiod.LINE_REQ_EV_BOTH_EDGES)
+
+        def open():
+            chip = gpiod.Chip(path, gpiod.Chip.OPEN_BY_PATH)
+            gpioLine = chip.get_line(line)
+            gpioLine.request(consumer="broker", type=types[type])
+            return gpioLine
+
+        return self.acquire(conn, "gpio", ("gpio", path, line, type), open)
+
+    def openPwm(self, conn, handle, args):
+        dev, pwm = PWM_OPEN_ARGS.unpack(args)
+        binding = self.binding("pwm")
+        return self.acquire(conn, "pwm", ("pwm", dev, pwm), lambda: binding.open(dev, pwm))
+
+    def closeHandle(self, conn, handle, args):
+        if conn.handles[handle] == 0:
+            raise RuntimeError("Handle %d is not open" % handle)
+        conn.handles[handle] -= 1
+        for sub in list(conn.subs.values()):
+            if sub.dev is self.devices[handle] and conn.handles[handle] == 0:
+                self.cancel(sub)
+        self.release(handle)
+        return 0, b""
+
+    def i2cRead(self, conn, handle, args):
+        state = self.lookup(handle, "i2c").handle
+        addr, reg, length = I2C_ARGS.unpack(args)
+        i2c = self.bindings["i2c"]
+        if length > len(state.rx):
+            state.rx = i2c.ffi.new("uint8_t[]", length)
+        state.reg[0] = reg
+        msgs = state.msgs
+        msgs[0].addr = addr
+        msgs[0].flags = 0
+        msgs[0].len = 1
+        msgs[0].buf = state.reg
+        msgs[1].addr = addr
+        msgs[1].flags = i2c.lib.I2C_M_RD
+        msgs[1].len = length
+        msgs[1].buf = state.rx
+        if i2c.lib.i2c_transfer(state.handle, msgs, 2) < 0:
+            raise RuntimeError(i2c.ffi.string(i2c.lib.i2c_errmsg(state.handle)).decode('utf-8'))
+        return length, i2c.ffi.buffer(state.rx, length)[:]
+
+    def i2cWrite(self, conn, handle, args):
+        """Register followed by data in one message.
+        """
+        state = self.lookup(handle, "i2c").handle
+        addr, reg, length = I2C_ARGS.unpack_from(args)
+        i2c = self.bindings["i2c"]
+        buf = i2c.ffi.new("uint8_t[]", bytes((reg,)) + bytes(args[I2C_ARGS.size:]))
+        msgs = state.msgs
+        msgs[0].addr = addr
+        msgs[0].flags = 0
+        msgs[0].len = len(buf)
+        msgs[0].buf = buf
+        if i2c.lib.i2c_transfer(state.handle, msgs, 1) < 0:
+            raise RuntimeError(i2c.ffi.string(i2c.lib.i2c_errmsg(state.handle)).decode('utf-8'))
+        return 0, b""
+
+    def spiTransfer(self, conn, handle, args):
+        h = self.lookup(handle, "spi").handle
+        spi = self.bindings["spi"]
+        length = len(args)
+        rx = spi.ffi.new("uint8_t[]", length)
+        if spi.lib.spi_transfer(h, spi.ffi.from_buffer("uint8_t[]", args), rx, length) < 0:
+            raise RuntimeError(spi.ffi.string(spi.lib.spi_errmsg(h)).decode('utf-8'))
+        return length, spi.ffi.buffer(rx, length)[:]
+
+    def serialRead(self, conn, handle, args):
+        """Bytes available now, up to length (execute waits for the rest if
+        there is a timeout).
+        """
+        h = self.lookup(handle, "serial").handle
+        length, timeoutMs = SERIAL_READ_ARGS.unpack(args)
+        serial = self.bindings["serial"]
+        buf = serial.ffi.new("uint8_t[]", length)
+        rc = serial.lib.serial_read(h, buf, length, 0)
+        if rc < 0:
+            raise RuntimeError(serial.ffi.string(serial.lib.serial_errmsg(h)).decode('utf-8'))
+        return rc, serial.ffi.buffer(buf, rc)[:]
+
+    def serialWrite(self, conn, handle, args):
+        h = self.lookup(handle, "serial").handle
+        serial = self.bindings["serial"]
+        rc = serial.lib.serial_write(h, serial.ffi.from_buffer("uint8_t[]", args), len(args))
+        if rc < 0:
+            raise RuntimeError(serial.ffi.string(serial.lib.serial_errmsg(h)).decode('utf-8'))
+        return rc, b""
+
+    def gpioGet(self, conn, handle, args):
+        return self.lookup(handle, "gpio").handle.get_value(), b""
+
+    def gpioSet(self, conn, handle, args):
+        self.lookup(handle, "gpio").handle.set_value(BYTE.unpack(args)[0])
+        return 0, b""
+
+    def pwmSet(self, conn, handle, args):
+        """Period and/or duty cycle in ns, negative leaves it unchanged.
+        """
+        dev, pwm = self.lookup(handle, "pwm").key[1:]
+        period, duty = PWM_SET_ARGS.unpack(args)
+        lib = self.bindings["pwm"].lib
+        if period >= 0 and lib.pwm_set_period(dev, pwm, period) < 0:
+            raise RuntimeError("Error setting period on device %d" % dev)
+        if duty >= 0 and lib.pwm_set_duty_cycle(dev, pwm, duty) < 0:
+            raise RuntimeError("Error setting duty cycle on device %d" % dev)
+        return 0, b""
+
+    def pwmEnable(self, conn, handle, args):
+        dev, pwm = self.lookup(handle, "pwm").key[1:]
+        lib = self.bindings["pwm"].lib
+        if BYTE.unpack(args)[0]:
+            rc = lib.pwm_enable(dev, pwm)
+        else:
+            rc = lib.pwm_disable(dev, pwm)
+        if rc < 0:
+            raise RuntimeError("Error enabling device %d" % dev)
+        return 0, b""
+
+    def subscribe(self, conn, handle, args):
+        """Periodic read (period ns and an embedded read request) or, with
+        period 0 on a GPIO event handle, edge events.
+        """
+        if conn.handles[handle] == 0:
+            raise RuntimeError("Handle %d is not open" % handle)
+        dev = self.devices[handle]
+        period, = SUB_ARGS.unpack_from(args)
+        opcode, _, length = OP.unpack_from(args, SUB_ARGS.size)
+        opArgs = bytes(args[SUB_ARGS.size + OP.size:SUB_ARGS.size + OP.size + length])
+        sub = subscription(SUB_FLAG | next(self.subIds), conn, dev, opcode, opArgs, period)
+        sub.handle = handle
+        if period == 0:
+            if dev.kind != "gpio":
+                raise RuntimeError("Only GPIO event handles can subscribe without a period")
+            self.addWatch(dev.handle.event_get_fd(), sub)
+        else:
+            if opcode not in (I2C_READ, SPI_TRANSFER, SERIAL_READ, GPIO_GET):
+                raise RuntimeError("Opcode %d can not be subscribed" % opcode)
+            heapq.heappush(self.timers, (sub.due, next(self.timerSeq), sub))
+        conn.subs[sub.id] = sub
+        return sub.id & ~SUB_FLAG, b""
+
+    def unsubscribe(self, conn, handle, args):
+        sub = conn.subs.get(SUB_FLAG | ID.unpack(args)[0])
+        if sub is None:
+            raise RuntimeError("No such subscription")
+        self.cancel(sub)
+        return 0, b""
+
+    def cancel(self, sub):
+        sub.active = False
+        del sub.conn.subs[sub.id]
+        if sub.period == 0:
+            self.removeWatch(sub.dev.handle.event_get_fd(), sub)
+
+    def addWatch(self, fd, waiter):
+        """Register fd once however many waiters it has.
+        """
+        w = self.watches.get(fd)
+        if w is None:
+            w = watch(fd)
+            self.watches[fd] = w
+            self.sel.register(fd, selectors.EVENT_READ, w)
+        w.waiters.append(waiter)
+
+    def removeWatch(self, fd, waiter):
+        w = self.watches[fd]
+        w.waiters.remove(waiter)
+        if not w.waiters:
+            self.sel.unregister(fd)
+            del self.watches[fd]
+
+    def execute(self, fr):
+        """Run request items from where fr stopped. Returns False if a serial
+        read is waiting for data.
+        """
+        data = fr.data
+        while fr.index < fr.count:
+            opcode, handle, length = OP.unpack_from(data, fr.offset)
+            args = data[fr.offset + OP.size:fr.offset + OP.size + length]
+            fr.offset += OP.size + length
+            fr.index += 1
+            op = self.ops.get(opcode)
+            try:
+                if op is None:
+                    raise RuntimeError("Unknown opcode %d" % opcode)
+                rc, result = op(fr.conn, handle, args)
+                if opcode == SERIAL_READ and self.waitSerial(fr, handle, args, result):
+                    return False
+            except Exception as e:
+                rc, result = -errno.EIO, str(e).encode('utf-8')
+            fr.parts.append(RESULT.pack(rc, len(result)))
+            fr.parts.append(result)
+        return True
+
+    def waitSerial(self, fr, handle, args, result):
+        """Park fr on the serial port if the read is short and has a timeout.
+        """
+        length, timeoutMs = SERIAL_READ_ARGS.unpack(args)
+        if len(result) >= length or timeoutMs == 0:
+            return False
+        serial = self.bindings["serial"]
+        h = self.devices[handle].handle
+        fr.handle = handle
+        fr.length = length
+        fr.received = result
+        fr.due = time.monotonic_ns() + timeoutMs * 1000000
+        fr.fd = serial.lib.serial_fd(h)
+        fr.active = True
+        self.addWatch(fr.fd, fr)
+        heapq.heappush(self.timers, (fr.due, next(self.timerSeq), fr))
+        return True
+
+    def resumeSerial(self, fr):
+        """Read what arrived and finish the read when it is complete or timed
+        out, then run the rest of the frame.
+        """
+        try:
+            rc, data = self.serialRead(fr.conn, fr.handle, SERIAL_READ_ARGS.pack(fr.length - len(fr.received), 0))
+            fr.received += data
+            result = fr.received
+            rc = len(result)
+            if rc < fr.length and time.monotonic_ns() < fr.due:
+                return
+        except Exception as e:
+            rc, result = -errno.EIO, str(e).encode('utf-8')
+        self.removeWatch(fr.fd, fr)
+        fr.active = False
+        fr.parts.append(RESULT.pack(rc, len(result)))
+        fr.parts.append(result)
+        self.finish(fr)
+
+    def finish(self, fr):
+        """Continue a parked frame, reply when done and run the frames queued
+        behind it.
+        """
+        conn = fr.conn
+        if not self.execute(fr):
+            return
+        conn.pending = None
+        self.send(conn, fr.id, fr.count, b"".join(fr.parts))
+        if conn.sock is not None:
+            self.process(conn)
+
+    def send(self, conn, id, count, payload, push=False):
+        if push and len(conn.outbuf) > MAX_BACKLOG:
+            conn.dropped += 1
+            return
+        conn.outbuf += FRAME.pack(len(payload), id, count)
+        conn.outbuf += payload
+        if not conn.writing:
+            self.flush(conn)
+
+    def flush(self, conn):
+        try:
+            sent = conn.sock.send(conn.outbuf)
+        except BlockingIOError:
+            sent = 0
+        except OSError:
+            self.disconnect(conn)
+            return
+        del conn.outbuf[:sent]
+        writing = len(conn.outbuf) > 0
+        if writing != conn.writing:
+            conn.writing = writing
+            events = selectors.EVENT_READ | (selectors.EVENT_WRITE if writing else 0)
+            self.sel.modify(conn.sock, events, conn)
+
+    def receive(self, conn):
+        try:
+            data = conn.sock.recv(65536)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""
+        if not data:
+            self.disconnect(conn)
+            return
+        conn.inbuf += data
+        self.process(conn)
+
+    def process(self, conn):
+        """Run complete frames in inbuf until one has to wait.
+        """
+        buf = conn.inbuf
+        offset = 0
+        while conn.pending is None and len(buf) - offset >= FRAME.size:
+            length, id, count = FRAME.unpack_from(buf, offset)
+            if len(buf) - offset - FRAME.size < length:
+                break
+            start = offset + FRAME.size
+            payload = memoryview(buf)[start:start + length]
+            fr = pendingframe(conn, id, count, payload)
+            try:
+                done = self.execute(fr)
+                if not done:
+                    fr.data = bytes(payload)
+            finally:
+                payload.release()
+            offset = start + length
+            if not done:
+                conn.pending = fr
+                break
+            self.send(conn, id, count, b"".join(fr.parts))
+            if conn.sock is None:
+                return
+        del buf[:offset]
+
+    def disconnect(self, conn):
+        if conn.sock is None:
+            return
+        for sub in list(conn.subs.values()):
+            self.cancel(sub)
+        fr = conn.pending
+        if fr is not None and fr.active:
+            self.removeWatch(fr.fd, fr)
+            fr.active = False
+        conn.pending = None
+        for handle, refs in conn.handles.items():
+            for i in range(refs):
+                self.release(handle)
+        conn.handles.clear()
+        self.sel.unregister(conn.sock)
+        conn.sock.close()
+        conn.sock = None
+
+    def poll(self, sub):
+        """Run subscribed read and push result.
+        """
+        conn = sub.conn
+        try:
+            rc, data = self.ops[sub.opcode](conn, sub.handle, sub.args)
+        except Exception as e:
+            rc, data = -errno.EIO, str(e).encode('utf-8')
+        payload = RESULT.pack(rc, STAMP.size + len(data)) + STAMP.pack(time.monotonic_ns()) + data
+        self.send(conn, sub.id, 1, payload, push=True)
+
+    def readable(self, w):
+        """GPIO event to every subscriber of the line, or serial data to the
+        frames waiting on the port.
+        """
+        waiters = list(w.waiters)
+        if isinstance(waiters[0], subscription):
+            event = waiters[0].dev.handle.event_read()
+            data = STAMP.pack(event.sec * 1000000000 + event.nsec) + BYTE.pack(event.type)
+            payload = RESULT.pack(event.type, len(data)) + data
+            for sub in waiters:
+                if sub.active:
+                    self.send(sub.conn, sub.id, 1, payload, push=True)
+        else:
+            for fr in waiters:
+                if fr.active:
+                    self.resumeSerial(fr)
+
+    def runTimers(self):
+        """Run due subscriptions and return seconds until the next one.
+        """
+        timers = self.timers
+        now = time.monotonic_ns()
+        while timers and timers[0][0] <= now:
+            due, seq, sub = heapq.heappop(timers)
+            if not sub.active:
+                continue
+            if isinstance(sub, pendingframe):
+                # Serial read timeout
+                self.resumeSerial(sub)
+                continue
+            self.poll(sub)
+            # Skip missed periods rather than bursting
+            sub.due = max(due + sub.period, now)
+            heapq.heappush(timers, (sub.due, next(self.timerSeq), sub))
+        while timers and not timers[0][2].active:
+            heapq.heappop(timers)
+        if timers:
+            return max(0.0, (timers[0][0] - time.monotonic_ns()) / 1000000000)
+        return None
+
+    def serve(self):
+        """Run until stop().
+        """
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self.path)
+        listener.listen(16)
+        listener.setblocking(False)
+        self.sel.register(listener, selectors.EVENT_READ, None)
+        self.sel.register(self.wakeRead, selectors.EVENT_READ, self.wakeRead)
+        self.running = True
+        try:
+            while self.running:
+                timeout = self.runTimers()
+                for key, events in self.sel.select(timeout):
+                    data = key.data
+                    if data is None:
+                        sock, addr = listener.accept()
+                        sock.setblocking(False)
+                        self.sel.register(sock, selectors.EVENT_READ, connection(sock))
+                    elif data is self.wakeRead:
+                        os.read(self.wakeRead, 64)
+                    elif isinstance(data, watch):
+                        if data.waiters:
+                            self.readable(data)
+                    else:
+                        if data.sock is not None and events & selectors.EVENT_WRITE:
+                            self.flush(data)
+                        if data.sock is not None and events & selectors.EVENT_READ:
+                            self.receive(data)
+        finally:
+            for key in list(self.sel.get_map().values()):
+                if isinstance(key.data, connection):
+                    self.disconnect(key.data)
+            self.sel.unregister(listener)
+            self.sel.unregister(self.wakeRead)
+            listener.close()
+            os.unlink(self.path)
+
+    def stop(self):
+        """Stop serve() (safe from another thread or a signal handler).
+        """
+        self.running = False
+        os.write(self.wakeWrite, b"\x00")
+
+
+class batch:
+    """Operations sent in one frame. Methods chain, execute() returns one
+    value per operation (bytes for reads, int otherwise) and raises
+    RuntimeError with the first error after the whole batch ran.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.parts = []
+        self.reads = []
+
+    def add(self, opcode, handle, args, read=False):
+        self.parts.append(OP.pack(opcode, handle, len(args)))
+        self.parts.append(args)
+        self.reads.append(read)
+        return self
+
+    def openI2c(self, path):
+        return self.add(OPEN_I2C, 0, path.encode('utf-8'))
+
+    def openSpi(self, path, mode, maxSpeed):
+        return self.add(OPEN_SPI, 0, SPI_OPEN_ARGS.pack(mode, maxSpeed) + path.encode('utf-8'))
+
+    def openSerial(self, path, baudrate):
+        return self.add(OPEN_SERIAL, 0, SERIAL_OPEN_ARGS.pack(baudrate) + path.encode('utf-8'))
+
+    def openGpio(self, chip, line, type=GPIO_IN):
+        return self.add(OPEN_GPIO, 0, GPIO_OPEN_ARGS.pack(line, type) + chip.encode('utf-8'))
+
+    def openPwm(self, device, pwm):
+        return self.add(OPEN_PWM, 0, PWM_OPEN_ARGS.pack(device, pwm))
+
+    def close(self, handle):
+        return self.add(CLOSE, handle, b"")
+
+    def i2cRead(self, handle, addr, reg, length):
+        return self.add(I2C_READ, handle, I2C_ARGS.pack(addr, reg, length), True)
+
+    def i2cWrite(self, handle, addr, reg, data):
+        return self.add(I2C_WRITE, handle, I2C_ARGS.pack(addr, reg, len(data)) + bytes(data))
+
+    def spiTransfer(self, handle, data):
+        return self.add(SPI_TRANSFER, handle, bytes(data), True)
+
+    def serialRead(self, handle, length, timeoutMs):
+        return self.add(SERIAL_READ, handle, SERIAL_READ_ARGS.pack(length, timeoutMs), True)
+
+    def serialWrite(self, handle, data):
+        return self.add(SERIAL_WRITE, handle, bytes(data))
+
+    def gpioGet(self, handle):
+        return self.add(GPIO_GET, handle, b"")
+
+    def gpioSet(self, handle, value):
+        return self.add(GPIO_SET, handle, BYTE.pack(value))
+
+    def pwmSet(self, handle, period=-1, duty=-1):
+        return self.add(PWM_SET, handle, PWM_SET_ARGS.pack(period, duty))
+
+    def pwmEnable(self, handle, enable=True):
+        return self.add(PWM_ENABLE, handle, BYTE.pack(1 if enable else 0))
+
+    def subscribe(self, handle, rate, batchOp=None):
+        """Subscribe to the single read in batchOp (a batch) at rate Hz, or to
+        GPIO edges when rate is 0.
+        """
+        if rate:
+            period = int(1000000000 / rate)
+            op = b"".join(batchOp.parts)
+        else:
+            period = 0
+            op = OP.pack(GPIO_GET, handle, 0)
+        return self.add(SUBSCRIBE, handle, SUB_ARGS.pack(period) + op)
+
+    def unsubscribe(self, id):
+        return self.add(UNSUBSCRIBE, 0, ID.pack(id))
+
+    def execute(self):
+        results = self.client.request(b"".join(self.parts), len(self.reads))
+        values = []
+        error = None
+        for read, (rc, data) in zip(self.reads, results):
+            if rc < 0:
+                if error is None:
+                    error = RuntimeError(data.decode('utf-8'))
+                values.append(None)
+            elif read:
+                values.append(data)
+            else:
+                values.append(rc)
+        if error is not None:
+            raise error
+        return values
+
+
+class client:
+    """Blocking broker client. Not thread safe, use one per thread.
+    """
+
+    def __init__(self, path=DEFAULT_PATH):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self.ids = itertools.count(1)
+        self.inbuf = bytearray()
+        self.pushes = collections.deque()
+
+    def readFrame(self, timeout=None):
+        """Next (id, [(rc, data)]) frame or None on timeout.
+        """
+        buf = self.inbuf
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            if len(buf) >= FRAME.size:
+                length, id, count = FRAME.unpack_from(buf)
+                if len(buf) >= FRAME.size + length:
+                    items = []
+                    offset = FRAME.size
+                    for i in range(count):
+                        rc, size = RESULT.unpack_from(buf, offset)
+                        offset += RESULT.size
+                        items.append((rc, bytes(buf[offset:offset + size])))
+                        offset += size
+                    del buf[:FRAME.size + length]
+                    return id, items
+            if deadline is None:
+                self.sock.settimeout(None)
+            else:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self.sock.settimeout(remaining)
+            try:
+                data = self.sock.recv(65536)
+            except socket.timeout:
+                return None
+            if not data:
+                raise RuntimeError("Broker closed connection")
+            buf += data
+
+    def request(self, ops, count):
+        """Send request items and wait for the results. Pushes that arrive
+        first are queued for receive().
+        """
+        id = next(self.ids) & ~SUB_FLAG
+        self.sock.sendall(FRAME.pack(len(ops), id, count) + ops)
+        while True:
+            frameId, items = self.readFrame()
+            if frameId == id:
+                return items
+            self.pushes.append((frameId, items))
+
+    def receive(self, timeout=None):
+        """Next pushed (subscription id, [(timestamp, data)]) or None on
+        timeout.
+        """
+        if self.pushes:
+            frame = self.pushes.popleft()
+        else:
+            frame = self.readFrame(timeout)
+            if frame is None:
+                return None
+        id, items = frame
+        return id & ~SUB_FLAG, [(STAMP.unpack_from(data)[0], data[STAMP.size:]) for rc, data in items]
+
+    def batch(self):
+        return batch(self)
+
+    def openI2c(self, path):
+        return self.batch().openI2c(path).execute()[0]
+
+    def openSpi(self, path, mode, maxSpeed):
+        return self.batch().openSpi(path, mode, maxSpeed).execute()[0]
+
+    def openSerial(self, path, baudrate):
+        return self.batch().openSerial(path, baudrate).execute()[0]
+
+    def openGpio(self, chip, line, type=GPIO_IN):
+        return self.batch().openGpio(chip, line, type).execute()[0]
+
+    def openPwm(self, device, pwm):
+        return self.batch().openPwm(device, pwm).execute()[0]
+
+    def close(self, handle=None):
+        """Close device handle, or the connection when no handle is given.
+        """
+        if handle is None:
+            self.sock.close()
+        else:
+            self.batch().close(handle).execute()
+
+    def i2cRead(self, handle, addr, reg, length):
+        return self.batch().i2cRead(handle, addr, reg, length).execute()[0]
+
+    def i2cWrite(self, handle, addr, reg, data):
+        self.batch().i2cWrite(handle, addr, reg, data).execute()
+
+    def spiTransfer(self, handle, data):
+        return self.batch().spiTransfer(handle, data).execute()[0]
+
+    def serialRead(self, handle, length, timeoutMs):
+        return self.batch().serialRead(handle, length, timeoutMs).execute()[0]
+
+    def serialWrite(self, handle, data):
+        return self.batch().serialWrite(handle, data).execute()[0]
+
+    def gpioGet(self, handle):
+        return self.batch().gpioGet(handle).execute()[0]
+
+    def gpioSet(self, handle, value):
+        self.batch().gpioSet(handle, value).execute()
+
+    def pwmSet(self, handle, period=-1, duty=-1):
+        self.batch().pwmSet(handle, period, duty).execute()
+
+    def pwmEnable(self, handle, enable=True):
+        self.batch().pwmEnable(handle, enable).execute()
+
+    def subscribeI2c(self, handle, addr, reg, length, rate):
+        return self.batch().subscribe(handle, rate, self.batch().i2cRead(handle, addr, reg, length)).execute()[0]
+
+    def subscribeSpi(self, handle, data, rate):
+        return self.batch().subscribe(handle, rate, self.batch().spiTransfer(handle, data)).execute()[0]
+
+    def subscribeSerial(self, handle, length, rate):
+        return self.batch().subscribe(handle, rate, self.batch().serialRead(handle, length, 0)).execute()[0]
+
+    def subscribeGpio(self, handle):
+        """Edge events, data is the gpiod.LineEvent type byte.
+        """
+        return self.batch().subscribe(handle, 0).execute()[0]
+
+    def unsubscribe(self, id):
+        self.batch().unsubscribe(id).execute()
@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2018 Steven P. Goldsmith
+# See LICENSE.md for details.
+
+"""
+IMU calibration with a persistent cache
+-------------
+
+Collects a stationary batch with one readBatch, fits gyro bias and accel
+offset/scale with NumPy and hands the result to the driver as a per axis
+affine transform (value * gain + bias). The driver folds it into the compiled
+burst constants and the batch decode multiply, so corrected samples cost the
+same as raw ones.
+
+Results are saved as JSON keyed by device, bus and address
+("mpu6050@/dev/i2c-1:0x68") with the bus fingerprint from discovery, so the
+next start loads them instead of sampling again:
+
+    mpu = mpu6050.mpu6050(i2c)
+    handle = i2c.open("/dev/i2c-1")
+    calib = calibration.startup(mpu, "/dev/i2c-1", handle, 0x68)
+
+The level fit (one pose, z up) finds offsets only. Offsets and scales need six
+or more poses (i.e. each axis up and down) passed to fitAccel. Units are the
+driver's (g and º/s).
+"""
+
+import os, time
+import numpy as np
+from libperiphery import discovery, samples
+
+DEFAULT_CACHE = os.path.join(os.path.expanduser("~"), ".cache", "userspaceio", "calibration.json")
+
+
+class calibration:
+    """Axis aligned correction: accel = accelScale * (raw - accelOffset) and
+    gyro = raw - gyroBias.
+    """
+
+    def __init__(self, accelOffset=(0.0, 0.0, 0.0), accelScale=(1.0, 1.0, 1.0), gyroBias=(0.0, 0.0, 0.0),
+                 residual=0.0, count=0):
+        self.accelOffset = np.array(accelOffset, dtype=np.float64)
+        self.accelScale = np.array(accelScale, dtype=np.float64)
+        self.gyroBias = np.array(gyroBias, dtype=np.float64)
+        self.residual = residual
+        self.count = count
+
+    def accelAffine(self):
+        """(gain, bias) 3-vectors of the accel correction.
+        """
+        return self.accelScale, -self.accelScale * self.accelOffset
+
+    def gyroAffine(self):
+        return np.ones(3), -self.gyroBias
+
+    def corrections(self, accel, gyro=()):
+        """{register name: (gain, bias)} for regmap.regdriver.setAffine.
+        """
+        result = {}
+        for names, (gain, bias) in ((accel, self.accelAffine()), (gyro, self.gyroAffine())):
+            for name, g, b in zip(names, gain, bias):
+                result[name] = (float(g), float(b))
+        return result
+
+    def toDict(self):
+        return {"accelOffset": self.accelOffset.tolist(), "accelScale": self.accelScale.tolist(),
+                "gyroBias": self.gyroBias.tolist(), "residual": self.residual, "count": self.count}
+
+    @classmethod
+    def fromDict(cls, d):
+        return cls(d["accelOffset"], d["accelScale"], d["gyroBias"], d.get("residual", 0.0), d.get("count", 0))
+
+    def __repr__(self):
+        return "calibration(accelOffset=%s, accelScale=%s, gyroBias=%s, residual=%.5f)" % (
+            np.round(self.accelOffset, 5).tolist(), np.round(self.accelScale, 5).tolist(),
+            np.round(self.gyroBias, 4).tolist(), self.residual)
+
+
+def isStationary(data, accelStd=0.02, gyroStd=1.0):
+    """True if no axis of the batch moved more than the standard deviations
+    (g and º/s).
+    """
+    if np.any(data["accel"].std(axis=0) > accelStd):
+        return False
+    return "gyro" not in data.dtype.names or not np.any(data["gyro"].std(axis=0) > gyroStd)
+
+
+def fitGyroBias(gyro):
+    """Mean rate of a stationary N x 3 batch.
+    """
+    return np.asarray(gyro, dtype=np.float64).mean(axis=0)
+
+
+def fitLevel(accel, gravity=(0.0, 0.0, 1.0)):
+    """Offsets of a stationary N x 3 batch taken in a known orientation, scale
+    is left at 1. Returns (offset, scale, residual).
+    """
+    accel = np.asarray(accel, dtype=np.float64)
+    offset = accel.mean(axis=0) - np.asarray(gravity, dtype=np.float64)
+    residual = float(np.sqrt(np.mean(np.sum((accel - offset - gravity) ** 2, axis=1))))
+    return offset, np.ones(3), residual
+
+
+def fitAccel(accel):
+    """Least squares axis aligned ellipsoid through N x 3 readings (pose means
+    or raw samples) from six or more orientations, so that every corrected
+    reading has 1 g magnitude. Returns (offset, scale, residual) where
+    residual is the RMS magnitude error in g.
+    """
+    accel = np.asarray(accel, dtype=np.float64).reshape(-1, 3)
+    # a x^2 + b y^2 + c z^2 + d x + e y + f z = 1
+    design = np.hstack((accel * accel, accel))
+    p, _, rank, _ = np.linalg.lstsq(design, np.ones(len(accel)), rcond=None)
+    if rank < 6:
+        raise ValueError("Accel fit needs readings from six or more orientations")
+    quadratic, linear = p[:3], p[3:]
+    if np.any(quadratic <= 0.0):
+        raise ValueError("Accel readings do not fit an ellipsoid")
+    offset = -linear / (2.0 * quadratic)
+    level = 1.0 + np.sum(quadratic * offset * offset)
+    scale = np.sqrt(quadratic / level)
+    corrected = scale * (accel - offset)
+    residual = float(np.sqrt(np.mean((np.sqrt(np.sum(corrected * corrected, axis=1)) - 1.0) ** 2)))
+    return offset, scale, residual
+
+
+def collect(driver, handle, addr, count=500, interval=0.002):
+    """Uncorrected batch of count samples (mpu6050 or adxl345 driver).
+    """
+    if hasattr(driver, "getGyroData"):
+        batch = samples.samplebatch(samples.imudtype, 14, count)
+    else:
+        batch = samples.samplebatch(samples.acceldtype, 6, count)
+    previous = driver.getCalibration(handle, addr)
+    driver.setCalibration(handle, addr, None)
+    try:
+        return driver.readBatch(handle, addr, batch, count, interval).copy()
+    finally:
+        driver.setCalibration(handle, addr, previous)
+
+
+def calibrate(driver, handle, addr, count=500, interval=0.002, gravity=(0.0, 0.0, 1.0), poses=None):
+    """Stationary batch -> calibration. Offsets only from the level fit, or
+    offsets and scales when poses (N x 3 accel means, N >= 6) are given, in
+    which case the batch's accel mean is fitted as one more pose. Raises
+    ValueError if the device moved.
+    """
+    data = collect(driver, handle, addr, count, interval)
+    if not isStationary(data):
+        raise ValueError("Device moved during calibration")
+    if poses is None:
+        offset, scale, residual = fitLevel(data["accel"], gravity)
+    else:
+        offset, scale, residual = fitAccel(np.vstack((np.asarray(poses, dtype=np.float64).reshape(-1, 3),
+                                                       data["accel"].mean(axis=0))))
+    gyroBias = fitGyroBias(data["gyro"]) if "gyro" in data.dtype.names else np.zeros(3)
+    return calibration(offset, scale, gyroBias, residual, count)
+
+
+# Identity registers tried in order (MPU-6050, ADXL345)
+IDENTITY_REGISTERS = ("WHO_AM_I", "DEVID")
+
+
+def identity(driver, handle, addr):
+    """Raw value of the driver's identity register or None if it has none.
+    """
+    for name in IDENTITY_REGISTERS:
+        if name in driver.regs.map.registers:
+            return driver.regs.readReg(handle, addr, name)
+    return None
+
+
+class cache:
+    """Calibrations by device key in a JSON file. Entries are stale when the
+    bus fingerprint or the identity register (WHO_AM_I, DEVID) changes. That
+    catches a different part at the same address, but these parts have no
+    serial number, so a swapped sensor of the same type keeps the old
+    calibration until it is forced or invalidated.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE):
+        self.path = path
+
+    @staticmethod
+    def key(name, bus, addr):
+        return "%s@%s:0x%02x" % (name, bus, addr)
+
+    def load(self):
+        return discovery.loadJson(self.path)
+
+    def save(self, entries):
+        discovery.saveJson(self.path, entries)
+
+    def get(self, name, bus, addr, ident=None):
+        """Cached calibration or None if missing or stale. ident is the
+        identity register value read now (see identity()).
+        """
+        entry = self.load().get(self.key(name, bus, addr))
+        if entry is None or entry["fingerprint"] != discovery.fingerprint(bus) or entry.get("identity") != ident:
+            return None
+        return calibration.fromDict(entry["calibration"])
+
+    def put(self, name, bus, addr, calib, ident=None):
+        entries = self.load()
+        entries[self.key(name, bus, addr)] = {"fingerprint": discovery.fingerprint(bus), "identity": ident,
+                                              "time": time.time(), "calibration": calib.toDict()}
+        self.save(entries)
+
+    def invalidate(self, name=None, bus=None, addr=None):
+        """Drop one entry or all.
+        """
+        if name is None:
+            entries = {}
+        else:
+            entries = self.load()
+            entries.pop(self.key(name, bus, addr), None)
+        self.save(entries)
+
+
+def startup(driver, bus, handle, addr, cachePath=DEFAULT_CACHE, count=500, interval=0.002, force=False):
+    """Apply the cached calibration of the device, or calibrate (level, keep it
+    still) and cache it when there is none or force. Returns the calibration.
+    """
+    store = cache(cachePath)
+    name = driver.regs.map.name
+    ident = identity(driver, handle, addr)
+    calib = None if force else store.get(name, bus, addr, ident)
+    if calib is None:
+        calib = calibrate(driver, handle, addr, count, interval)
+        store.put(name, bus, addr, calib, ident)
+    driver.setCalibration(handle, addr, calib)
+    return calib
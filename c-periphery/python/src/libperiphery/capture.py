@@ -0,0 +1,333 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2018 Steven P. Goldsmith
+# See LICENSE.md for details.
+
+"""
+Record and replay of bus transactions
+-------------
+
+capture wraps a binding's lib (libperipheryi2c, libperipheryspi or
+libperipheryserial) and logs every I2C message set, SPI transfer and serial
+chunk with a monotonic timestamp to a compact binary file. replaylib is a lib
+that feeds those responses back, at original speed or as fast as possible, so
+mpu6050/adxl345/serial consumers run offline against a field trace:
+
+    cap = capture.capture("field.cap")
+    cap.enable(mpu.i2c)
+    ...
+    cap.close()
+
+    i2c = libperipheryi2c.libperipheryi2c(lib=capture.replaylib("field.cap"))
+    mpu = mpu6050.mpu6050(i2c)
+
+File is a magic header followed by records of <kind, timestamp ns, channel, rc,
+payload length> and the payload. Each open gets a channel number.
+"""
+
+import collections, errno, struct, threading, time
+from cffi import FFI
+from libperiphery import sim
+
+ffi = FFI()
+
+MAGIC = b"UIOCAP1\n"
+HEADER = struct.Struct("<BqHiI")
+MSG = struct.Struct("<HHH")
+COUNT = struct.Struct("<H")
+
+OPEN = 0
+I2C = 1
+SPI = 2
+SERIAL_READ = 3
+SERIAL_WRITE = 4
+
+
+def records(path):
+    """Yield (kind, timestamp, channel, rc, payload) from capture file.
+    """
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise RuntimeError("%s is not a capture file" % path)
+        while True:
+            header = f.read(HEADER.size)
+            if len(header) < HEADER.size:
+                return
+            kind, timestamp, channel, rc, length = HEADER.unpack(header)
+            yield kind, timestamp, channel, rc, f.read(length)
+
+
+class capturelib:
+    """Lib wrapper that logs transfers to capture.
+    """
+
+    def __init__(self, lib, cap):
+        self.lib = lib
+        self.cap = cap
+        self.channels = {}
+
+    def __getattr__(self, name):
+        return getattr(self.lib, name)
+
+    def opened(self, handle, path, rc):
+        if rc >= 0:
+            self.channels[handle] = self.cap.channel(path)
+        return rc
+
+    def i2c_open(self, i2c, path):
+        return self.opened(i2c, path, self.lib.i2c_open(i2c, path))
+
+    def spi_open(self, spi, path, mode, maxSpeed):
+        return self.opened(spi, path, self.lib.spi_open(spi, path, mode, maxSpeed))
+
+    def spi_open_advanced(self, spi, path, *args):
+        return self.opened(spi, path, self.lib.spi_open_advanced(spi, path, *args))
+
+    def serial_open(self, serial, path, baudrate):
+        return self.opened(serial, path, self.lib.serial_open(serial, path, baudrate))
+
+    def serial_open_advanced(self, serial, path, *args):
+        return self.opened(serial, path, self.lib.serial_open_advanced(serial, path, *args))
+
+    def i2c_transfer(self, i2c, msgs, count):
+        timestamp = time.monotonic_ns()
+        rc = self.lib.i2c_transfer(i2c, msgs, count)
+        # Message set with data after the transfer (written or read)
+        parts = [COUNT.pack(count)]
+        for i in range(count):
+            msg = msgs[i]
+            parts.append(MSG.pack(msg.addr, msg.flags, msg.len))
+            parts.append(ffi.buffer(msg.buf, msg.len)[:])
+        self.cap.write(I2C, timestamp, self.channels.get(i2c, 0), rc, b"".join(parts))
+        return rc
+
+    def spi_transfer(self, spi, txbuf, rxbuf, length):
+        timestamp = time.monotonic_ns()
+        rc = self.lib.spi_transfer(spi, txbuf, rxbuf, length)
+        if txbuf != ffi.NULL:
+            tx = ffi.buffer(txbuf, length)[:]
+        else:
+            tx = bytes(length)
+        if rxbuf != ffi.NULL:
+            rx = ffi.buffer(rxbuf, length)[:]
+        else:
+            rx = bytes(length)
+        self.cap.write(SPI, timestamp, self.channels.get(spi, 0), rc, tx + rx)
+        return rc
+
+    def serial_read(self, serial, buf, length, timeoutMs):
+        timestamp = time.monotonic_ns()
+        rc = self.lib.serial_read(serial, buf, length, timeoutMs)
+        if rc > 0:
+            data = ffi.buffer(buf, rc)[:]
+        else:
+            data = b""
+        self.cap.write(SERIAL_READ, timestamp, self.channels.get(serial, 0), rc, data)
+        return rc
+
+    def serial_write(self, serial, buf, length):
+        timestamp = time.monotonic_ns()
+        rc = self.lib.serial_write(serial, buf, length)
+        self.cap.write(SERIAL_WRITE, timestamp, self.channels.get(serial, 0), rc, ffi.buffer(buf, length)[:])
+        return rc
+
+
+class capture:
+    """Capture file writer.
+    """
+
+    def __init__(self, path):
+        self.file = open(path, "wb")
+        self.file.write(MAGIC)
+        self.lock = threading.Lock()
+        self.paths = {}
+        self.bindings = []
+
+    def channel(self, path):
+        """Channel number for device path, logged on first use.
+        """
+        if not isinstance(path, bytes):
+            path = ffi.string(path)
+        with self.lock:
+            channel = self.paths.get(path)
+            if channel is None:
+                channel = len(self.paths) + 1
+                self.paths[path] = channel
+                self.file.write(HEADER.pack(OPEN, time.monotonic_ns(), channel, 0, len(path)))
+                self.file.write(path)
+        return channel
+
+    def write(self, kind, timestamp, channel, rc, payload):
+        with self.lock:
+            self.file.write(HEADER.pack(kind, timestamp, channel, rc, len(payload)))
+            self.file.write(payload)
+
+    def enable(self, binding):
+        """Capture transfers made through binding. Open devices after enable so
+        they get a channel.
+        """
+        binding.lib = capturelib(binding.lib, self)
+        self.bindings.append(binding)
+
+    def disable(self, binding):
+        if isinstance(binding.lib, capturelib):
+            binding.lib = binding.lib.lib
+        self.bindings.remove(binding)
+
+    def close(self):
+        for binding in list(self.bindings):
+            self.disable(binding)
+        with self.lock:
+            self.file.close()
+
+
+class replaylib:
+    """Lib that answers I2C, SPI and serial calls from a capture file.
+
+    Each device path opened is matched to its captured channel and transfers
+    are answered in order. realtime=True waits to reproduce the captured
+    spacing between calls, False runs at maximum speed.
+    """
+
+    I2C_M_RD = sim.i2clib.I2C_M_RD
+    I2C_ERROR_OPEN = sim.i2clib.I2C_ERROR_OPEN
+    I2C_ERROR_TRANSFER = sim.i2clib.I2C_ERROR_TRANSFER
+    SPI_MODE_0 = sim.spilib.SPI_MODE_0
+    SPI_MODE_1 = sim.spilib.SPI_MODE_1
+    SPI_MODE_2 = sim.spilib.SPI_MODE_2
+    SPI_MODE_3 = sim.spilib.SPI_MODE_3
+    SPI_ERROR_OPEN = sim.spilib.SPI_ERROR_OPEN
+    SPI_ERROR_TRANSFER = sim.spilib.SPI_ERROR_TRANSFER
+    SERIAL_ERROR_OPEN = sim.seriallib.SERIAL_ERROR_OPEN
+    SERIAL_ERROR_IO = sim.seriallib.SERIAL_ERROR_IO
+
+    def __init__(self, path, realtime=False):
+        self.realtime = realtime
+        self.paths = {}
+        self.queues = collections.defaultdict(collections.deque)
+        self.first = None
+        for kind, timestamp, channel, rc, payload in records(path):
+            if kind == OPEN:
+                self.paths[payload] = channel
+            else:
+                if self.first is None:
+                    self.first = timestamp
+                self.queues[(channel, kind)].append((timestamp, rc, payload))
+        self.startedAt = None
+        # Leftover serial bytes when reads ask for less than was captured
+        self.pending = {}
+
+    def wait(self, timestamp):
+        """Reproduce captured timing.
+        """
+        if not self.realtime:
+            return
+        now = time.monotonic_ns()
+        if self.startedAt is None:
+            self.startedAt = now
+        delay = (timestamp - self.first) - (now - self.startedAt)
+        if delay > 0:
+            time.sleep(delay / 1000000000)
+
+    def next(self, handle, kind, code, what):
+        queue = self.queues.get((handle.fd, kind))
+        if not queue:
+            sim.setError(handle, code, errno.ENODATA, "Replay %s past end of capture" % what)
+            return None
+        record = queue.popleft()
+        self.wait(record[0])
+        return record
+
+    def opened(self, handle, path, code):
+        channel = self.paths.get(path)
+        if channel is None:
+            return sim.setError(handle, code, errno.ENOENT, "Device \"%s\" not in capture" % path.decode('utf-8'))
+        handle.fd = channel
+        return 0
+
+    def i2c_open(self, i2c, path):
+        return self.opened(i2c, path, self.I2C_ERROR_OPEN)
+
+    def i2c_transfer(self, i2c, msgs, count):
+        record = self.next(i2c, I2C, self.I2C_ERROR_TRANSFER, "I2C transfer")
+        if record is None:
+            return self.I2C_ERROR_TRANSFER
+        timestamp, rc, payload = record
+        if rc < 0:
+            return sim.setError(i2c, rc, errno.EIO, "I2C transfer (captured error)")
+        offset = COUNT.size
+        if COUNT.unpack_from(payload)[0] != count:
+            return sim.setError(i2c, self.I2C_ERROR_TRANSFER, errno.EINVAL, "Replay message count mismatch")
+        for i in range(count):
+            addr, flags, length = MSG.unpack_from(payload, offset)
+            offset += MSG.size
+            msg = msgs[i]
+            if addr != msg.addr or length != msg.len:
+                return sim.setError(i2c, self.I2C_ERROR_TRANSFER, errno.EINVAL, "Replay message mismatch")
+            if flags & self.I2C_M_RD:
+                ffi.memmove(msg.buf, payload[offset:offset + length], length)
+            offset += length
+        return rc
+
+    def spi_open(self, spi, path, mode, maxSpeed):
+        return self.opened(spi, path, self.SPI_ERROR_OPEN)
+
+    def spi_open_advanced(self, spi, path, *args):
+        return self.opened(spi, path, self.SPI_ERROR_OPEN)
+
+    def spi_transfer(self, spi, txbuf, rxbuf, length):
+        record = self.next(spi, SPI, self.SPI_ERROR_TRANSFER, "SPI transfer")
+        if record is None:
+            return self.SPI_ERROR_TRANSFER
+        timestamp, rc, payload = record
+        if len(payload) != 2 * length:
+            return sim.setError(spi, self.SPI_ERROR_TRANSFER, errno.EINVAL, "Replay transfer length mismatch")
+        if rxbuf != ffi.NULL:
+            ffi.memmove(rxbuf, payload[length:], length)
+        return rc
+
+    def serial_open(self, serial, path, baudrate):
+        return self.opened(serial, path, self.SERIAL_ERROR_OPEN)
+
+    def serial_open_advanced(self, serial, path, *args):
+        return self.opened(serial, path, self.SERIAL_ERROR_OPEN)
+
+    def serial_read(self, serial, buf, length, timeoutMs):
+        data = self.pending.pop(serial.fd, None)
+        if data is None:
+            record = self.next(serial, SERIAL_READ, self.SERIAL_ERROR_IO, "serial read")
+            if record is None:
+                return self.SERIAL_ERROR_IO
+            timestamp, rc, data = record
+            if rc < 0:
+                return sim.setError(serial, rc, errno.EIO, "Reading serial port (captured error)")
+        if len(data) > length:
+            self.pending[serial.fd] = data[length:]
+            data = data[:length]
+        ffi.memmove(buf, data, len(data))
+        return len(data)
+
+    def serial_write(self, serial, buf, length):
+        record = self.next(serial, SERIAL_WRITE, self.SERIAL_ERROR_IO, "serial write")
+        if record is None:
+            return self.SERIAL_ERROR_IO
+        return record[1]
+
+    def close(self, handle):
+        handle.fd = -1
+        return 0
+
+    i2c_close = close
+    spi_close = close
+    serial_close = close
+
+    def errmsg(self, handle):
+        return handle.error.errmsg
+
+    i2c_errmsg = errmsg
+    spi_errmsg = errmsg
+    serial_errmsg = errmsg
+
+    def remaining(self):
+        """Records not replayed yet per (channel, kind).
+        """
+        return {key: len(queue) for key, queue in self.queues.items() if queue}
@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2018 Steven P. Goldsmith
+# See LICENSE.md for details.
+
+"""
+Cached I2C bus discovery
+-------------
+
+Scans every /dev/i2c-* bus at once (one thread per bus) with a one byte read
+probe per address, like i2cdetect -r, then identifies responders from a table
+of WHO_AM_I registers. The result is saved as JSON with a fingerprint per bus
+(device number and adapter name from sysfs), so the next start only rescans
+buses that changed. A cached bus is also rescanned when one of its cached
+addresses stops ACKing (one probe per device, catches removed devices) or the
+entry is older than maxAge seconds (catches added ones):
+
+    d = discovery.discovery()
+    for bus, addr in d.find("adxl345"):
+        ...
+
+Read probes are used because a quick write can change state on some devices
+(i.e. EEPROM write pointer). Devices that do not ACK a read are not found.
+"""
+
+import glob, json, os, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from libperiphery import libperipheryi2c
+
+DEFAULT_CACHE = os.path.join(os.path.expanduser("~"), ".cache", "userspaceio", "i2c.json")
+FIRST_ADDR = 0x03
+LAST_ADDR = 0x77
+
+# name, addresses, WHO_AM_I register, expected values
+signatures = [
+    ("mpu6050", (0x68, 0x69), 0x75, (0x68,)),
+    ("mpu6500", (0x68, 0x69), 0x75, (0x70,)),
+    ("mpu9250", (0x68, 0x69), 0x75, (0x71,)),
+    ("adxl345", (0x53, 0x1d), 0x00, (0xe5,)),
+    ("bmp280", (0x76, 0x77), 0xd0, (0x56, 0x57, 0x58)),
+    ("bme280", (0x76, 0x77), 0xd0, (0x60,)),
+    ("bmp180", (0x77,), 0xd0, (0x55,)),
+    ("hmc5883l", (0x1e,), 0x0a, (0x48,)),
+    ("l3gd20", (0x6a, 0x6b), 0x0f, (0xd4, 0xd7)),
+    ("lsm303", (0x19,), 0x0f, (0x33,)),
+]
+
+
+def fingerprint(path):
+    """Device number and adapter name of bus, None if it does not exist.
+    """
+    try:
+        rdev = os.stat(path).st_rdev
+    except OSError:
+        return None
+    name = ""
+    try:
+        with open("/sys/class/i2c-dev/%s/name" % os.path.basename(path)) as f:
+            name = f.read().strip()
+    except OSError:
+        pass
+    return "%d:%d:%s" % (os.major(rdev), os.minor(rdev), name)
+
+
+def loadJson(path):
+    """JSON file contents, {} if missing or corrupt.
+    """
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def saveJson(path, obj):
+    """Write JSON to a temporary file and rename it over path, so readers never
+    see a partial file.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp = "%s.%d.tmp" % (path, os.getpid())
+    with open(tmp, "w") as f:
+        json.dump(obj, f, indent=1, sort_keys=True)
+    os.rename(tmp, path)
+
+
+class discovery:
+    """Discovery service. i2c is a libperipheryi2c instance (or one with a
+    simulated lib), buses a list of bus paths (default all /dev/i2c-*).
+    """
+
+    def __init__(self, i2c=None, cachePath=DEFAULT_CACHE, buses=None, signatures=signatures, maxAge=86400.0):
+        if i2c is None:
+            i2c = libperipheryi2c.libperipheryi2c()
+        self.i2c = i2c
+        self.cachePath = cachePath
+        self.buses = buses
+        self.signatures = signatures
+        # Seconds a cached bus is trusted (None = until its fingerprint changes)
+        self.maxAge = maxAge
+        self.lock = threading.Lock()
+        self.devices = None
+        # bus path -> error of buses that could not be opened on the last scan
+        self.failed = {}
+
+    def busPaths(self):
+        if self.buses is not None:
+            return list(self.buses)
+        return sorted(glob.glob("/dev/i2c-*"), key=lambda path: int(path.rsplit("-", 1)[1]))
+
+    def probe(self, handle, addr, msgs, buf):
+        """True if addr ACKs a one byte read.
+        """
+        msgs[0].addr = addr
+        msgs[0].flags = self.i2c.lib.I2C_M_RD
+        msgs[0].len = 1
+        msgs[0].buf = buf
+        return self.i2c.lib.i2c_transfer(handle, msgs, 1) >= 0
+
+    def identify(self, handle, addr):
+        """Name from WHO_AM_I table or None.
+        """
+        for name, addresses, reg, values in self.signatures:
+            if addr in addresses:
+                try:
+                    if self.i2c.readReg(handle, addr, reg) in values:
+                        return name
+                except RuntimeError:
+                    pass
+        return None
+
+    def scanBus(self, path):
+        """{address: name or None} for responders on one bus or None if the
+        bus cannot be opened (error in failed).
+        """
+        found = {}
+        try:
+            handle = self.i2c.open(path)
+        except RuntimeError as e:
+            self.failed[path] = str(e)
+            return None
+        try:
+            msgs = self.i2c.ffi.new("struct i2c_msg[1]")
+            buf = self.i2c.ffi.new("uint8_t[1]")
+            for addr in range(FIRST_ADDR, LAST_ADDR + 1):
+                if self.probe(handle, addr, msgs, buf):
+                    found[addr] = self.identify(handle, addr)
+        finally:
+            self.i2c.close(handle)
+        return found
+
+    def verifyBus(self, path, addrs):
+        """True if every cached address on the bus still ACKs.
+        """
+        try:
+            handle = self.i2c.open(path)
+        except RuntimeError:
+            return False
+        try:
+            msgs = self.i2c.ffi.new("struct i2c_msg[1]")
+            buf = self.i2c.ffi.new("uint8_t[1]")
+            return all(self.probe(handle, addr, msgs, buf) for addr in addrs)
+        finally:
+            self.i2c.close(handle)
+
+    def fresh(self, entry, now):
+        return self.maxAge is None or now - entry.get("time", 0) <= self.maxAge
+
+    def load(self):
+        return loadJson(self.cachePath)
+
+    def save(self, cache):
+        saveJson(self.cachePath, cache)
+
+    def scan(self, force=False):
+        """{bus path: {address: name or None}}. Buses with an unchanged
+        fingerprint come from the cache unless force. Buses that cannot be
+        opened are left out (and out of the cache so they are tried again).
+        """
+        with self.lock:
+            self.failed = {}
+            cache = self.load()
+            paths = self.busPaths()
+            prints = {path: fingerprint(path) for path in paths}
+            now = time.time()
+            stale = [path for path in paths
+                     if force or path not in cache or cache[path]["fingerprint"] != prints[path]
+                     or not self.fresh(cache[path], now)]
+            cached = [path for path in paths if path not in stale and cache[path]["devices"]]
+            if cached:
+                with ThreadPoolExecutor(max_workers=len(cached)) as executor:
+                    checks = executor.map(lambda path: self.verifyBus(path, [int(addr, 16) for addr
+                                                                             in cache[path]["devices"]]), cached)
+                    stale += [path for path, ok in zip(cached, checks) if not ok]
+            if stale:
+                with ThreadPoolExecutor(max_workers=len(stale)) as executor:
+                    results = dict(zip(stale, executor.map(self.scanBus, stale)))
+                for path, found in results.items():
+                    if found is None:
+                        cache.pop(path, None)
+                    else:
+                        cache[path] = {"fingerprint": prints[path], "time": now,
+                                       "devices": {"0x%02x" % addr: name for addr, name in found.items()}}
+            # Forget buses that went away
+            changed = stale or set(cache) != set(paths)
+            cache = {path: cache[path] for path in paths if path in cache}
+            if changed:
+                self.save(cache)
+            self.devices = {path: {int(addr, 16): name for addr, name in entry["devices"].items()}
+                            for path, entry in cache.items()}
+            return self.devices
+
+    def find(self, name):
+        """[(bus path, address)] of devices identified as name.
+        """
+        if self.devices is None:
+            self.scan()
+        return [(path, addr) for path, found in self.devices.items() for addr, name2 in sorted(found.items())
+                if name2 == name]
+
+    def invalidate(self, path=None):
+        """Drop cached results for one bus or all, next scan probes again.
+        """
+        with self.lock:
+            cache = self.load()
+            if path is None:
+                cache = {}
+            else:
+                cache.pop(path, None)
+            self.save(cache)
+            self.devices = None
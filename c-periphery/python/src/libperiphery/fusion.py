@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2018 Steven P. Goldsmith
+# See LICENSE.md for details.
+
+"""
+IMU sensor fusion on sample batches
+-------------
+
+Complementary, Madgwick and Mahony orientation filters that take batches of
+timestamps (ns), accel (N x 3, any unit) and gyro (N x 3, º/s like
+mpu6050.getGyroData) and keep filter state across batches.
+
+The complementary filter is linear, so a whole batch is solved in closed form
+with NumPy (cumulative sums in blocks). Madgwick and Mahony are non linear
+recursions, so normalization, unit conversion and dt are done vectorized for
+the batch and the per sample step runs on plain floats, which is several times
+faster than NumPy on 4 element vectors.
+"""
+
+import math
+import numpy as np
+
+
+def deltas(timestamps, last, nominal):
+    """dt in seconds for each sample. First sample uses the previous batch's
+    last timestamp or nominal.
+    """
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    dt = np.empty(len(timestamps))
+    if len(timestamps) == 0:
+        return dt
+    if last is None:
+        dt[0] = nominal
+    else:
+        dt[0] = (timestamps[0] - last) / 1e9
+    dt[1:] = np.diff(timestamps) / 1e9
+    return dt
+
+
+def normalize(vectors):
+    """Normalize rows, zero rows stay zero.
+    """
+    vectors = np.asarray(vectors, dtype=np.float64)
+    norm = np.sqrt(np.einsum("ij,ij->i", vectors, vectors))
+    norm[norm == 0.0] = 1.0
+    return vectors / norm[:, None]
+
+
+def euler(quat):
+    """Quaternion (N x 4, w x y z) to roll, pitch, yaw in radians (N x 3).
+    """
+    w, x, y, z = quat[:, 0], quat[:, 1], quat[:, 2], quat[:, 3]
+    result = np.empty((len(quat), 3))
+    result[:, 0] = np.arctan2(2.0 * (w * x + y * z), 1.0 - 2.0 * (x * x + y * y))
+    result[:, 1] = np.arcsin(np.clip(2.0 * (w * y - z * x), -1.0, 1.0))
+    result[:, 2] = np.arctan2(2.0 * (w * z + x * y), 1.0 - 2.0 * (y * y + z * z))
+    return result
+
+
+def quaternion(angles):
+    """Roll, pitch, yaw in radians (N x 3) to quaternion (N x 4, w x y z).
+    """
+    half = np.asarray(angles) * 0.5
+    cr, cp, cy = np.cos(half[:, 0]), np.cos(half[:, 1]), np.cos(half[:, 2])
+    sr, sp, sy = np.sin(half[:, 0]), np.sin(half[:, 1]), np.sin(half[:, 2])
+    result = np.empty((len(half), 4))
+    result[:, 0] = cr * cp * cy + sr * sp * sy
+    result[:, 1] = sr * cp * cy - cr * sp * sy
+    result[:, 2] = cr * sp * cy + sr * cp * sy
+    result[:, 3] = cr * cp * sy - sr * sp * cy
+    return result
+
+
+class complementary:
+    """Complementary filter for roll and pitch, gyro integration for yaw.
+
+    angle[n] = alpha * (angle[n - 1] + rate[n] * dt[n]) + (1 - alpha) * accelAngle[n]
+    """
+
+    def __init__(self, alpha=0.98, rate=1000.0):
+        """rate is the nominal sample rate used for the very first dt.
+        """
+        self.alpha = alpha
+        self.nominal = 1.0 / rate
+        self.angles = None
+        self.last = None
+        # Keep alpha^-block within 1e6 so cumsum does not lose precision
+        if alpha >= 1.0:
+            self.block = 1024
+        else:
+            self.block = max(1, min(1024, int(math.log(1e6) / -math.log(alpha))))
+
+    def update(self, timestamps, accel, gyro):
+        """Return roll, pitch, yaw (N x 3 radians).
+        """
+        accel = np.asarray(accel, dtype=np.float64)
+        rates = np.radians(np.asarray(gyro, dtype=np.float64))
+        n = len(accel)
+        result = np.empty((n, 3))
+        if n == 0:
+            return result
+        dt = deltas(timestamps, self.last, self.nominal)
+        self.last = int(timestamps[-1])
+        accelAngles = np.empty((n, 2))
+        accelAngles[:, 0] = np.arctan2(accel[:, 1], accel[:, 2])
+        accelAngles[:, 1] = np.arctan2(-accel[:, 0], np.hypot(accel[:, 1], accel[:, 2]))
+        if self.angles is None:
+            # Start from the accelerometer
+            self.angles = np.array([accelAngles[0, 0], accelAngles[0, 1], 0.0])
+        alpha = self.alpha
+        u = alpha * rates[:, :2] * dt[:, None] + (1.0 - alpha) * accelAngles
+        x0 = self.angles[:2].copy()
+        for start in range(0, n, self.block):
+            end = min(n, start + self.block)
+            k = np.arange(end - start, dtype=np.float64)
+            # x[k] = alpha^k * (alpha * x0 + sum(u[j] * alpha^-j, j <= k))
+            powers = alpha ** k
+            block = powers[:, None] * (alpha * x0 + np.cumsum(u[start:end] / powers[:, None], axis=0))
+            result[start:end, :2] = block
+            x0 = block[-1]
+        result[:, 2] = self.angles[2] + np.cumsum(rates[:, 2] * dt)
+        self.angles = result[-1].copy()
+        return result
+
+    def quaternion(self, angles):
+        return quaternion(angles)
+
+
+class madgwick:
+    """Madgwick gradient descent IMU filter (gyro + accel).
+    """
+
+    def __init__(self, beta=0.1, rate=1000.0):
+        self.beta = beta
+        self.nominal = 1.0 / rate
+        self.q = [1.0, 0.0, 0.0, 0.0]
+        self.last = None
+
+    def update(self, timestamps, accel, gyro):
+        """Return quaternion array (N x 4, w x y z).
+        """
+        n = len(accel)
+        result = np.empty((n, 4))
+        if n == 0:
+            return result
+        dt = deltas(timestamps, self.last, self.nominal).tolist()
+        self.last = int(timestamps[-1])
+        acc = normalize(accel).tolist()
+        rates = np.radians(np.asarray(gyro, dtype=np.float64)).tolist()
+        beta = self.beta
+        sqrt = math.sqrt
+        q0, q1, q2, q3 = self.q
+        out = [None] * n
+        for i in range(n):
+            gx, gy, gz = rates[i]
+            ax, ay, az = acc[i]
+            qDot1 = 0.5 * (-q1 * gx - q2 * gy - q3 * gz)
+            qDot2 = 0.5 * (q0 * gx + q2 * gz - q3 * gy)
+            qDot3 = 0.5 * (q0 * gy - q1 * gz + q3 * gx)
+            qDot4 = 0.5 * (q0 * gz + q1 * gy - q2 * gx)
+            if ax or ay or az:
+                _2q0 = 2.0 * q0
+                _2q1 = 2.0 * q1
+                _2q2 = 2.0 * q2
+                _2q3 = 2.0 * q3
+                _4q0 = 4.0 * q0
+                _4q1 = 4.0 * q1
+                _4q2 = 4.0 * q2
+                _8q1 = 8.0 * q1
+                _8q2 = 8.0 * q2
+                q0q0 = q0 * q0
+                q1q1 = q1 * q1
+                q2q2 = q2 * q2
+                q3q3 = q3 * q3
+                s0 = _4q0 * q2q2 + _2q2 * ax + _4q0 * q1q1 - _2q1 * ay
+                s1 = _4q1 * q3q3 - _2q3 * ax + 4.0 * q0q0 * q1 - _2q0 * ay - _4q1 + _8q1 * q1q1 + _8q1 * q2q2 + _4q1 * az
+                s2 = 4.0 * q0q0 * q2 + _2q0 * ax + _4q2 * q3q3 - _2q3 * ay - _4q2 + _8q2 * q1q1 + _8q2 * q2q2 + _4q2 * az
+                s3 = 4.0 * q1q1 * q3 - _2q1 * ax + 4.0 * q2q2 * q3 - _2q2 * ay
+                norm = sqrt(s0 * s0 + s1 * s1 + s2 * s2 + s3 * s3)
+                if norm:
+                    norm = beta / norm
+                    qDot1 -= norm * s0
+                    qDot2 -= norm * s1
+                    qDot3 -= norm * s2
+                    qDot4 -= norm * s3
+            d = dt[i]
+            q0 += qDot1 * d
+            q1 += qDot2 * d
+            q2 += qDot3 * d
+            q3 += qDot4 * d
+            norm = 1.0 / sqrt(q0 * q0 + q1 * q1 + q2 * q2 + q3 * q3)
+            q0 *= norm
+            q1 *= norm
+            q2 *= norm
+            q3 *= norm
+            out[i] = (q0, q1, q2, q3)
+        self.q = [q0, q1, q2, q3]
+        result[:] = out
+        return result
+
+
+class mahony:
+    """Mahony complementary (PI feedback) IMU filter (gyro + accel).
+    """
+
+    def __init__(self, kp=0.5, ki=0.0, rate=1000.0):
+        self.kp = kp
+        self.ki = ki
+        self.nominal = 1.0 / rate
+        self.q = [1.0, 0.0, 0.0, 0.0]
+        self.integral = [0.0, 0.0, 0.0]
+        self.last = None
+
+    def update(self, timestamps, accel, gyro):
+        """Return quaternion array (N x 4, w x y z).
+        """
+        n = len(accel)
+        result = np.empty((n, 4))
+        if n == 0:
+            return result
+        dt = deltas(timestamps, self.last, self.nominal).tolist()
+        self.last = int(timestamps[-1])
+        acc = normalize(accel).tolist()
+        rates = np.radians(np.asarray(gyro, dtype=np.float64)).tolist()
+        twoKp = 2.0 * self.kp
+        twoKi = 2.0 * self.ki
+        ix, iy, iz = self.integral
+        sqrt = math.sqrt
+        q0, q1, q2, q3 = self.q
+        out = [None] * n
+        for i in range(n):
+            gx, gy, gz = rates[i]
+            ax, ay, az = acc[i]
+            d = dt[i]
+            if ax or ay or az:
+                # Estimated direction of gravity and error from measured
+                halfvx = q1 * q3 - q0 * q2
+                halfvy = q0 * q1 + q2 * q3
+                halfvz = q0 * q0 - 0.5 + q3 * q3
+                halfex = ay * halfvz - az * halfvy
+                halfey = az * halfvx - ax * halfvz
+                halfez = ax * halfvy - ay * halfvx
+                if twoKi > 0.0:
+                    ix += twoKi * halfex * d
+                    iy += twoKi * halfey * d
+                    iz += twoKi * halfez * d
+                    gx += ix
+                    gy += iy
+                    gz += iz
+                gx += twoKp * halfex
+                gy += twoKp * halfey
+                gz += twoKp * halfez
+            gx *= 0.5 * d
+            gy *= 0.5 * d
+            gz *= 0.5 * d
+            qa = q0
+            qb = q1
+            qc = q2
+            q0 += -qb * gx - qc * gy - q3 * gz
+            q1 += qa * gx + qc * gz - q3 * gy
+            q2 += qa * gy - qb * gz + q3 * gx
+            q3 += qa * gz + qb * gy - qc * gx
+            norm = 1.0 / sqrt(q0 * q0 + q1 * q1 + q2 * q2 + q3 * q3)
+            q0 *= norm
+            q1 *= norm
+            q2 *= norm
+            q3 *= norm
+            out[i] = (q0, q1, q2, q3)
+        self.q = [q0, q1, q2, q3]
+        self.integral = [ix, iy, iz]
+        result[:] = out
+        return result
@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2018 Steven P. Goldsmith
+# See LICENSE.md for details.
+
+"""
+Thread safe shared I2C bus manager
+-------------
+
+Owns one i2c_t handle per /dev/i2c-N and serializes transactions with a
+priority scheduler. Each device gets a client that looks like a
+libperipheryi2c instance, so existing drivers work unchanged. Pass the client
+to the driver's constructor (drivers keep the i2c object they were built with):
+
+    bus = i2cbus.i2cbus()
+    client = bus.client("mpu6050", priority=0, rate=1000)
+    mpu = mpu6050.mpu6050(client)
+    handle = client.open("/dev/i2c-0")
+    # Clear then set range without another client in between
+    client.call(handle, mpu.setAccelRange, handle, 0x68, 0x08)
+
+Every transfer holds the bus on its own. Driver methods that take several
+transfers (read-modify-write, clear then set) go through call() or
+transaction() so no other client gets in between.
+
+Lower priority number wins. A client over its rate budget (transactions per
+second) drops behind every in budget client until its tokens refill, so a slow
+device cannot starve a high rate one.
+"""
+
+import heapq, itertools, threading, time
+from libperiphery import libperipheryi2c
+
+
+class scheduler:
+    """Priority arbitration for one bus. Holds are reentrant per thread so
+    multi-step sequences can nest helper calls.
+    """
+
+    # Added to priority when client is over budget
+    overBudget = 1000000
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.waiting = []
+        self.seq = itertools.count()
+        self.owner = None
+        self.depth = 0
+        self.acquiredAt = 0
+        self.holder = None
+        self.startedAt = time.monotonic_ns()
+        self.busyNs = 0
+        self.transactions = 0
+
+    def acquire(self, client):
+        ident = threading.get_ident()
+        with self.cond:
+            if self.owner == ident:
+                self.depth += 1
+                return
+            start = time.monotonic_ns()
+            priority = client.priority
+            if not client.take(start):
+                priority += self.overBudget
+            entry = (priority, next(self.seq), ident)
+            heapq.heappush(self.waiting, entry)
+            while self.owner is not None or self.waiting[0] is not entry:
+                self.cond.wait()
+            heapq.heappop(self.waiting)
+            self.owner = ident
+            self.depth = 1
+            self.acquiredAt = time.monotonic_ns()
+            client.waitNs += self.acquiredAt - start
+            self.holder = client
+
+    def release(self):
+        with self.cond:
+            self.depth -= 1
+            if self.depth == 0:
+                held = time.monotonic_ns() - self.acquiredAt
+                self.busyNs += held
+                self.transactions += 1
+                self.holder.busyNs += held
+                self.holder.transactions += 1
+                self.owner = None
+                self.cond.notify_all()
+
+    def utilization(self):
+        """Fraction of wall time bus was held since start.
+        """
+        elapsed = time.monotonic_ns() - self.startedAt
+        if elapsed <= 0:
+            return 0.0
+        return self.busyNs / elapsed
+
+
+class bushold:
+    """Context manager holding the bus for a multi-step sequence.
+    """
+
+    def __init__(self, bus, client):
+        self.bus = bus
+        self.client = client
+
+    def __enter__(self):
+        self.bus.scheduler.acquire(self.client)
+        return self.bus.handle
+
+    def __exit__(self, excType, excValue, traceback):
+        self.bus.scheduler.release()
+        return False
+
+
+class bus:
+    """One physical bus.
+    """
+
+    def __init__(self, path, handle):
+        self.path = path
+        self.handle = handle
+        self.refs = 0
+        self.scheduler = scheduler()
+
+
+class lockedlib:
+    """Pass through to the manager's lib with i2c_transfer serialized on the
+    handle's bus. Lets code that calls lib directly (i.e. trigger.i2cread)
+    share the bus too.
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    def __getattr__(self, name):
+        return getattr(self.client.manager.i2c.lib, name)
+
+    def i2c_transfer(self, handle, msgs, count):
+        client = self.client
+        bus = client.manager.handles[handle]
+        bus.scheduler.acquire(client)
+        try:
+            return client.manager.i2c.lib.i2c_transfer(handle, msgs, count)
+        finally:
+            bus.scheduler.release()
+
+
+class i2cclient(libperipheryi2c.libperipheryi2c):
+    """Per device view of the bus manager with the libperipheryi2c interface.
+    libperipheryi2c.__init__ is not called since cdef and dlopen are shared
+    through the manager.
+    """
+
+    def __init__(self, manager, name, priority, rate, burst):
+        self.manager = manager
+        self.name = name
+        self.priority = priority
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.refilledAt = time.monotonic_ns()
+        self.ffi = manager.i2c.ffi
+        self.lib = lockedlib(self)
+        self.waitNs = 0
+        self.busyNs = 0
+        self.transactions = 0
+
+    def take(self, now):
+        """Token bucket check. Returns False if over rate budget. Called with
+        scheduler lock held.
+        """
+        if self.rate is None:
+            return True
+        self.tokens = min(self.burst, self.tokens + (now - self.refilledAt) * self.rate / 1e9)
+        self.refilledAt = now
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return True
+        return False
+
+    def open(self, device):
+        """Return shared handle for device.
+        """
+        return self.manager.open(device)
+
+    def close(self, handle):
+        """Release shared handle. Bus is closed when last client closes it.
+        """
+        self.manager.close(handle)
+
+    def transaction(self, handle):
+        """Hold bus for a multi-step sequence.
+
+        with client.transaction(handle):
+            client.writeReg(handle, addr, reg, value)
+            value = client.readReg(handle, addr, reg)
+        """
+        return bushold(self.manager.handles[handle], self)
+
+    def call(self, handle, func, *args, **kwargs):
+        """Run func (i.e. a multi-write driver method) holding handle's bus
+        and return its result.
+        """
+        with self.transaction(handle):
+            return func(*args, **kwargs)
+
+    def readWord(self, handle, addr, reg):
+        """Read two i2c registers and combine them without another device
+        getting in between.
+        """
+        with self.transaction(handle):
+            return libperipheryi2c.libperipheryi2c.readWord(self, handle, addr, reg)
+
+
+class i2cbus:
+    """Shared I2C bus manager.
+    """
+
+    def __init__(self, i2c=None):
+        """i2c is a libperipheryi2c instance to share (default creates one).
+        """
+        if i2c is None:
+            i2c = libperipheryi2c.libperipheryi2c()
+        self.i2c = i2c
+        self.lock = threading.Lock()
+        self.buses = {}
+        self.handles = {}
+        self.clients = []
+
+    def client(self, name, priority=10, rate=None, burst=None):
+        """Return libperipheryi2c compatible client for a device. rate is the
+        transaction budget per second (None = unlimited) and burst the bucket
+        size (default one second of budget).
+        """
+        if burst is None:
+            if rate is None:
+                burst = 1
+            else:
+                burst = max(1.0, float(rate))
+        c = i2cclient(self, name, priority, rate, burst)
+        with self.lock:
+            self.clients.append(c)
+        return c
+
+    def open(self, device):
+        """Return shared handle, opening bus on first use.
+        """
+        with self.lock:
+            b = self.buses.get(device)
+            if b is None:
+                handle = self.i2c.open(device)
+                b = bus(device, handle)
+                self.buses[device] = b
+                self.handles[handle] = b
+            b.refs += 1
+            return b.handle
+
+    def close(self, handle):
+        """Drop reference and close bus when no longer used.
+        """
+        with self.lock:
+            b = self.handles[handle]
+            b.refs -= 1
+            if b.refs == 0:
+                self.i2c.close(handle)
+                del self.buses[b.path]
+                del self.handles[handle]
+
+    def closeAll(self):
+        """Close every bus regardless of references.
+        """
+        with self.lock:
+            for b in self.buses.values():
+                self.i2c.close(b.handle)
+            self.buses = {}
+            self.handles = {}
+
+    def utilization(self):
+        """Return per bus utilization and per client share of bus time.
+        """
+        result = {}
+        with self.lock:
+            for path, b in self.buses.items():
+                s = b.scheduler
+                result[path] = {"utilization": s.utilization(), "transactions": s.transactions, "busy_ns": s.busyNs}
+            clients = {}
+            for c in self.clients:
+                clients[c.name] = {"priority": c.priority, "rate": c.rate, "transactions": c.transactions,
+                                   "busy_ns": c.busyNs, "wait_ns": c.waitNs}
+        return {"buses": result, "clients": clients}
@@ -0,0 +1,340 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2018 Steven P. Goldsmith
+# See LICENSE.md for details.
+
+"""
+Opt-in per call instrumentation for the CFFI bindings
+-------------
+
+enable() swaps a binding's lib (libperipheryi2c, libperipheryspi,
+libperipheryserial, libperipherymmio or libpwmio) for a proxy that times each
+C call and records call count, bytes moved, errors and a latency histogram per
+device and operation. Nothing is wrapped until enable() is called, so there is
+no cost when disabled.
+
+Objects that copied the lib reference (i.e. self.lib = self.pwm.lib in the
+demos) before enable() keep calling the raw lib. Enable first.
+"""
+
+import os, threading, time
+
+
+def transferSize(args, rc):
+    """i2c_transfer(i2c, msgs, count)
+    """
+    msgs = args[1]
+    size = 0
+    for i in range(args[2]):
+        size += msgs[i].len
+    return size
+
+
+def lenArgSize(args, rc):
+    """Functions with length as last argument.
+    """
+    return args[-1]
+
+
+def ioSize(args, rc):
+    """serial_read/serial_write return bytes transferred.
+    """
+    if rc > 0:
+        return rc
+    return 0
+
+
+# Bytes moved by each C function, everything else counts as 0
+sizers = {
+    "i2c_transfer": transferSize,
+    "spi_transfer": lenArgSize,
+    "serial_read": ioSize,
+    "serial_write": ioSize,
+    "mmio_read": lenArgSize,
+    "mmio_write": lenArgSize,
+    "mmio_read32": lambda args, rc: 4,
+    "mmio_write32": lambda args, rc: 4,
+    "mmio_read16": lambda args, rc: 2,
+    "mmio_write16": lambda args, rc: 2,
+    "mmio_read8": lambda args, rc: 1,
+    "mmio_write8": lambda args, rc: 1,
+}
+
+
+def openName(name, args):
+    """Device name from open call arguments or None if not an open call.
+    """
+    if name in ("i2c_open", "spi_open", "spi_open_advanced", "serial_open", "serial_open_advanced"):
+        return args[1].decode('utf-8')
+    elif name == "mmio_open":
+        return "mmio@0x%x" % args[1]
+    return None
+
+
+class libproxy:
+    """Wrap a CFFI lib so each function call is timed and passed to sinks.
+
+    Sinks implement record(device, op, start, end, size, error) with start and
+    end from time.monotonic_ns(). Constants and non callables pass straight
+    through.
+    """
+
+    def __init__(self, lib):
+        self.lib = lib
+        self.sinks = []
+        # Handle (i2c_t*, spi_t*, etc.) to device name
+        self.devices = {}
+
+    def __getattr__(self, name):
+        attr = getattr(self.lib, name)
+        if callable(attr):
+            attr = self.wrap(name, attr)
+        # Cache so __getattr__ is only hit once per name
+        setattr(self, name, attr)
+        return attr
+
+    def device(self, args):
+        """Device name from first argument. libpwmio uses device number and
+        libperiphery uses a handle.
+        """
+        if not args:
+            return "lib"
+        first = args[0]
+        if isinstance(first, int):
+            return "pwmchip%d" % first
+        return self.devices.get(first, "unknown")
+
+    def wrap(self, name, func):
+        """Return timed version of func.
+        """
+        sizer = sizers.get(name)
+        sinks = self.sinks
+        devices = self.devices
+        now = time.monotonic_ns
+
+        def timed(*args):
+            start = now()
+            rc = func(*args)
+            end = now()
+            error = isinstance(rc, int) and rc < 0
+            if sizer and not error:
+                size = sizer(args, rc)
+            else:
+                size = 0
+            if not error:
+                device = openName(name, args)
+                if device:
+                    devices[args[0]] = device
+            device = self.device(args)
+            for sink in sinks:
+                sink.record(device, name, start, end, size, error)
+            return rc
+
+        return timed
+
+
+def attach(binding, sink):
+    """Add sink to binding, installing a proxy if needed.
+    """
+    if not isinstance(binding.lib, libproxy):
+        binding.lib = libproxy(binding.lib)
+    if sink not in binding.lib.sinks:
+        binding.lib.sinks.append(sink)
+
+
+def detach(binding, sink):
+    """Remove sink and restore raw lib when no sinks are left.
+    """
+    if isinstance(binding.lib, libproxy):
+        if sink in binding.lib.sinks:
+            binding.lib.sinks.remove(sink)
+        if not binding.lib.sinks:
+            binding.lib = binding.lib.lib
+
+
+class histogram:
+    """HDR style log linear histogram of nanosecond values.
+
+    Values below 2^subBits get their own bucket and every power of two above
+    that is split into 2^(subBits - 1) buckets, so relative error is bounded by
+    2^(1 - subBits) (12.5% with the default of 4).
+    """
+
+    def __init__(self, subBits=4, maxBits=40):
+        self.subBits = subBits
+        self.half = 1 << (subBits - 1)
+        self.maxValue = (1 << maxBits) - 1
+        self.counts = [0] * ((maxBits - subBits + 2) * self.half)
+        self.total = 0
+        self.sum = 0
+        self.max = 0
+
+    def index(self, value):
+        """Bucket index for value.
+        """
+        shift = value.bit_length() - self.subBits
+        if shift <= 0:
+            return value
+        return shift * self.half + (value >> shift)
+
+    def lower(self, index):
+        """Lowest value in bucket.
+        """
+        if index < 2 * self.half:
+            return index
+        shift = index // self.half - 1
+        return (index - shift * self.half) << shift
+
+    def upper(self, index):
+        """Highest value in bucket.
+        """
+        return self.lower(index + 1) - 1
+
+    def record(self, value):
+        if value > self.maxValue:
+            value = self.maxValue
+        self.counts[self.index(value)] += 1
+        self.total += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, percent):
+        """Value at percent (0 - 100) using bucket upper bound.
+        """
+        if self.total == 0:
+            return 0
+        target = max(1, int(self.total * percent / 100.0 + 0.5))
+        count = 0
+        for i, c in enumerate(self.counts):
+            count += c
+            if count >= target:
+                return min(self.upper(i), self.max)
+        return self.max
+
+    def cumulative(self, bounds):
+        """Cumulative counts <= each bound for Prometheus buckets.
+        """
+        result = []
+        count = 0
+        i = 0
+        last = len(self.counts)
+        for bound in bounds:
+            while i < last and self.upper(i) <= bound:
+                count += self.counts[i]
+                i += 1
+            result.append(count)
+        return result
+
+    def snapshot(self):
+        if self.total:
+            mean = self.sum / self.total
+        else:
+            mean = 0
+        return {"count": self.total, "mean": mean, "max": self.max, "p50": self.percentile(50),
+                "p90": self.percentile(90), "p99": self.percentile(99), "p999": self.percentile(99.9)}
+
+
+class opstats:
+    """Counters for one device and operation.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.bytes = 0
+        self.latency = histogram()
+
+
+class instrument:
+    """Aggregate call statistics sink. The stats dict is only changed and
+    walked under lock. Per op counters are bumped without it to keep the hot
+    path cheap, so with several threads on one op snapshot() and prometheus()
+    are best effort (a count may lag or miss a concurrent increment).
+    """
+
+    # Prometheus latency bucket bounds in ns
+    bounds = (1000, 5000, 10000, 50000, 100000, 500000, 1000000, 5000000, 10000000, 50000000, 100000000, 1000000000)
+
+    def __init__(self):
+        self.stats = {}
+        self.lock = threading.Lock()
+        self.bindings = []
+
+    def enable(self, binding):
+        """Start recording calls made through binding.lib.
+        """
+        attach(binding, self)
+        if binding not in self.bindings:
+            self.bindings.append(binding)
+
+    def disable(self, binding=None):
+        """Stop recording binding or all bindings if None.
+        """
+        if binding is None:
+            bindings = list(self.bindings)
+        else:
+            bindings = [binding]
+        for b in bindings:
+            detach(b, self)
+            if b in self.bindings:
+                self.bindings.remove(b)
+
+    def record(self, device, op, start, end, size, error):
+        key = (device, op)
+        stats = self.stats.get(key)
+        if stats is None:
+            with self.lock:
+                stats = self.stats.setdefault(key, opstats())
+        stats.calls += 1
+        if error:
+            stats.errors += 1
+        stats.bytes += size
+        stats.latency.record(end - start)
+
+    def reset(self):
+        with self.lock:
+            self.stats = {}
+
+    def snapshot(self):
+        """Return {device: {op: {calls, errors, bytes, latency}}}.
+        """
+        result = {}
+        with self.lock:
+            for (device, op), stats in sorted(list(self.stats.items())):
+                result.setdefault(device, {})[op] = {"calls": stats.calls, "errors": stats.errors,
+                                                     "bytes": stats.bytes, "latency_ns": stats.latency.snapshot()}
+        return result
+
+    def prometheus(self, prefix="userspaceio"):
+        """Return Prometheus text exposition format.
+        """
+        lines = []
+        with self.lock:
+            items = sorted(list(self.stats.items()))
+        for name, attr, help in (("calls_total", "calls", "C calls"), ("errors_total", "errors", "C calls returning error"),
+                                 ("bytes_total", "bytes", "Bytes transferred")):
+            lines.append("# HELP %s_%s %s" % (prefix, name, help))
+            lines.append("# TYPE %s_%s counter" % (prefix, name))
+            for (device, op), stats in items:
+                lines.append('%s_%s{device="%s",op="%s"} %d' % (prefix, name, device, op, getattr(stats, attr)))
+        lines.append("# HELP %s_latency_seconds C call latency" % prefix)
+        lines.append("# TYPE %s_latency_seconds histogram" % prefix)
+        for (device, op), stats in items:
+            labels = 'device="%s",op="%s"' % (device, op)
+            hist = stats.latency
+            for bound, count in zip(self.bounds, hist.cumulative(self.bounds)):
+                lines.append('%s_latency_seconds_bucket{%s,le="%g"} %d' % (prefix, labels, bound / 1e9, count))
+            lines.append('%s_latency_seconds_bucket{%s,le="+Inf"} %d' % (prefix, labels, hist.total))
+            lines.append('%s_latency_seconds_sum{%s} %.9f' % (prefix, labels, hist.sum / 1e9))
+            lines.append('%s_latency_seconds_count{%s} %d' % (prefix, labels, hist.total))
+        return "\n".join(lines) + "\n"
+
+    def writePrometheus(self, path, prefix="userspaceio"):
+        """Write Prometheus text file for node exporter textfile collector.
+        Written to temp file and renamed so the collector never sees a partial
+        file.
+        """
+        tmp = "%s.%d.tmp" % (path, os.getpid())
+        with open(tmp, "w") as f:
+            f.write(self.prometheus(prefix))
+        os.rename(tmp, path)
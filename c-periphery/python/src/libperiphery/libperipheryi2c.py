@@ -14,7 +14,10 @@ from cffi import FFI
 
 class libperipheryi2c:
 
-    def __init__(self):
+    def __init__(self, lib=None):
+        """lib replaces the shared library, i.e. a simulated backend from
+        libperiphery.sim.
+        """
         self.ffi = FFI()
         # Specify each C function, struct and constant you want a Python binding for
         # Copy-n-paste with minor edits
@@ -69,7 +72,9 @@ class libperipheryi2c:
 
         const char *i2c_errmsg(i2c_t *i2c);
         """)
-        self.lib = self.ffi.dlopen("/usr/local/lib/libperipheryi2c.so")
+        if lib is None:
+            lib = self.ffi.dlopen("/usr/local/lib/libperipheryi2c.so")
+        self.lib = lib
 
     def open(self, device):
         """Open I2C device and return handle.
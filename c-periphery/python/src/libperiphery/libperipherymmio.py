@@ -14,7 +14,10 @@ from cffi import FFI
 
 class libperipherymmio:
 
-    def __init__(self):
+    def __init__(self, lib=None):
+        """lib replaces the shared library, i.e. a simulated backend from
+        libperiphery.sim.
+        """
         self.ffi = FFI()
         # Specify each C function, struct and constant you want a Python binding for
         # Copy-n-paste with minor edits
@@ -76,4 +79,6 @@ class libperipherymmio:
         
         const char *mmio_errmsg(mmio_t *mmio);
         """)
-        self.lib = self.ffi.dlopen("/usr/local/lib/libperipherymmio.so")
+        if lib is None:
+            lib = self.ffi.dlopen("/usr/local/lib/libperipherymmio.so")
+        self.lib = lib
@@ -14,7 +14,10 @@ from cffi import FFI
 
 class libperipheryserial:
 
-    def __init__(self):
+    def __init__(self, lib=None):
+        """lib replaces the shared library, i.e. a simulated backend from
+        libperiphery.sim.
+        """
         self.ffi = FFI()
         # Specify each C function, struct and constant you want a Python binding for
         # Copy-n-paste with minor edits
@@ -96,7 +99,9 @@ class libperipheryserial:
         
         const char *serial_errmsg(serial_t *serial);
         """)
-        self.lib = self.ffi.dlopen("/usr/local/lib/libperipheryserial.so")
+        if lib is None:
+            lib = self.ffi.dlopen("/usr/local/lib/libperipheryserial.so")
+        self.lib = lib
 
     def open(self, device, baudrate):
         """Open serial device and return handle.
@@ -14,7 +14,10 @@ from cffi import FFI
 
 class libperipheryspi:
 
-    def __init__(self):
+    def __init__(self, lib=None):
+        """lib replaces the shared library, i.e. a simulated backend from
+        libperiphery.sim.
+        """
         self.ffi = FFI()
         # Specify each C function, struct and constant you want a Python binding for
         # Copy-n-paste with minor edits
@@ -86,7 +89,9 @@ class libperipheryspi:
         
         const char *spi_errmsg(spi_t *spi);
         """)
-        self.lib = self.ffi.dlopen("/usr/local/lib/libperipheryspi.so")
+        if lib is None:
+            lib = self.ffi.dlopen("/usr/local/lib/libperipheryspi.so")
+        self.lib = lib
         
     def open(self, device, mode, maxSpeed):
         """Open SPI device and return handle.
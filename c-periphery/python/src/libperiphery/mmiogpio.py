@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2018 Steven P. Goldsmith
+# See LICENSE.md for details.
+
+"""
+MMIO GPIO
+-------------
+
+Pin set/clear/read by writing the SoC's port controller registers directly
+through libperipherymmio, for bit-banged clocked protocols (HX711, shift
+registers, etc.). Register layout comes from a per SoC descriptor. Each pin
+precomputes its register word index and mask, so an operation is one word read
+and/or write on a mapped pointer (no C call per access):
+
+    gpio = mmiogpio.mmiogpio(mmiogpio.H3)
+    led = gpio.pin("PA17")
+    led.output()
+    led.set()
+
+    # Test without hardware: registers live in a plain file
+    gpio = mmiogpio.mmiogpio(mmiogpio.H3, files={"PIO": "/tmp/pio", "R_PIO": "/tmp/rpio"})
+
+Writes are read-modify-write of the bank's data register (the H3 has no set or
+clear registers), so do not share a bank with pins the kernel drives at the
+same time. Needs root (/dev/mem). Python can not meet WS2812 timing, use SPI or
+PWM for that.
+"""
+
+import mmap, os
+from libperiphery import libperipherymmio
+
+INPUT = 0
+OUTPUT = 1
+DISABLED = 7
+PULL_OFF = 0
+PULL_UP = 1
+PULL_DOWN = 2
+
+
+class socdesc:
+    """Port controller layout.
+
+    blocks maps block name to (physical base, map size), banks maps bank letter
+    to (block, bank index in block) and chips maps libgpiod chip number to its
+    first bank letter.
+    """
+
+    def __init__(self, name, blocks, banks, chips, stride, cfg, dat, drv, pul, cfgBits=4):
+        self.name = name
+        self.blocks = blocks
+        self.banks = banks
+        self.chips = chips
+        self.stride = stride
+        self.cfg = cfg
+        self.dat = dat
+        self.drv = drv
+        self.pul = pul
+        self.cfgBits = cfgBits
+
+
+# Allwinner H2+/H3 (NanoPi Duo, Orange Pi). PL is in the R_PIO block and is
+# libgpiod gpiochip1, the rest are gpiochip0 at bank * 32 + pin.
+H3 = socdesc("Allwinner H2+/H3",
+             blocks={"PIO": (0x01c20800, 0x400), "R_PIO": (0x01f02c00, 0x400)},
+             banks={"A": ("PIO", 0), "C": ("PIO", 2), "D": ("PIO", 3), "E": ("PIO", 4), "F": ("PIO", 5),
+                    "G": ("PIO", 6), "L": ("R_PIO", 0)},
+             chips={0: "A", 1: "L"},
+             stride=0x24, cfg=0x00, dat=0x10, drv=0x14, pul=0x1c)
+
+
+class pin:
+    """One pin with precomputed register word indexes and masks.
+    """
+
+    def __init__(self, name, words, bankOffset, bit, desc):
+        self.name = name
+        self.words = words
+        self.bit = bit
+        self.mask = 1 << bit
+        self.dat = (bankOffset + desc.dat) // 4
+        perReg = 32 // desc.cfgBits
+        self.cfg = (bankOffset + desc.cfg) // 4 + bit // perReg
+        self.cfgShift = (bit % perReg) * desc.cfgBits
+        self.cfgMask = ((1 << desc.cfgBits) - 1) << self.cfgShift
+        self.pul = (bankOffset + desc.pul) // 4 + bit // 16
+        self.pulShift = (bit % 16) * 2
+
+    def mode(self, value):
+        """Set function (INPUT, OUTPUT, DISABLED or SoC function number).
+        """
+        words = self.words
+        words[self.cfg] = (words[self.cfg] & ~self.cfgMask) | ((value << self.cfgShift) & self.cfgMask)
+
+    def getMode(self):
+        return (self.words[self.cfg] & self.cfgMask) >> self.cfgShift
+
+    def input(self):
+        self.mode(INPUT)
+
+    def output(self):
+        self.mode(OUTPUT)
+
+    def pull(self, value):
+        words = self.words
+        words[self.pul] = (words[self.pul] & ~(0x3 << self.pulShift)) | (value << self.pulShift)
+
+    def set(self):
+        self.words[self.dat] |= self.mask
+
+    def clear(self):
+        self.words[self.dat] &= ~self.mask & 0xffffffff
+
+    def write(self, value):
+        if value:
+            self.words[self.dat] |= self.mask
+        else:
+            self.words[self.dat] &= ~self.mask & 0xffffffff
+
+    def read(self):
+        return (self.words[self.dat] >> self.bit) & 1
+
+
+class mmiogpio:
+    """Maps the descriptor's blocks with libperipherymmio or, for tests,
+    files (block name -> path, created zero filled if missing).
+    """
+
+    def __init__(self, desc=H3, mmio=None, files=None):
+        self.desc = desc
+        self.handles = []
+        self.maps = []
+        self.views = {}
+        for block, (base, size) in desc.blocks.items():
+            if files is not None:
+                self.views[block] = self.mapFile(files[block], size)
+            else:
+                if mmio is None:
+                    mmio = libperipherymmio.libperipherymmio()
+                handle = mmio.ffi.new("mmio_t *")
+                if mmio.lib.mmio_open(handle, base, size) < 0:
+                    raise RuntimeError(mmio.ffi.string(mmio.lib.mmio_errmsg(handle)).decode('utf-8'))
+                self.handles.append(handle)
+                # The binding's uint32_t is unsigned long, so use unsigned int for 32 bit words
+                self.views[block] = mmio.ffi.cast("unsigned int *", mmio.lib.mmio_ptr(handle))
+        self.mmio = mmio
+
+    def mapFile(self, path, size):
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+            mm = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        base = memoryview(mm)
+        view = base.cast("I")
+        self.maps.append((mm, base, view))
+        return view
+
+    def pin(self, name):
+        """Pin by name, i.e. "PA6" or "PL3".
+        """
+        bank = name[1:2].upper()
+        if name[0].upper() != "P" or bank not in self.desc.banks:
+            raise ValueError("Unknown pin %s for %s" % (name, self.desc.name))
+        if not name[2:].isdigit() or int(name[2:]) > 31:
+            raise ValueError("Unknown pin %s for %s" % (name, self.desc.name))
+        block, index = self.desc.banks[bank]
+        return pin(name.upper(), self.views[block], index * self.desc.stride, int(name[2:]), self.desc)
+
+    def line(self, chip, line):
+        """Pin by libgpiod chip number and line offset.
+        """
+        first = self.desc.chips[chip]
+        return self.pin("P%s%d" % (chr(ord(first) + line // 32), line % 32))
+
+    def close(self):
+        self.views.clear()
+        # Release views first, pins made from them can not be used after close
+        for mm, base, view in self.maps:
+            view.release()
+            base.release()
+            mm.close()
+        self.maps = []
+        for handle in self.handles:
+            self.mmio.lib.mmio_close(handle)
+        self.handles = []
+
+
+class bitbang:
+    """Clocked serial on a data pin and a clock pin. Word values for every
+    clock edge are computed before the first write, so the transfer loop only
+    stores precomputed words. Fastest when both pins are in the same bank (one
+    register per edge).
+
+    This is still a Python loop, one store per edge, not native code. The
+    bindings are ABI mode cffi (no compiler on the target), so edge timing is
+    whatever the interpreter gives and is not guaranteed.
+    """
+
+    def __init__(self, data, clock, msbFirst=True, hold=0):
+        """hold repeats each write to stretch clock phases on fast SoCs.
+        """
+        self.data = data
+        self.clock = clock
+        self.msbFirst = msbFirst
+        self.hold = hold
+        self.sameBank = data.words is clock.words and data.dat == clock.dat
+
+    def bits(self, value, count):
+        if self.msbFirst:
+            return [(value >> (count - 1 - i)) & 1 for i in range(count)]
+        return [(value >> i) & 1 for i in range(count)]
+
+    def shiftOut(self, data, bitsPerWord=8):
+        """Clock out each value in data (idle clock low, data valid on rising
+        edge).
+        """
+        bits = []
+        for value in data:
+            bits.extend(self.bits(value, bitsPerWord))
+        writes = 1 + self.hold
+        if self.sameBank:
+            words = self.data.words
+            dat = self.data.dat
+            base = words[dat] & ~(self.data.mask | self.clock.mask) & 0xffffffff
+            low = (base, base | self.data.mask)
+            clockMask = self.clock.mask
+            sequence = []
+            for bit in bits:
+                word = low[bit]
+                sequence.extend([word] * writes)
+                sequence.extend([word | clockMask] * writes)
+            sequence.append(base)
+            for word in sequence:
+                words[dat] = word
+        else:
+            dataPin = self.data
+            clockPin = self.clock
+            clockPin.clear()
+            for bit in bits:
+                dataPin.write(bit)
+                for i in range(writes):
+                    clockPin.set()
+                for i in range(writes):
+                    clockPin.clear()
+
+    def shiftIn(self, count):
+        """Clock in count bits (sampled after the rising edge), i.e. HX711
+        with count = 24 plus gain pulses.
+        """
+        clock = self.clock
+        data = self.data
+        value = 0
+        for i in range(count):
+            clock.set()
+            for j in range(self.hold):
+                clock.set()
+            bit = data.read()
+            clock.clear()
+            for j in range(self.hold):
+                clock.clear()
+            if self.msbFirst:
+                value = (value << 1) | bit
+            else:
+                value |= bit << i
+        return value
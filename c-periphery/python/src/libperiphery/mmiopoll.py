@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2018 Steven P. Goldsmith
+# See LICENSE.md for details.
+
+"""
+MMIO register wait engine
+-------------
+
+Wait until registers match (mask, value) conditions. The engine spins for a
+budget of spinNs reading the mapped words directly (no C call per read), then
+sleeps with exponential backoff until the timeout. Every wait returns how many
+reads and sleeps it took and how long, and the poller keeps totals and a wait
+time histogram to tune latency against CPU use:
+
+    mmio = libperipherymmio.libperipherymmio()
+    handle = mmio.ffi.new("mmio_t *")
+    mmio.lib.mmio_open(handle, 0x01c20800, 0x400)
+    words = mmiopoll.wordview(mmio, handle)
+    poll = mmiopoll.poller(spinNs=20000)
+    result = poll.wait([(words, 0x10, 0x40, 0x40)], timeout=0.01)
+
+Words can also be a mmiogpio file backed view for testing.
+"""
+
+import time
+from libperiphery import instrument
+
+
+def wordview(mmio, handle):
+    """32 bit word pointer for an open mmio_t (the binding's uint32_t is
+    unsigned long, so unsigned int is used).
+    """
+    return mmio.ffi.cast("unsigned int *", mmio.lib.mmio_ptr(handle))
+
+
+class waitresult:
+    """Outcome of one wait.
+    """
+
+    __slots__ = ("ok", "reads", "sleeps", "elapsed", "spun")
+
+    def __init__(self, ok, reads, sleeps, elapsed, spun):
+        self.ok = ok
+        self.reads = reads
+        self.sleeps = sleeps
+        # ns
+        self.elapsed = elapsed
+        # True if satisfied in the spin phase
+        self.spun = spun
+
+    def __repr__(self):
+        return "waitresult(ok=%s, reads=%d, sleeps=%d, elapsed=%d ns, spun=%s)" % (
+            self.ok, self.reads, self.sleeps, self.elapsed, self.spun)
+
+
+class poller:
+    """Spin then back off wait engine.
+    """
+
+    def __init__(self, spinNs=50000, minSleep=0.00001, maxSleep=0.01, factor=2.0, checkEvery=64):
+        """spinNs is the busy wait budget, sleeps start at minSleep and grow by
+        factor up to maxSleep. The clock is read every checkEvery spins.
+        """
+        self.spinNs = spinNs
+        self.minSleep = minSleep
+        self.maxSleep = maxSleep
+        self.factor = factor
+        self.checkEvery = checkEvery
+        self.reset()
+
+    def reset(self):
+        self.waits = 0
+        self.timeouts = 0
+        self.spinHits = 0
+        self.reads = 0
+        self.sleeps = 0
+        self.histogram = instrument.histogram()
+
+    def compile(self, conditions):
+        """(words, byte offset, mask, value) to (words, index, mask, value).
+        """
+        return [(words, offset // 4, mask, value & mask) for words, offset, mask, value in conditions]
+
+    def check(self, compiled, anyMatch):
+        if anyMatch:
+            for words, index, mask, value in compiled:
+                if words[index] & mask == value:
+                    return True
+            return False
+        for words, index, mask, value in compiled:
+            if words[index] & mask != value:
+                return False
+        return True
+
+    def wait(self, conditions, timeout=1.0, anyMatch=False):
+        """Wait until all (or any) conditions match or timeout seconds pass.
+        """
+        clock = time.perf_counter_ns
+        start = clock()
+        deadline = start + int(timeout * 1000000000)
+        spinEnd = min(deadline, start + self.spinNs)
+        reads = 0
+        sleeps = 0
+        ok = False
+        spun = False
+        checkEvery = self.checkEvery
+        if len(conditions) == 1 and not anyMatch:
+            # Single register fast path
+            words, offset, mask, value = conditions[0]
+            index = offset // 4
+            value &= mask
+            now = start
+            while now < spinEnd:
+                for i in range(checkEvery):
+                    if words[index] & mask == value:
+                        ok = True
+                        reads += i + 1
+                        break
+                else:
+                    reads += checkEvery
+                    now = clock()
+                    continue
+                break
+        else:
+            compiled = self.compile(conditions)
+            check = self.check
+            now = start
+            while now < spinEnd:
+                for i in range(checkEvery):
+                    if check(compiled, anyMatch):
+                        ok = True
+                        reads += i + 1
+                        break
+                else:
+                    reads += checkEvery
+                    now = clock()
+                    continue
+                break
+        if ok:
+            spun = True
+        else:
+            compiled = self.compile(conditions)
+            delay = self.minSleep
+            while True:
+                reads += 1
+                if self.check(compiled, anyMatch):
+                    ok = True
+                    break
+                now = clock()
+                if now >= deadline:
+                    break
+                time.sleep(min(delay, (deadline - now) / 1000000000))
+                sleeps += 1
+                delay = min(delay * self.factor, self.maxSleep)
+        elapsed = clock() - start
+        self.waits += 1
+        self.reads += reads
+        self.sleeps += sleeps
+        if spun:
+            self.spinHits += 1
+        if not ok:
+            self.timeouts += 1
+        self.histogram.record(elapsed)
+        return waitresult(ok, reads, sleeps, elapsed, spun)
+
+    def waitFor(self, words, offset, mask, value, timeout=1.0):
+        """Wait on one register, raise TimeoutError if it never matches.
+        """
+        result = self.wait([(words, offset, mask, value)], timeout)
+        if not result.ok:
+            raise TimeoutError("Register 0x%x & 0x%x != 0x%x after %.6f seconds" % (offset, mask, value, timeout))
+        return result
+
+    def stats(self):
+        """Totals and wait time percentiles in ns.
+        """
+        return {"waits": self.waits, "timeouts": self.timeouts, "spinHits": self.spinHits, "reads": self.reads,
+                "sleeps": self.sleeps, "p50": self.histogram.percentile(50), "p99": self.histogram.percentile(99),
+                "max": self.histogram.max}
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2018 Steven P. Goldsmith
+# See LICENSE.md for details.
+
+"""
+Columnar chunked sample recorder
+-------------
+
+Appends timestamped structured batches (i.e. shmring.sampledtype) to
+preallocated memory mapped .npy files, one per field, in chunk directories.
+A chunk is rotated when it is full or spans more than chunkSecs. index.json
+lists each chunk's record count and first/last timestamp, so a time slice is
+found without opening every chunk and returned as zero copy memmaps:
+
+    rec = recorder.recorder("/data/imu", shmring.sampledtype, chunkSecs=3600)
+    rec.write(batch)
+    ...
+    rec.close()
+
+    for chunk in recorder.reader("/data/imu").slice(start, end):
+        chunk["values"][:, 0]
+"""
+
+import json, os
+import numpy as np
+
+INDEX = "index.json"
+
+
+def fieldPath(directory, chunk, field):
+    return os.path.join(directory, chunk, "%s.npy" % field)
+
+
+class recorder:
+    """Writer. The dtype must have an int64 "timestamp" field (ns) and batches
+    must be in time order.
+    """
+
+    def __init__(self, directory, dtype, chunkRecords=1048576, chunkSecs=None):
+        self.directory = directory
+        self.dtype = np.dtype(dtype)
+        if "timestamp" not in self.dtype.names:
+            raise ValueError("dtype needs a timestamp field")
+        self.chunkRecords = chunkRecords
+        if chunkSecs is None:
+            self.chunkNs = None
+        else:
+            self.chunkNs = int(chunkSecs * 1000000000)
+        os.makedirs(directory, exist_ok=True)
+        self.chunks = []
+        indexPath = os.path.join(directory, INDEX)
+        if os.path.exists(indexPath):
+            with open(indexPath) as f:
+                index = json.load(f)
+            if np.dtype([tuple(d) for d in index["dtype"]]) != self.dtype:
+                raise ValueError("%s was recorded with a different dtype" % directory)
+            self.chunks = index["chunks"]
+        self.columns = None
+        self.chunk = None
+
+    def open(self):
+        """Start new chunk with preallocated columns.
+        """
+        name = "chunk-%06d" % len(self.chunks)
+        os.makedirs(os.path.join(self.directory, name))
+        self.columns = {}
+        for field in self.dtype.names:
+            sub = self.dtype.fields[field][0]
+            self.columns[field] = np.lib.format.open_memmap(fieldPath(self.directory, name, field), mode="w+",
+                                                            dtype=sub.base, shape=(self.chunkRecords,) + sub.shape)
+        self.chunk = {"name": name, "count": 0, "first": None, "last": None}
+        self.chunks.append(self.chunk)
+
+    def rotate(self):
+        self.flush()
+        self.columns = None
+        self.chunk = None
+
+    def write(self, batch):
+        """Bulk copy structured batch into the columns, rotating as needed.
+        """
+        n = len(batch)
+        pos = 0
+        timestamps = batch["timestamp"]
+        while pos < n:
+            if self.chunk is None:
+                self.open()
+            chunk = self.chunk
+            count = chunk["count"]
+            take = min(n - pos, self.chunkRecords - count)
+            if self.chunkNs is not None:
+                first = chunk["first"]
+                if first is None:
+                    first = int(timestamps[pos])
+                # Records that still fit in the chunk's time span
+                take = min(take, int(np.searchsorted(timestamps[pos:pos + take], first + self.chunkNs)))
+            if take == 0:
+                self.rotate()
+                continue
+            for field, column in self.columns.items():
+                column[count:count + take] = batch[field][pos:pos + take]
+            if chunk["first"] is None:
+                chunk["first"] = int(timestamps[pos])
+            chunk["last"] = int(timestamps[pos + take - 1])
+            chunk["count"] = count + take
+            pos += take
+            if chunk["count"] == self.chunkRecords:
+                self.rotate()
+
+    def flush(self):
+        """Flush columns and publish index so readers see written records.
+        """
+        if self.columns is not None:
+            for column in self.columns.values():
+                column.flush()
+        index = {"dtype": self.dtype.descr, "chunks": self.chunks}
+        path = os.path.join(self.directory, INDEX)
+        tmp = "%s.%d.tmp" % (path, os.getpid())
+        with open(tmp, "w") as f:
+            json.dump(index, f)
+        os.rename(tmp, path)
+
+    def close(self):
+        self.rotate()
+
+
+class reader:
+    """Zero copy time slice reader.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.reload()
+
+    def reload(self):
+        """Re-read index (i.e. while recorder is running).
+        """
+        with open(os.path.join(self.directory, INDEX)) as f:
+            index = json.load(f)
+        self.dtype = np.dtype([tuple(d) for d in index["dtype"]])
+        self.chunks = [chunk for chunk in index["chunks"] if chunk["count"]]
+
+    def columns(self, chunk):
+        """Field -> read only memmap of the chunk's written records.
+        """
+        return {field: np.load(fieldPath(self.directory, chunk["name"], field), mmap_mode="r")[:chunk["count"]]
+                for field in self.dtype.names}
+
+    def slice(self, start=None, end=None):
+        """Yield column dicts for records with start <= timestamp < end, one
+        per chunk.
+        """
+        for chunk in self.chunks:
+            if start is not None and chunk["last"] < start:
+                continue
+            if end is not None and chunk["first"] >= end:
+                break
+            columns = self.columns(chunk)
+            timestamps = columns["timestamp"]
+            low = 0 if start is None else int(np.searchsorted(timestamps, start))
+            high = len(timestamps) if end is None else int(np.searchsorted(timestamps, end))
+            if low < high:
+                yield {field: column[low:high] for field, column in columns.items()}
+
+    def read(self, start=None, end=None):
+        """Time slice copied into one structured array.
+        """
+        parts = list(self.slice(start, end))
+        result = np.empty(sum(len(part["timestamp"]) for part in parts), dtype=self.dtype)
+        pos = 0
+        for part in parts:
+            n = len(part["timestamp"])
+            for field, column in part.items():
+                result[field][pos:pos + n] = column
+            pos += n
+        return result
@@ -0,0 +1,351 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2018 Steven P. Goldsmith
+# See LICENSE.md for details.
+
+"""
+Declarative register maps
+-------------
+
+A device is described once as registers (address, width, sign, byte order,
+scale) with named bit fields. regdriver turns a list of register names into a
+compiled burst: adjacent registers are read in one I2C transaction, raw values
+come from one precompiled struct.unpack and scaling is a multiply/add per value
+(no per field branching). Scales that depend on a range field are not cached:
+each read also reads the range registers (one small transfer, adjacent ones are
+joined) and picks the read compiled for those values, so range changes made
+outside the driver (i2c.writeReg, another driver, a bus client) are seen. A per
+register affine correction (calibration) is folded into the same constants:
+
+    registers = regmap.devicemap("adxl345", [
+        regmap.register("DATA_FORMAT", 0x31, fields=[regmap.field("RANGE", 0, 2)]),
+        regmap.register("DATAX", 0x32, 2, True, "<", 0.0039),
+        ...])
+    regs = regmap.regdriver(registers, i2c)
+    x, y, z = regs.read(handle, 0x53, "DATAX", "DATAY", "DATAZ")
+    regs.setField(handle, 0x53, "DATA_FORMAT", "RANGE", 1)
+"""
+
+import struct
+import numpy as np
+from libperiphery import samples
+
+# (width, signed) -> struct code
+CODES = {(1, False): "B", (1, True): "b", (2, False): "H", (2, True): "h", (4, False): "I", (4, True): "i"}
+
+
+class field:
+    """Bit field of a register.
+    """
+
+    def __init__(self, name, shift, width=1):
+        self.name = name
+        self.shift = shift
+        self.width = width
+        self.mask = ((1 << width) - 1) << shift
+
+
+class rangescale:
+    """Scale picked by a range field. lsbs is LSB per unit indexed by field
+    value (datasheet order), i.e. (16384.0, 8192.0, 4096.0, 2048.0).
+    """
+
+    def __init__(self, register, field, lsbs):
+        self.register = register
+        self.field = field
+        self.scales = tuple(1.0 / lsb for lsb in lsbs)
+
+
+class register:
+    """Register or multi-byte value. scale is units per LSB or a rangescale.
+    Set readClear on registers that change state when read (interrupt status,
+    FIFO data) so they are read on their own.
+    """
+
+    def __init__(self, name, addr, width=1, signed=False, endian=">", scale=1.0, offset=0.0, fields=(),
+                 readClear=False):
+        if (width, signed) not in CODES:
+            raise ValueError("Unsupported width %d for %s" % (width, name))
+        self.name = name
+        self.addr = addr
+        self.width = width
+        self.signed = signed
+        self.endian = endian
+        self.scale = scale
+        self.offset = offset
+        self.fields = {f.name: f for f in fields}
+        self.readClear = readClear
+        self.code = CODES[(width, signed)]
+
+
+class devicemap:
+    """Registers of one device by name.
+    """
+
+    def __init__(self, name, registers):
+        self.name = name
+        self.registers = {r.name: r for r in registers}
+
+    def __getitem__(self, name):
+        return self.registers[name]
+
+    def fieldOf(self, reg, name):
+        return self.registers[reg].fields[name]
+
+
+class span:
+    """Contiguous register range read in one transaction.
+    """
+
+    def __init__(self, i2c, handle, addr, regs):
+        start = regs[0].addr
+        self.length = max(r.addr + r.width for r in regs) - start
+        self.reader = samples.blockreader(i2c, handle, addr, start, self.length)
+        # One struct per run of equal byte order
+        self.structs = []
+        pos = 0
+        fmt = ""
+        endian = regs[0].endian
+        segmentStart = 0
+        for r in regs:
+            if r.endian != endian:
+                self.structs.append((struct.Struct(endian + fmt), segmentStart))
+                endian = r.endian
+                fmt = ""
+                segmentStart = pos
+            gap = r.addr - start - pos
+            fmt += "%dx" % gap if gap else ""
+            fmt += r.code
+            pos = r.addr - start + r.width
+        self.structs.append((struct.Struct(endian + fmt), segmentStart))
+        self.dtype = np.dtype({"names": [r.name for r in regs],
+                               "formats": [r.endian + ("i" if r.signed else "u") + str(r.width) for r in regs],
+                               "offsets": [r.addr - start for r in regs], "itemsize": self.length})
+
+    def readRaw(self):
+        data = self.reader.read()
+        if len(self.structs) == 1:
+            return self.structs[0][0].unpack(data)
+        values = ()
+        for s, offset in self.structs:
+            values += s.unpack_from(data, offset)
+        return values
+
+
+class burst:
+    """Compiled read of a list of registers (see regdriver.burst).
+    """
+
+    def __init__(self, driver, handle, addr, names, maxGap):
+        self.driver = driver
+        self.handle = handle
+        self.addr = addr
+        self.names = tuple(names)
+        self.registers = [driver.map[name] for name in names]
+        ordered = sorted(set(self.registers), key=lambda r: r.addr)
+        # Coalesce into spans, read clear registers stand alone
+        groups = []
+        for r in ordered:
+            if groups and not r.readClear and not groups[-1][-1].readClear:
+                last = groups[-1][-1]
+                if r.addr - (last.addr + last.width) <= maxGap and r.addr >= last.addr + last.width:
+                    groups[-1].append(r)
+                    continue
+            groups.append([r])
+        self.spans = [span(driver.i2c, handle, addr, group) for group in groups]
+        flat = [r for group in groups for r in group]
+        self.order = [flat.index(r) for r in self.registers]
+        self.direct = len(self.spans) == 1 and self.order == list(range(len(flat)))
+        # Range registers the scales depend on, read with every scaled read
+        self.ranges = tuple(sorted({r.scale.register for r in self.registers if isinstance(r.scale, rangescale)},
+                                   key=lambda name: driver.map[name].addr))
+        self.rangeBurst = driver.burst(handle, addr, self.ranges) if self.ranges else None
+        # Range register values -> compiled read
+        self.compiled = {}
+
+    def readRaw(self):
+        """Raw integers in requested order.
+        """
+        if len(self.spans) == 1:
+            values = self.spans[0].readRaw()
+        else:
+            values = ()
+            for s in self.spans:
+                values += s.readRaw()
+        if self.direct:
+            return values
+        return tuple(values[i] for i in self.order)
+
+    def rangeValues(self):
+        """Current raw values of the range registers (() if none).
+        """
+        if self.rangeBurst is None:
+            return ()
+        return self.rangeBurst.readRaw()
+
+    def resolve(self, values=None):
+        """(scale, offset) of each register with the driver's affine
+        correction folded in. values are the range register values (read if
+        None).
+        """
+        if values is None:
+            values = self.rangeValues()
+        ranges = dict(zip(self.ranges, values))
+        affine = self.driver.affine.get((self.handle, self.addr), {})
+        scales = []
+        for r in self.registers:
+            scale = self.driver.scaleOf(self.handle, self.addr, r, ranges)
+            gain, bias = affine.get(r.name, (1.0, 0.0))
+            scales.append((scale * gain, r.offset * gain + bias))
+        return scales
+
+    def compile(self, values=()):
+        """Generate a read function with scales and offsets for the range
+        register values as constants, so a read is one transfer, one unpack and
+        one list display.
+        """
+        scales = self.resolve(values)
+        if len(self.spans) == 1 and len(self.spans[0].structs) == 1:
+            # Unpack straight from the block in address order
+            namespace = {"unpack": self.spans[0].structs[0][0].unpack, "block": self.spans[0].reader.read}
+            source = "unpack(block())"
+            count = len(self.spans[0].dtype.names)
+            order = self.order
+        else:
+            namespace = {"raw": self.readRaw}
+            source = "raw()"
+            count = len(self.registers)
+            order = range(count)
+        names = ["v%d" % i for i in range(count)]
+        terms = []
+        for index, (scale, offset) in zip(order, scales):
+            term = names[index]
+            if scale != 1.0:
+                term += " * %r" % scale
+            if offset:
+                term += " + %r" % offset
+            terms.append(term)
+        exec("def read():\n    %s, = %s\n    return [%s]\n" % (", ".join(names), source, ", ".join(terms)), namespace)
+        self.compiled[values] = namespace["read"]
+        return namespace["read"]
+
+    def read(self):
+        """Scaled values in requested order. Without range registers the
+        compiled read replaces this method, otherwise the range registers are
+        read first and pick the compiled read for their values.
+        """
+        if self.rangeBurst is None:
+            self.read = self.compile()
+            return self.read()
+        values = self.rangeBurst.readRaw()
+        read = self.compiled.get(values)
+        if read is None:
+            read = self.compile(values)
+        return read()
+
+    def reset(self):
+        """Drop compiled reads (i.e. after the affine correction changes).
+        """
+        self.compiled = {}
+        self.__dict__.pop("read", None)
+
+    def decode(self, raw):
+        """Scaled {name: array} from N x length raw blocks (single span only,
+        i.e. rows filled by spans[0].reader.readInto).
+        """
+        if len(self.spans) != 1:
+            raise ValueError("Batch decode needs registers in one span")
+        rows = np.asarray(raw, dtype=np.uint8).reshape(-1, self.spans[0].length)
+        records = rows.view(self.spans[0].dtype).reshape(-1)
+        scales = self.resolve()
+        return {r.name: records[r.name] * scale + offset for r, (scale, offset) in zip(self.registers, scales)}
+
+
+class regdriver:
+    """Generic driver for a devicemap. i2c is any libperipheryi2c compatible
+    object. maxGap is how many unrequested bytes may be read to join two
+    registers into one transaction.
+    """
+
+    def __init__(self, devmap, i2c, maxGap=0):
+        self.map = devmap
+        self.i2c = i2c
+        self.maxGap = maxGap
+        # (handle, addr, names) -> burst
+        self.bursts = {}
+        # (handle, addr) -> {register name: (gain, bias)}
+        self.affine = {}
+
+    def burst(self, handle, addr, names):
+        key = (handle, addr, tuple(names))
+        b = self.bursts.get(key)
+        if b is None:
+            b = burst(self, handle, addr, names, self.maxGap)
+            self.bursts[key] = b
+        return b
+
+    def read(self, handle, addr, *names):
+        """Scaled values of registers as a list.
+        """
+        return self.burst(handle, addr, names).read()
+
+    def readRaw(self, handle, addr, *names):
+        """Raw (sign extended) values of registers as a tuple.
+        """
+        return self.burst(handle, addr, names).readRaw()
+
+    def readReg(self, handle, addr, name):
+        return self.burst(handle, addr, (name,)).readRaw()[0]
+
+    def write(self, handle, addr, name, value):
+        """Write raw value to register (multi-byte values in one transaction).
+        """
+        r = self.map[name]
+        if r.width == 1:
+            self.i2c.writeReg(handle, addr, r.addr, value & 0xff)
+        else:
+            data = struct.pack(r.endian + r.code, value)
+            buf = self.i2c.ffi.new("uint8_t[]", bytes([r.addr]) + data)
+            msgs = self.i2c.ffi.new("struct i2c_msg[]", 1)
+            msgs[0].addr = addr
+            msgs[0].flags = 0x00
+            msgs[0].len = len(data) + 1
+            msgs[0].buf = buf
+            if self.i2c.lib.i2c_transfer(handle, msgs, 1) < 0:
+                raise RuntimeError(self.i2c.ffi.string(self.i2c.lib.i2c_errmsg(handle)).decode('utf-8'))
+
+    def getField(self, handle, addr, reg, name):
+        f = self.map.fieldOf(reg, name)
+        return (self.readReg(handle, addr, reg) & f.mask) >> f.shift
+
+    def setField(self, handle, addr, reg, name, value):
+        """Read-modify-write one field.
+        """
+        f = self.map.fieldOf(reg, name)
+        current = self.readReg(handle, addr, reg)
+        self.write(handle, addr, reg, (current & ~f.mask) | ((value << f.shift) & f.mask))
+
+    def scaleOf(self, handle, addr, r, ranges=None):
+        """Units per LSB of register r. A range register is taken from ranges
+        ({register name: raw value}) or read from the device, never cached.
+        """
+        scale = r.scale
+        if isinstance(scale, rangescale):
+            if ranges and scale.register in ranges:
+                value = ranges[scale.register]
+            else:
+                value = self.readReg(handle, addr, scale.register)
+            f = self.map.fieldOf(scale.register, scale.field)
+            return scale.scales[(value & f.mask) >> f.shift]
+        return scale
+
+    def setAffine(self, handle, addr, corrections):
+        """Apply value * gain + bias after scaling, corrections is {register
+        name: (gain, bias)} (None or empty to remove).
+        """
+        if corrections:
+            self.affine[(handle, addr)] = dict(corrections)
+        else:
+            self.affine.pop((handle, addr), None)
+        for key, b in self.bursts.items():
+            if key[:2] == (handle, addr):
+                b.reset()
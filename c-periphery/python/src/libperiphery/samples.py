@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2018 Steven P. Goldsmith
+# See LICENSE.md for details.
+
+"""
+Sample containers and batch decode
+-------------
+
+Single readings are __slots__ records (no per instance dict). Streams use a
+preallocated samplebatch: raw register blocks are read straight into a NumPy
+byte array (no copy) and the whole batch is decoded to physical units at once
+into a structured array:
+
+    batch = samples.samplebatch(samples.imudtype, 14, 1000)
+    data = mpu.readBatch(handle, 0x68, batch)
+    data["accel"][:, 2]
+
+Units are g for acceleration, º/s for rotation and ºC for temperature.
+"""
+
+import time
+import numpy as np
+
+GRAVITY = 9.80665
+
+# ADXL345 full resolution g per LSB (any range)
+ADXL345_SCALE = 0.0039
+
+imudtype = np.dtype([("timestamp", "<i8"), ("accel", "<f4", (3,)), ("temp", "<f4"), ("gyro", "<f4", (3,))])
+acceldtype = np.dtype([("timestamp", "<i8"), ("accel", "<f4", (3,))])
+
+
+class imusample:
+    """One accel/temp/gyro reading.
+    """
+
+    __slots__ = ("timestamp", "ax", "ay", "az", "temp", "gx", "gy", "gz")
+
+    def __init__(self, timestamp, ax, ay, az, temp, gx, gy, gz):
+        self.timestamp = timestamp
+        self.ax = ax
+        self.ay = ay
+        self.az = az
+        self.temp = temp
+        self.gx = gx
+        self.gy = gy
+        self.gz = gz
+
+    def __repr__(self):
+        return "imusample(%d, accel=(%.4f, %.4f, %.4f), temp=%.2f, gyro=(%.3f, %.3f, %.3f))" % (
+            self.timestamp, self.ax, self.ay, self.az, self.temp, self.gx, self.gy, self.gz)
+
+
+class accelsample:
+    """One accelerometer reading.
+    """
+
+    __slots__ = ("timestamp", "x", "y", "z")
+
+    def __init__(self, timestamp, x, y, z):
+        self.timestamp = timestamp
+        self.x = x
+        self.y = y
+        self.z = z
+
+    def __repr__(self):
+        return "accelsample(%d, %.4f, %.4f, %.4f)" % (self.timestamp, self.x, self.y, self.z)
+
+
+def decodeMpu6050(raw, accelScale=16384.0, gyroScale=131.0, out=None, calib=None):
+    """N x 14 raw bytes from ACCEL_XOUT_H (0x3b) to structured imudtype array.
+    Timestamps in out are left as they are. calib (calibration.calibration)
+    is folded into the scale multiply plus one add.
+    """
+    words = np.asarray(raw, dtype=np.uint8).reshape(-1, 14).view(">i2")
+    if out is None:
+        out = np.zeros(len(words), dtype=imudtype)
+    np.multiply(words[:, 3], 1.0 / 340.0, out=out["temp"], casting="unsafe")
+    out["temp"] += 36.53
+    if calib is None:
+        np.multiply(words[:, 0:3], 1.0 / accelScale, out=out["accel"], casting="unsafe")
+        np.multiply(words[:, 4:7], 1.0 / gyroScale, out=out["gyro"], casting="unsafe")
+    else:
+        gain, bias = calib.accelAffine()
+        np.multiply(words[:, 0:3], gain / accelScale, out=out["accel"], casting="unsafe")
+        out["accel"] += bias.astype(np.float32)
+        gain, bias = calib.gyroAffine()
+        np.multiply(words[:, 4:7], gain / gyroScale, out=out["gyro"], casting="unsafe")
+        out["gyro"] += bias.astype(np.float32)
+    return out
+
+
+def decodeAdxl345(raw, scale=ADXL345_SCALE, out=None, calib=None):
+    """N x 6 raw bytes from DATAX0 (0x32) to structured acceldtype array with
+    optional calib as in decodeMpu6050.
+    """
+    words = np.asarray(raw, dtype=np.uint8).reshape(-1, 6).view("<i2")
+    if out is None:
+        out = np.zeros(len(words), dtype=acceldtype)
+    if calib is None:
+        np.multiply(words, scale, out=out["accel"], casting="unsafe")
+    else:
+        gain, bias = calib.accelAffine()
+        np.multiply(words, gain * scale, out=out["accel"], casting="unsafe")
+        out["accel"] += bias.astype(np.float32)
+    return out
+
+
+class blockreader:
+    """Register block read with preallocated messages (register select then
+    data read). read()/execute() return one block, readInto() reads many into
+    caller memory (i.e. samplebatch.raw). Also trigger.i2cread.
+    """
+
+    def __init__(self, i2c, handle, addr, reg, length):
+        """i2c is a libperipheryi2c instance (or anything with the same lib and
+        ffi) and handle is an open i2c_t.
+        """
+        self.i2c = i2c
+        self.lib = i2c.lib
+        self.ffi = i2c.ffi
+        self.handle = handle
+        self.length = length
+        self.reg = self.ffi.new("uint8_t[]", 1)
+        self.reg[0] = reg
+        self.buf = self.ffi.new("uint8_t[]", length)
+        self.msgs = self.ffi.new("struct i2c_msg[]", 2)
+        self.msgs[0].addr = addr
+        self.msgs[0].flags = 0x00
+        self.msgs[0].len = 1
+        self.msgs[0].buf = self.reg
+        self.msgs[1].addr = addr
+        self.msgs[1].flags = self.lib.I2C_M_RD
+        self.msgs[1].len = length
+        self.msgs[1].buf = self.buf
+
+    def transfer(self):
+        if self.lib.i2c_transfer(self.handle, self.msgs, 2) < 0:
+            raise RuntimeError(self.ffi.string(self.lib.i2c_errmsg(self.handle)).decode('utf-8'))
+
+    def read(self):
+        """Block as bytes.
+        """
+        self.transfer()
+        return self.ffi.buffer(self.buf)[:]
+
+    # Transaction interface for trigger, acquisition and aio
+    execute = read
+
+    def readInto(self, raw, timestamps, count, interval=0.0):
+        """Read count blocks into rows of raw (uint8, count x length) and stamp
+        each with time.monotonic_ns(). interval is seconds between reads.
+        """
+        msg = self.msgs[1]
+        base = self.ffi.cast("uint8_t *", self.ffi.from_buffer(raw))
+        length = self.length
+        clock = time.monotonic_ns
+        try:
+            for i in range(count):
+                msg.buf = base + i * length
+                self.transfer()
+                timestamps[i] = clock()
+                if interval:
+                    time.sleep(interval)
+        finally:
+            msg.buf = self.buf
+
+
+class samplebatch:
+    """Preallocated raw blocks, timestamps and decoded samples.
+    """
+
+    def __init__(self, dtype, blockSize, capacity):
+        self.raw = np.zeros((capacity, blockSize), dtype=np.uint8)
+        self.data = np.zeros(capacity, dtype=dtype)
+        self.capacity = capacity
+        self.count = 0
+
+    def samples(self):
+        """Decoded samples of the last read.
+        """
+        return self.data[:self.count]
@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2018 Steven P. Goldsmith
+# See LICENSE.md for details.
+
+"""
+Shared memory sample ring
+-------------
+
+Lock free single producer/multi consumer ring in
+multiprocessing.shared_memory. The acquisition process writes fixed size
+timestamped records and publishes a 64 bit write sequence. Each consumer keeps
+its own cursor and gets zero copy NumPy views of the records, with overrun
+detection when it falls more than a ring behind.
+
+Writes are a seqlock over the ring: the producer stores the begin counter (the
+sequence the write will end at), writes the records, then stores the published
+sequence. A write is in progress while they differ (the odd phase of a classic
+seqlock). Readers load the sequence, use the records, then load begin again;
+records older than begin - capacity were not touched (valid(), copy()).
+
+The counters go through libatomic (__atomic_load_8/__atomic_store_8 and
+atomic_thread_fence with acquire/release order), so the order holds on weakly
+ordered ARM and 64 bit loads are never torn on 32 bit ARM. Without libatomic
+plain loads and stores are used and the order is only guaranteed on x86 (TSO).
+"""
+
+import json, multiprocessing, struct
+from multiprocessing import shared_memory, resource_tracker
+from cffi import FFI
+import numpy as np
+
+MAGIC = 0x55494f52
+HEADER_SIZE = 512
+# magic, version, capacity, record size
+FIXED = struct.Struct("<IIQQ")
+SEQ_OFFSET = 32
+BEGIN_OFFSET = 40
+
+# C11/GCC memory orders
+RELAXED = 0
+ACQUIRE = 2
+RELEASE = 3
+
+ffi = FFI()
+ffi.cdef("""
+uint64_t __atomic_load_8(const volatile void *ptr, int order);
+void __atomic_store_8(volatile void *ptr, uint64_t value, int order);
+void atomic_thread_fence(int order);
+""")
+try:
+    atomic = ffi.dlopen("libatomic.so.1")
+    # getattr since __ names would be mangled inside classes
+    atomicLoad = getattr(atomic, "__atomic_load_8")
+    atomicStore = getattr(atomic, "__atomic_store_8")
+    atomicFence = atomic.atomic_thread_fence
+except (OSError, AttributeError):
+    atomic = None
+
+# Default record: ns timestamp plus 7 values (MPU-6050 accel, temp, gyro)
+sampledtype = np.dtype([("timestamp", "<i8"), ("values", "<f4", (7,))])
+
+
+def attach(name):
+    """Attach to existing segment without the resource tracker unlinking it
+    when this process exits.
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Before Python 3.13. Children of the producer share its tracker, so
+        # only unrelated processes unregister.
+        shm = shared_memory.SharedMemory(name=name)
+        if multiprocessing.parent_process() is None:
+            resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+class shmring:
+    """Shared memory ring.
+    """
+
+    def __init__(self, name, capacity=65536, dtype=sampledtype, create=False):
+        """create=True for the producer. Consumers attach by name and get
+        capacity and dtype from the header.
+        """
+        self.create = create
+        if create:
+            dtype = np.dtype(dtype)
+            size = HEADER_SIZE + capacity * dtype.itemsize
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+            descr = json.dumps(dtype.descr).encode('utf-8')
+            if len(descr) > HEADER_SIZE - 64:
+                raise RuntimeError("dtype description too long")
+            FIXED.pack_into(self.shm.buf, 0, MAGIC, 1, capacity, dtype.itemsize)
+            self.shm.buf[64:64 + len(descr)] = descr
+        else:
+            self.shm = attach(name)
+            magic, version, capacity, itemsize = FIXED.unpack_from(self.shm.buf, 0)
+            if magic != MAGIC:
+                raise RuntimeError("%s is not a sample ring" % name)
+            descr = bytes(self.shm.buf[64:HEADER_SIZE]).rstrip(b"\x00").decode('utf-8')
+            dtype = np.dtype([tuple(d) for d in json.loads(descr)])
+        self.capacity = capacity
+        self.dtype = dtype
+        if atomic is not None:
+            self.header = ffi.from_buffer("uint8_t[]", self.shm.buf[:HEADER_SIZE])
+            self.seqPtr = self.header + SEQ_OFFSET
+            self.beginPtr = self.header + BEGIN_OFFSET
+        else:
+            self.header = None
+            self.seq = np.ndarray((1,), dtype="<u8", buffer=self.shm.buf, offset=SEQ_OFFSET)
+            self.begin = np.ndarray((1,), dtype="<u8", buffer=self.shm.buf, offset=BEGIN_OFFSET)
+        self.records = np.ndarray((capacity,), dtype=dtype, buffer=self.shm.buf, offset=HEADER_SIZE)
+
+    def load(self, name, order):
+        """Counter value (seq or begin).
+        """
+        if self.header is not None:
+            return atomicLoad(getattr(self, name + "Ptr"), order)
+        counter = getattr(self, name)
+        # Read until two reads match (no torn 64 bit load)
+        while True:
+            first = int(counter[0])
+            if first == int(counter[0]):
+                return first
+
+    def store(self, name, value, order):
+        if self.header is not None:
+            atomicStore(getattr(self, name + "Ptr"), value, order)
+        else:
+            getattr(self, name)[0] = value
+
+    def fence(self, order):
+        if self.header is not None:
+            atomicFence(order)
+
+    def writeSeq(self):
+        """Published write sequence (total records written). Records before it
+        are visible after this load.
+        """
+        return self.load("seq", ACQUIRE)
+
+    def beginSeq(self):
+        """Sequence the write in progress ends at (writeSeq() if none). Loads
+        of records before this call happen before it.
+        """
+        self.fence(ACQUIRE)
+        return self.load("begin", RELAXED)
+
+    def close(self):
+        """Release views and detach. Producer also unlinks the segment. Views
+        returned by read() must be released first.
+        """
+        del self.records
+        if self.header is not None:
+            ffi.release(self.header)
+            del self.seqPtr, self.beginPtr
+        else:
+            del self.seq, self.begin
+        self.header = None
+        self.shm.close()
+        if self.create:
+            self.shm.unlink()
+
+
+class producer(shmring):
+    """Writer side.
+    """
+
+    def __init__(self, name, capacity=65536, dtype=sampledtype):
+        shmring.__init__(self, name, capacity, dtype, create=True)
+        self.count = 0
+
+    def write(self, batch):
+        """Append structured array batch (bulk copy, at most one split at the
+        end of the ring).
+        """
+        n = len(batch)
+        if n > self.capacity:
+            batch = batch[-self.capacity:]
+            self.count += n - self.capacity
+            n = self.capacity
+        start = self.count % self.capacity
+        first = min(n, self.capacity - start)
+        self.beginWrite(self.count + n)
+        self.records[start:start + first] = batch[:first]
+        if first < n:
+            self.records[:n - first] = batch[first:]
+        self.count += n
+        # Publish after the records are in place
+        self.store("seq", self.count, RELEASE)
+
+    def beginWrite(self, end):
+        """Mark slots up to sequence end as being written, before any record
+        store.
+        """
+        self.store("begin", end, RELAXED)
+        self.fence(RELEASE)
+
+    def append(self, timestamp, values):
+        """Append one record.
+        """
+        i = self.count % self.capacity
+        self.beginWrite(self.count + 1)
+        record = self.records[i]
+        record["timestamp"] = timestamp
+        record["values"] = values
+        self.count += 1
+        self.store("seq", self.count, RELEASE)
+
+
+class consumer(shmring):
+    """Reader side with its own cursor.
+    """
+
+    def __init__(self, name, fromStart=False, headroom=None):
+        """fromStart=False skips what is already in the ring. headroom slots
+        are kept away from the writer so a view is not overwritten while in use
+        (default 1/8 of the ring).
+        """
+        shmring.__init__(self, name)
+        if headroom is None:
+            headroom = self.capacity // 8
+        self.headroom = headroom
+        seq = self.writeSeq()
+        if fromStart:
+            self.cursor = max(0, seq - self.capacity + headroom)
+        else:
+            self.cursor = seq
+        self.viewSeq = self.cursor
+        self.lost = 0
+
+    def available(self):
+        return self.writeSeq() - self.cursor
+
+    def read(self, maxRecords=None):
+        """Return zero copy view of the next records (up to the end of the ring
+        buffer, so call again after a wrap) and the number of records lost to
+        overrun since the last read.
+        """
+        seq = self.writeSeq()
+        lost = 0
+        oldest = seq - self.capacity + self.headroom
+        if self.cursor < oldest:
+            lost = oldest - self.cursor
+            self.lost += lost
+            self.cursor = oldest
+        n = seq - self.cursor
+        if maxRecords is not None:
+            n = min(n, maxRecords)
+        start = self.cursor % self.capacity
+        n = min(n, self.capacity - start)
+        self.viewSeq = self.cursor
+        self.cursor += n
+        return self.records[start:start + n], lost
+
+    def valid(self):
+        """True if no write has touched the last view's slots since it was
+        read (seqlock check). Check after processing.
+        """
+        return self.beginSeq() - self.viewSeq <= self.capacity
+
+    def copy(self, maxRecords=None):
+        """Like read() but returns a copy that is checked against concurrent
+        writes. Records overwritten during the copy are read again or counted
+        as lost.
+        """
+        lost = 0
+        while True:
+            view, viewLost = self.read(maxRecords)
+            data = view.copy()
+            del view
+            lost += viewLost
+            if self.valid():
+                return data, lost
+            # Overwritten while copying, read from the oldest slot still safe
+            self.cursor = self.viewSeq
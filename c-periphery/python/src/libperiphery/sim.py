@@ -0,0 +1,699 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2018 Steven P. Goldsmith
+# See LICENSE.md for details.
+
+"""
+Simulated device backends
+-------------
+
+Drop-in replacements for the shared libraries behind libperipheryi2c,
+libperipheryspi, libperipheryserial and libpwmio. Pass one as lib and the
+binding's helper methods and the demos run without hardware:
+
+    bus = sim.i2clib()
+    bus.add("/dev/i2c-0", 0x68, sim.mpu6050model())
+    i2c = libperipheryi2c.libperipheryi2c(lib=bus)
+    mpu = mpu6050.mpu6050(i2c)
+
+Functions take the same arguments and return the same codes as c-periphery and
+pwmio, and the handles are the real CFFI structs.
+"""
+
+import errno, fcntl, itertools, os, random, select, shutil, struct, tempfile, termios, time, tty
+from cffi import FFI
+
+ffi = FFI()
+
+# Fake file descriptors for handles that have no real file
+fds = itertools.count(1000)
+
+
+def setError(handle, code, cErrno, msg):
+    """Fill in handle error like c-periphery and return code.
+    """
+    handle.error.c_errno = cErrno
+    if cErrno:
+        msg = "%s: %s [errno %d]" % (msg, os.strerror(cErrno), cErrno)
+    handle.error.errmsg = msg.encode('utf-8')[:95]
+    return code
+
+
+class regmap:
+    """Register map I2C device with auto increment register pointer.
+    """
+
+    def __init__(self, size=256):
+        self.size = size
+        self.regs = bytearray(size)
+        self.pointer = 0
+
+    def update(self, reg, length):
+        """Called before registers reg to reg + length are read.
+        """
+        pass
+
+    def writeReg(self, reg, value):
+        self.regs[reg] = value
+
+    def write(self, data):
+        """First byte sets register pointer, rest are written auto incrementing.
+        """
+        if not data:
+            return
+        self.pointer = data[0] % self.size
+        for value in data[1:]:
+            self.writeReg(self.pointer, value)
+            self.pointer = (self.pointer + 1) % self.size
+
+    def read(self, length):
+        reg = self.pointer
+        self.update(reg, length)
+        end = reg + length
+        if end <= self.size:
+            data = self.regs[reg:end]
+        else:
+            data = self.regs[reg:] + self.regs[:end - self.size]
+        self.pointer = end % self.size
+        return data
+
+
+class mpu6050model(regmap):
+    """MPU-6050 register model. Accel (g) and gyro (º/s) values plus gaussian
+    noise are latched into the data registers at the configured sample rate.
+    """
+
+    def __init__(self, accel=(0.0, 0.0, 1.0), gyro=(0.0, 0.0, 0.0), tempC=25.0, noise=0.01, seed=None):
+        regmap.__init__(self)
+        self.accel = list(accel)
+        self.gyro = list(gyro)
+        self.tempC = tempC
+        self.noise = noise
+        self.random = random.Random(seed)
+        self.latchedAt = 0.0
+        self.previous = None
+        self.block = struct.Struct(">7h")
+        # PWR_MGMT_1 sleep, WHO_AM_I
+        self.regs[0x6b] = 0x40
+        self.regs[0x75] = 0x68
+
+    def period(self):
+        """Sample period from SMPLRT_DIV and DLPF_CFG.
+        """
+        if self.regs[0x1a] & 0x07 in (0, 7):
+            rate = 8000.0
+        else:
+            rate = 1000.0
+        return (1 + self.regs[0x19]) / rate
+
+    def clamp(self, value):
+        return max(-32768, min(32767, int(value)))
+
+    def latch(self):
+        accelLsb = 16384.0 / (1 << ((self.regs[0x1c] >> 3) & 0x03))
+        gyroLsb = (131.0, 65.5, 32.8, 16.4)[(self.regs[0x1b] >> 3) & 0x03]
+        gauss = self.random.gauss
+        noise = self.noise
+        accel = [a + gauss(0, noise) for a in self.accel]
+        values = [self.clamp(a * accelLsb) for a in accel]
+        # Motion is a sample to sample change over MOT_THR (2 mg/LSB)
+        if self.regs[0x38] & 0x40 and self.previous is not None:
+            if max(abs(a - b) for a, b in zip(accel, self.previous)) > self.regs[0x1f] * 0.002:
+                self.regs[0x3a] |= 0x40
+        self.previous = accel
+        values.append(self.clamp((self.tempC - 36.53) * 340))
+        values += [self.clamp((g + gauss(0, noise)) * gyroLsb) for g in self.gyro]
+        self.regs[0x3b:0x49] = self.block.pack(*values)
+        # INT_STATUS DATA_RDY_INT
+        self.regs[0x3a] |= 0x01
+
+    def update(self, reg, length):
+        # Asleep devices do not update
+        if not self.regs[0x6b] & 0x40 and reg < 0x49 and reg + length > 0x3a:
+            now = time.monotonic()
+            if now - self.latchedAt >= self.period():
+                self.latchedAt = now
+                self.latch()
+
+    def read(self, length):
+        reg = self.pointer
+        data = regmap.read(self, length)
+        # INT_STATUS cleared by reading it or any read with INT_RD_CLEAR
+        if (reg <= 0x3a < reg + length) or self.regs[0x37] & 0x10:
+            self.regs[0x3a] = 0
+        return data
+
+
+class adxl345model(regmap):
+    """ADXL345 register model. Accel (g) plus gaussian noise is latched into
+    the data registers at the BW_RATE output data rate.
+    """
+
+    def __init__(self, accel=(0.0, 0.0, 1.0), noise=0.01, seed=None):
+        regmap.__init__(self, 64)
+        self.accel = list(accel)
+        self.noise = noise
+        self.random = random.Random(seed)
+        self.latchedAt = 0.0
+        # Activity reference and when the signal last left THRESH_INACT
+        self.reference = None
+        self.movedAt = time.monotonic()
+        self.block = struct.Struct("<3h")
+        # DEVID, BW_RATE, INT_SOURCE
+        self.regs[0x00] = 0xe5
+        self.regs[0x2c] = 0x0a
+        self.regs[0x30] = 0x02
+
+    def period(self):
+        return 1.0 / (3200.0 / (1 << (0x0f - (self.regs[0x2c] & 0x0f))))
+
+    def latch(self):
+        dataFormat = self.regs[0x31]
+        if dataFormat & 0x08:
+            # FULL_RES is 3.9 mg/LSB at any range
+            lsb, limit = 256.0, 512 << (dataFormat & 0x03)
+        else:
+            lsb, limit = 256.0 / (1 << (dataFormat & 0x03)), 512
+        gauss = self.random.gauss
+        accel = [a + gauss(0, self.noise) for a in self.accel]
+        values = [max(-limit, min(limit - 1, int(a * lsb))) for a in accel]
+        self.regs[0x32:0x38] = self.block.pack(*values)
+        self.regs[0x30] |= 0x80
+        self.activity(accel)
+
+    def activity(self, accel):
+        """AC coupled activity/inactivity against the last reference sample
+        (62.5 mg/LSB thresholds, TIME_INACT in seconds).
+        """
+        now = time.monotonic()
+        if self.reference is None:
+            self.reference = accel
+        change = max(abs(a - b) for a, b in zip(accel, self.reference))
+        if change > self.regs[0x25] * 0.0625:
+            self.movedAt = now
+        if self.regs[0x2e] & 0x10 and change > self.regs[0x24] * 0.0625:
+            self.regs[0x30] |= 0x10
+            self.reference = accel
+        elif self.regs[0x2e] & 0x08 and now - self.movedAt >= self.regs[0x26]:
+            self.regs[0x30] |= 0x08
+            self.movedAt = now
+            self.reference = accel
+
+    def update(self, reg, length):
+        # POWER_CTL measure bit
+        if self.regs[0x2d] & 0x08 and reg < 0x38 and reg + length > 0x30:
+            now = time.monotonic()
+            if now - self.latchedAt >= self.period():
+                self.latchedAt = now
+                self.latch()
+
+    def read(self, length):
+        reg = self.pointer
+        data = regmap.read(self, length)
+        # DATA_READY cleared when data registers are read
+        if reg <= 0x37 and reg + length > 0x32:
+            self.regs[0x30] &= ~0x80
+        # Activity and inactivity cleared by reading INT_SOURCE
+        if reg <= 0x30 < reg + length:
+            self.regs[0x30] &= ~0x18
+        return data
+
+
+class i2clib:
+    """Simulated libperipheryi2c.so. Devices are registered per bus path and
+    address. Transfers to a missing address fail like a NAK.
+    """
+
+    I2C_M_TEN = 0x0010
+    I2C_M_RD = 0x0001
+    I2C_M_STOP = 0x8000
+    I2C_M_NOSTART = 0x4000
+    I2C_M_REV_DIR_ADDR = 0x2000
+    I2C_M_IGNORE_NAK = 0x1000
+    I2C_M_NO_RD_ACK = 0x0800
+    I2C_M_RECV_LEN = 0x0400
+    I2C_ERROR_ARG = -1
+    I2C_ERROR_OPEN = -2
+    I2C_ERROR_QUERY_SUPPORT = -3
+    I2C_ERROR_NOT_SUPPORTED = -4
+    I2C_ERROR_TRANSFER = -5
+    I2C_ERROR_CLOSE = -6
+
+    def __init__(self):
+        self.buses = {}
+        self.open = {}
+
+    def add(self, path, addr, device):
+        """Attach device at addr on bus path.
+        """
+        self.buses.setdefault(path, {})[addr] = device
+        return device
+
+    def i2c_open(self, i2c, path):
+        path = path.decode('utf-8')
+        if path not in self.buses:
+            return setError(i2c, self.I2C_ERROR_OPEN, errno.ENOENT, "Opening I2C device \"%s\"" % path)
+        i2c.fd = next(fds)
+        self.open[i2c.fd] = self.buses[path]
+        return 0
+
+    def i2c_transfer(self, i2c, msgs, count):
+        devices = self.open.get(i2c.fd)
+        if devices is None:
+            return setError(i2c, self.I2C_ERROR_TRANSFER, errno.EBADF, "I2C transfer")
+        for i in range(count):
+            msg = msgs[i]
+            device = devices.get(msg.addr)
+            if device is None:
+                return setError(i2c, self.I2C_ERROR_TRANSFER, errno.ENXIO, "I2C transfer")
+            if msg.flags & self.I2C_M_RD:
+                data = device.read(msg.len)
+                ffi.memmove(msg.buf, bytes(data), msg.len)
+            else:
+                device.write(ffi.buffer(msg.buf, msg.len)[:])
+        return 0
+
+    def i2c_close(self, i2c):
+        if self.open.pop(i2c.fd, None) is None:
+            return setError(i2c, self.I2C_ERROR_CLOSE, errno.EBADF, "Closing I2C device")
+        i2c.fd = -1
+        return 0
+
+    def i2c_fd(self, i2c):
+        return i2c.fd
+
+    def i2c_tostring(self, i2c, string, length):
+        text = ("I2C (fd=%d)" % i2c.fd).encode('utf-8')[:length - 1] + b"\x00"
+        ffi.memmove(string, text, len(text))
+        return len(text) - 1
+
+    def i2c_errno(self, i2c):
+        return i2c.error.c_errno
+
+    def i2c_errmsg(self, i2c):
+        return i2c.error.errmsg
+
+
+class spilib:
+    """Simulated libperipheryspi.so. Transfers loop tx back to rx unless a
+    responder(txbytes) -> rxbytes is registered for the device path.
+    """
+
+    SPI_MODE_0 = 0x00
+    SPI_MODE_1 = 0x01
+    SPI_MODE_2 = 0x02
+    SPI_MODE_3 = 0x03
+    SPI_ERROR_ARG = -1
+    SPI_ERROR_OPEN = -2
+    SPI_ERROR_QUERY = -3
+    SPI_ERROR_CONFIGURE = -4
+    SPI_ERROR_TRANSFER = -5
+    SPI_ERROR_CLOSE = -6
+    MSB_FIRST = 0
+    LSB_FIRST = 1
+
+    def __init__(self):
+        self.responders = {}
+        self.open = {}
+
+    def add(self, path, responder=None):
+        """Register device path with optional responder.
+        """
+        self.responders[path] = responder
+
+    def spi_open_advanced(self, spi, path, mode, maxSpeed, bitOrder, bitsPerWord, extraFlags):
+        path = path.decode('utf-8')
+        if self.responders and path not in self.responders:
+            return setError(spi, self.SPI_ERROR_OPEN, errno.ENOENT, "Opening SPI device \"%s\"" % path)
+        if mode & ~0x3:
+            return setError(spi, self.SPI_ERROR_ARG, 0, "Invalid mode (can be 0,1,2,3)")
+        spi.fd = next(fds)
+        self.open[spi.fd] = {"path": path, "mode": mode, "max_speed": maxSpeed, "bit_order": bitOrder,
+                             "bits_per_word": bitsPerWord, "extra_flags": extraFlags}
+        return 0
+
+    def spi_open(self, spi, path, mode, maxSpeed):
+        return self.spi_open_advanced(spi, path, mode, maxSpeed, self.MSB_FIRST, 8, 0)
+
+    def spi_transfer(self, spi, txbuf, rxbuf, length):
+        state = self.open.get(spi.fd)
+        if state is None:
+            return setError(spi, self.SPI_ERROR_TRANSFER, errno.EBADF, "SPI transfer")
+        responder = self.responders.get(state["path"])
+        if responder is None:
+            if rxbuf != ffi.NULL and txbuf != ffi.NULL:
+                ffi.memmove(rxbuf, txbuf, length)
+        else:
+            if txbuf != ffi.NULL:
+                tx = ffi.buffer(txbuf, length)[:]
+            else:
+                tx = bytes(length)
+            rx = responder(tx)
+            if rxbuf != ffi.NULL:
+                ffi.memmove(rxbuf, rx, min(length, len(rx)))
+        return 0
+
+    def spi_close(self, spi):
+        if self.open.pop(spi.fd, None) is None:
+            return setError(spi, self.SPI_ERROR_CLOSE, errno.EBADF, "Closing SPI device")
+        spi.fd = -1
+        return 0
+
+    def get(self, spi, key, out):
+        out[0] = self.open[spi.fd][key]
+        return 0
+
+    def set(self, spi, key, value):
+        self.open[spi.fd][key] = value
+        return 0
+
+    def spi_get_mode(self, spi, mode):
+        return self.get(spi, "mode", mode)
+
+    def spi_get_max_speed(self, spi, maxSpeed):
+        return self.get(spi, "max_speed", maxSpeed)
+
+    def spi_get_bit_order(self, spi, bitOrder):
+        return self.get(spi, "bit_order", bitOrder)
+
+    def spi_get_bits_per_word(self, spi, bitsPerWord):
+        return self.get(spi, "bits_per_word", bitsPerWord)
+
+    def spi_get_extra_flags(self, spi, extraFlags):
+        return self.get(spi, "extra_flags", extraFlags)
+
+    def spi_set_mode(self, spi, mode):
+        return self.set(spi, "mode", mode)
+
+    def spi_set_max_speed(self, spi, maxSpeed):
+        return self.set(spi, "max_speed", maxSpeed)
+
+    def spi_set_bit_order(self, spi, bitOrder):
+        return self.set(spi, "bit_order", bitOrder)
+
+    def spi_set_bits_per_word(self, spi, bitsPerWord):
+        return self.set(spi, "bits_per_word", bitsPerWord)
+
+    def spi_set_extra_flags(self, spi, extraFlags):
+        return self.set(spi, "extra_flags", extraFlags)
+
+    def spi_fd(self, spi):
+        return spi.fd
+
+    def spi_errno(self, spi):
+        return spi.error.c_errno
+
+    def spi_errmsg(self, spi):
+        return spi.error.errmsg
+
+
+class displaymodel:
+    """ST7789/ILI9341 RGB565 panel. Register it as the spilib responder of a
+    path and pass dc as the display's D/C line. RAM is width x height x 2
+    bytes, big endian pixels in row order.
+    """
+
+    def __init__(self, width=240, height=320):
+        self.width = width
+        self.height = height
+        self.ram = bytearray(width * height * 2)
+        self.dcValue = 0
+        self.command = None
+        self.params = bytearray()
+        self.columns = (0, width - 1)
+        self.rows = (0, height - 1)
+        self.x = 0
+        self.y = 0
+        self.commands = 0
+
+    def dc(self, value):
+        self.dcValue = value
+
+    def __call__(self, tx):
+        if self.dcValue == 0:
+            self.command = tx[0]
+            self.params = bytearray()
+            self.commands += 1
+            if self.command == 0x2c:
+                self.x, self.y = self.columns[0], self.rows[0]
+        elif self.command in (0x2a, 0x2b):
+            self.params += tx
+            if len(self.params) >= 4:
+                start, end = struct.unpack(">HH", self.params[:4])
+                if self.command == 0x2a:
+                    self.columns = (start, end)
+                else:
+                    self.rows = (start, end)
+        elif self.command == 0x2c:
+            self.pixels(tx)
+        return b""
+
+    def pixels(self, data):
+        """Write pixels at the RAM pointer, wrapping inside the window.
+        """
+        x0, x1 = self.columns
+        pos = 0
+        while pos + 1 < len(data) and self.y <= self.rows[1]:
+            count = min(x1 - self.x + 1, (len(data) - pos) // 2)
+            offset = (self.y * self.width + self.x) * 2
+            self.ram[offset:offset + count * 2] = data[pos:pos + count * 2]
+            pos += count * 2
+            self.x += count
+            if self.x > x1:
+                self.x = x0
+                self.y += 1
+
+
+class ptylink:
+    """Pseudo terminal pair standing in for a serial link. Open path with
+    seriallib (or the real libperipheryserial) and talk to the other end with
+    read/write.
+    """
+
+    def __init__(self):
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.master)
+        tty.setraw(self.slave)
+        self.path = os.ttyname(self.slave)
+
+    def write(self, data):
+        return os.write(self.master, data)
+
+    def read(self, length, timeout=None):
+        """Read up to length bytes from the other end.
+        """
+        if select.select([self.master], [], [], timeout)[0]:
+            return os.read(self.master, length)
+        return b""
+
+    def close(self):
+        os.close(self.master)
+        os.close(self.slave)
+
+
+class seriallib:
+    """Simulated libperipheryserial.so on real file descriptors, so serial_fd
+    works with poll/asyncio. Use with ptylink paths.
+    """
+
+    PARITY_NONE = 0
+    PARITY_ODD = 1
+    PARITY_EVEN = 2
+    SERIAL_ERROR_ARG = -1
+    SERIAL_ERROR_OPEN = -2
+    SERIAL_ERROR_QUERY = -3
+    SERIAL_ERROR_IO = -5
+    SERIAL_ERROR_CONFIGURE = -6
+    SERIAL_ERROR_CLOSE = -7
+
+    def __init__(self):
+        self.open = {}
+
+    def serial_open_advanced(self, serial, path, baudrate, databits, parity, stopbits, xonxoff, rtscts):
+        path = path.decode('utf-8')
+        try:
+            fd = os.open(path, os.O_RDWR | os.O_NOCTTY)
+        except OSError as e:
+            return setError(serial, self.SERIAL_ERROR_OPEN, e.errno, "Opening serial port \"%s\"" % path)
+        tty.setraw(fd)
+        serial.fd = fd
+        self.open[fd] = {"baudrate": baudrate, "databits": databits, "parity": parity, "stopbits": stopbits,
+                         "xonxoff": xonxoff, "rtscts": rtscts}
+        return 0
+
+    def serial_open(self, serial, path, baudrate):
+        return self.serial_open_advanced(serial, path, baudrate, 8, self.PARITY_NONE, 1, False, False)
+
+    def serial_read(self, serial, buf, length, timeoutMs):
+        """Same semantics as c-periphery: block for length bytes if timeoutMs < 0
+        else return what arrives before each poll times out.
+        """
+        got = 0
+        poller = select.poll()
+        poller.register(serial.fd, select.POLLIN)
+        while got < length:
+            if timeoutMs >= 0 and not poller.poll(timeoutMs):
+                break
+            try:
+                data = os.read(serial.fd, length - got)
+            except OSError as e:
+                return setError(serial, self.SERIAL_ERROR_IO, e.errno, "Reading serial port")
+            ffi.memmove(buf + got, data, len(data))
+            got += len(data)
+        return got
+
+    def serial_write(self, serial, buf, length):
+        try:
+            return os.write(serial.fd, ffi.buffer(buf, length)[:])
+        except OSError as e:
+            return setError(serial, self.SERIAL_ERROR_IO, e.errno, "Writing serial port")
+
+    def serial_flush(self, serial):
+        termios.tcdrain(serial.fd)
+        return 0
+
+    def serial_input_waiting(self, serial, count):
+        count[0] = struct.unpack("I", fcntl.ioctl(serial.fd, termios.FIONREAD, b"\x00" * 4))[0]
+        return 0
+
+    def serial_output_waiting(self, serial, count):
+        count[0] = struct.unpack("I", fcntl.ioctl(serial.fd, termios.TIOCOUTQ, b"\x00" * 4))[0]
+        return 0
+
+    def serial_poll(self, serial, timeoutMs):
+        poller = select.poll()
+        poller.register(serial.fd, select.POLLIN | select.POLLPRI)
+        if poller.poll(timeoutMs):
+            return 1
+        return 0
+
+    def serial_close(self, serial):
+        if self.open.pop(serial.fd, None) is None:
+            return setError(serial, self.SERIAL_ERROR_CLOSE, errno.EBADF, "Closing serial port")
+        os.close(serial.fd)
+        serial.fd = -1
+        return 0
+
+    def get(self, serial, key, out):
+        out[0] = self.open[serial.fd][key]
+        return 0
+
+    def set(self, serial, key, value):
+        self.open[serial.fd][key] = value
+        return 0
+
+    def serial_get_baudrate(self, serial, baudrate):
+        return self.get(serial, "baudrate", baudrate)
+
+    def serial_get_databits(self, serial, databits):
+        return self.get(serial, "databits", databits)
+
+    def serial_get_parity(self, serial, parity):
+        return self.get(serial, "parity", parity)
+
+    def serial_get_stopbits(self, serial, stopbits):
+        return self.get(serial, "stopbits", stopbits)
+
+    def serial_get_xonxoff(self, serial, xonxoff):
+        return self.get(serial, "xonxoff", xonxoff)
+
+    def serial_get_rtscts(self, serial, rtscts):
+        return self.get(serial, "rtscts", rtscts)
+
+    def serial_set_baudrate(self, serial, baudrate):
+        return self.set(serial, "baudrate", baudrate)
+
+    def serial_set_databits(self, serial, databits):
+        return self.set(serial, "databits", databits)
+
+    def serial_set_parity(self, serial, parity):
+        return self.set(serial, "parity", parity)
+
+    def serial_set_stopbits(self, serial, stopbits):
+        return self.set(serial, "stopbits", stopbits)
+
+    def serial_set_xonxoff(self, serial, enabled):
+        return self.set(serial, "xonxoff", enabled)
+
+    def serial_set_rtscts(self, serial, enabled):
+        return self.set(serial, "rtscts", enabled)
+
+    def serial_fd(self, serial):
+        return serial.fd
+
+    def serial_errno(self, serial):
+        return serial.error.c_errno
+
+    def serial_errmsg(self, serial):
+        return serial.error.errmsg
+
+
+class pwmlib:
+    """Simulated libpwmio.so writing to a temp dir copy of /sys/class/pwm.
+    Return codes match pwmio.c (bytes written or -1).
+    """
+
+    def __init__(self, chips=1, root=None):
+        if root is None:
+            root = tempfile.mkdtemp(prefix="pwm")
+        self.root = root
+        for chip in range(chips):
+            path = os.path.join(root, "pwmchip%d" % chip)
+            os.makedirs(path, exist_ok=True)
+            for name, value in (("export", ""), ("unexport", ""), ("npwm", "1\n")):
+                with open(os.path.join(path, name), "w") as f:
+                    f.write(value)
+
+    def write(self, path, value):
+        try:
+            fd = os.open(os.path.join(self.root, path), os.O_WRONLY | os.O_TRUNC)
+        except OSError:
+            return -1
+        try:
+            return os.write(fd, value)
+        finally:
+            os.close(fd)
+
+    def read(self, device, pwm, name):
+        """Current sysfs value for tests and benchmarks.
+        """
+        with open(os.path.join(self.root, "pwmchip%d" % device, "pwm%d" % pwm, name)) as f:
+            return f.read()
+
+    def pwm_open_device(self, device):
+        rc = self.write("pwmchip%d/export" % device, b"0")
+        if rc > 0:
+            # Kernel creates pwm0 on export
+            path = os.path.join(self.root, "pwmchip%d" % device, "pwm0")
+            os.makedirs(path, exist_ok=True)
+            for name, value in (("enable", "0"), ("period", "0"), ("duty_cycle", "0"), ("polarity", "normal")):
+                with open(os.path.join(path, name), "w") as f:
+                    f.write(value)
+        return rc
+
+    def pwm_close_device(self, device):
+        rc = self.write("pwmchip%d/unexport" % device, b"0")
+        if rc > 0:
+            shutil.rmtree(os.path.join(self.root, "pwmchip%d" % device, "pwm0"), ignore_errors=True)
+        return rc
+
+    def pwm_enable(self, device, pwm):
+        return self.write("pwmchip%d/pwm%d/enable" % (device, pwm), b"1")
+
+    def pwm_disable(self, device, pwm):
+        return self.write("pwmchip%d/pwm%d/enable" % (device, pwm), b"0")
+
+    def pwm_set_polarity(self, device, pwm, polarity):
+        if not isinstance(polarity, bytes):
+            polarity = ffi.string(polarity)
+        return self.write("pwmchip%d/pwm%d/polarity" % (device, pwm), polarity)
+
+    def pwm_set_period(self, device, pwm, period):
+        return self.write("pwmchip%d/pwm%d/period" % (device, pwm), b"%d" % period)
+
+    def pwm_set_duty_cycle(self, device, pwm, dutyCycle):
+        return self.write("pwmchip%d/pwm%d/duty_cycle" % (device, pwm), b"%d" % dutyCycle)
+
+    def cleanup(self):
+        """Remove temp sysfs tree.
+        """
+        shutil.rmtree(self.root, ignore_errors=True)
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2018 Steven P. Goldsmith
+# See LICENSE.md for details.
+
+"""
+Streaming spectral analysis for vibration monitoring
+-------------
+
+Feed accelerometer batches (ADXL345/MPU-6050) and get one summary record per
+overlapping window: RMS, peak frequency and band energies per axis. Samples
+are kept in a ring buffer, and the window function, PSD scaling, frequency
+bins and band slices are computed once. All windows completed by a batch go
+through a single rfft call.
+"""
+
+import numpy as np
+
+
+class spectral:
+
+    def __init__(self, rate, size=1024, overlap=0.5, axes=3, bands=((0.0, 10.0), (10.0, 100.0), (100.0, 1000.0)), detrend=True):
+        """rate is the sample rate in Hz, size the FFT length, overlap the
+        fraction shared by consecutive windows and bands a list of (low, high)
+        Hz ranges.
+        """
+        self.rate = float(rate)
+        self.size = size
+        self.axes = axes
+        self.hop = max(1, int(size * (1.0 - overlap)))
+        self.detrend = detrend
+        self.ring = np.zeros((size, axes))
+        self.index = 0
+        self.filled = 0
+        self.pending = 0
+        # Precomputed window and one sided PSD density scaling (Welch)
+        self.window = np.hanning(size)[:, None]
+        self.scale = np.full(size // 2 + 1, 2.0 / (self.rate * np.sum(self.window ** 2)))
+        self.scale[0] /= 2.0
+        if size % 2 == 0:
+            self.scale[-1] /= 2.0
+        self.freqs = np.fft.rfftfreq(size, 1.0 / self.rate)
+        self.df = self.freqs[1]
+        self.bands = list(bands)
+        self.slices = [slice(np.searchsorted(self.freqs, low), np.searchsorted(self.freqs, high)) for low, high in bands]
+        self.dtype = np.dtype([("timestamp", "<i8"), ("rms", "<f4", (axes,)), ("peak", "<f4", (axes,)),
+                               ("bands", "<f4", (axes, len(self.bands)))])
+
+    def frame(self, out):
+        """Copy ring (oldest first) into out.
+        """
+        i = self.index
+        n = self.size - i
+        out[:n] = self.ring[i:]
+        out[n:] = self.ring[:i]
+
+    def update(self, timestamps, samples):
+        """Add batch (N timestamps, N x axes samples) and return structured
+        array of windows completed.
+        """
+        samples = np.asarray(samples, dtype=np.float64).reshape(-1, self.axes)
+        n = len(samples)
+        frames = []
+        stamps = []
+        pos = 0
+        while pos < n:
+            take = min(n - pos, self.hop - self.pending, self.size - self.index)
+            self.ring[self.index:self.index + take] = samples[pos:pos + take]
+            self.index = (self.index + take) % self.size
+            self.filled = min(self.size, self.filled + take)
+            self.pending += take
+            pos += take
+            if self.pending == self.hop:
+                self.pending = 0
+                if self.filled == self.size:
+                    frame = np.empty((self.size, self.axes))
+                    self.frame(frame)
+                    frames.append(frame)
+                    stamps.append(timestamps[pos - 1])
+        result = np.zeros(len(frames), dtype=self.dtype)
+        if not frames:
+            return result
+        data = np.stack(frames)
+        if self.detrend:
+            data -= data.mean(axis=1, keepdims=True)
+        result["timestamp"] = stamps
+        result["rms"] = np.sqrt(np.mean(data * data, axis=1))
+        data *= self.window
+        spectrum = np.fft.rfft(data, axis=1)
+        psd = (spectrum.real ** 2 + spectrum.imag ** 2) * self.scale[:, None]
+        # Skip DC for peak
+        result["peak"] = self.freqs[1 + np.argmax(psd[:, 1:, :], axis=1)]
+        for b, s in enumerate(self.slices):
+            result["bands"][:, :, b] = psd[:, s, :].sum(axis=1) * self.df
+        self.psd = psd
+        return result
+
+    def reset(self):
+        self.index = 0
+        self.filled = 0
+        self.pending = 0
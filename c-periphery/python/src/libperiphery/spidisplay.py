@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2018 Steven P. Goldsmith
+# See LICENSE.md for details.
+
+"""
+Dirty region push for SPI displays
+-------------
+
+ST7789 and ILI9341 panels take a window (CASET, RASET) and then pixels
+(RAMWR), so only what changed has to cross the bus. display keeps the last
+frame sent, finds changed rectangles with one NumPy compare, merges them while
+the merged window costs fewer bytes than the separate ones (overhead is the
+bytes per window sequence, commands plus the time of the extra transfers) and
+sends each window straight from the frame in chunk sized transfers (no copy
+for full width windows):
+
+    disp = spidisplay.display(spi, handle, 240, 320, dcLine.set_value)
+    disp.init(spidisplay.ILI9341_INIT)
+    frame = np.zeros((320, 240), dtype=">u2")
+    ...
+    disp.push(frame)
+
+Frames are height x width RGB565, big endian as on the wire (any other uint16
+array is converted). dc is a callable taking 0 (command) or 1 (data), i.e. a
+libgpiod line's set_value or an mmiogpio pin's write.
+"""
+
+import struct, time
+import numpy as np
+
+SWRESET = 0x01
+SLPOUT = 0x11
+INVON = 0x21
+DISPON = 0x29
+CASET = 0x2a
+RASET = 0x2b
+RAMWR = 0x2c
+MADCTL = 0x36
+COLMOD = 0x3a
+
+# (command, parameters, delay seconds), RGB565 and default orientation
+ST7789_INIT = ((SWRESET, b"", 0.15), (SLPOUT, b"", 0.5), (COLMOD, b"\x55", 0.01), (MADCTL, b"\x00", 0.0),
+               (INVON, b"", 0.01), (DISPON, b"", 0.1))
+ILI9341_INIT = ((SWRESET, b"", 0.15), (SLPOUT, b"", 0.12), (COLMOD, b"\x55", 0.01), (MADCTL, b"\x48", 0.0),
+                (DISPON, b"", 0.1))
+
+# Bytes of one window sequence (CASET + 4, RASET + 4, RAMWR)
+WINDOW_BYTES = 11
+
+
+def rgb565(rgb):
+    """Height x width x 3 uint8 to big endian RGB565.
+    """
+    rgb = np.asarray(rgb, dtype=np.uint16)
+    return ((rgb[..., 0] & 0xf8) << 8 | (rgb[..., 1] & 0xfc) << 3 | rgb[..., 2] >> 3).astype(">u2")
+
+
+def runs(mask):
+    """(starts, ends) of True runs in a 1-D bool array.
+    """
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], mask.view(np.int8), [0]))))
+    return edges[0::2], edges[1::2]
+
+
+def merge(rects, overhead):
+    """Greedy merge of (x0, y0, x1, y1) rectangles (end exclusive) while the
+    bounding box costs fewer bytes than the pair (area * 2 + overhead each).
+    """
+    if len(rects) < 2:
+        return rects
+    r = np.array(rects, dtype=np.int64)
+    while len(r) > 1:
+        cost = (r[:, 2] - r[:, 0]) * (r[:, 3] - r[:, 1]) * 2 + overhead
+        x0 = np.minimum.outer(r[:, 0], r[:, 0])
+        y0 = np.minimum.outer(r[:, 1], r[:, 1])
+        x1 = np.maximum.outer(r[:, 2], r[:, 2])
+        y1 = np.maximum.outer(r[:, 3], r[:, 3])
+        saving = cost[:, None] + cost[None, :] - ((x1 - x0) * (y1 - y0) * 2 + overhead)
+        np.fill_diagonal(saving, -1)
+        i, j = np.unravel_index(np.argmax(saving), saving.shape)
+        if saving[i, j] < 0:
+            break
+        r[i] = (x0[i, j], y0[i, j], x1[i, j], y1[i, j])
+        r = np.delete(r, j, axis=0)
+    return [tuple(int(v) for v in row) for row in r]
+
+
+class display:
+    """Dirty region pusher for one panel. xOffset and yOffset move the window
+    for panels smaller than the controller RAM (i.e. 240 x 240 ST7789).
+    chunk is bytes per transfer (spidev bufsiz, 4096 unless raised with the
+    spidev.bufsiz module parameter). overhead is the cost of one window
+    sequence in bytes (default 11 command bytes plus 6 transfers at about
+    10 bytes of bus time each).
+    """
+
+    def __init__(self, spi, handle, width, height, dc, chunk=4096, xOffset=0, yOffset=0, overhead=WINDOW_BYTES + 60):
+        self.spi = spi
+        self.lib = spi.lib
+        self.ffi = spi.ffi
+        self.handle = handle
+        self.width = width
+        self.height = height
+        self.dc = dc
+        self.chunk = chunk
+        self.xOffset = xOffset
+        self.yOffset = yOffset
+        self.overhead = overhead
+        # Last frame sent, None until the first full push
+        self.shadow = None
+        self.cmd = self.ffi.new("uint8_t[1]")
+        self.params = self.ffi.new("uint8_t[4]")
+        self.window = struct.Struct(">HH")
+        self.frames = 0
+        self.bytes = 0
+        self.transfers = 0
+        self.rects = 0
+
+    def write(self, ptr, length):
+        """Send length bytes at ptr in chunk sized transfers.
+        """
+        lib = self.lib
+        handle = self.handle
+        chunk = self.chunk
+        null = self.ffi.NULL
+        for offset in range(0, length, chunk):
+            if lib.spi_transfer(handle, ptr + offset, null, min(chunk, length - offset)) < 0:
+                raise RuntimeError(self.ffi.string(lib.spi_errmsg(handle)).decode('utf-8'))
+            self.transfers += 1
+        self.bytes += length
+
+    def command(self, cmd, params=b""):
+        self.dc(0)
+        self.cmd[0] = cmd
+        self.write(self.cmd, 1)
+        if params:
+            self.dc(1)
+            self.ffi.memmove(self.params, params, len(params))
+            self.write(self.params, len(params))
+
+    def init(self, sequence):
+        """Run an init sequence of (command, parameters, delay) and force the
+        next push to send the whole frame.
+        """
+        for cmd, params, delay in sequence:
+            if len(params) > 4:
+                raise ValueError("Init parameters longer than 4 bytes")
+            self.command(cmd, params)
+            if delay:
+                time.sleep(delay)
+        self.shadow = None
+
+    def setWindow(self, x0, y0, x1, y1):
+        """Window for RAMWR, end exclusive.
+        """
+        self.command(CASET, self.window.pack(x0 + self.xOffset, x1 - 1 + self.xOffset))
+        self.command(RASET, self.window.pack(y0 + self.yOffset, y1 - 1 + self.yOffset))
+
+    def sendRect(self, frame, rect):
+        x0, y0, x1, y1 = rect
+        self.setWindow(x0, y0, x1, y1)
+        self.command(RAMWR)
+        self.dc(1)
+        # Full width rows are contiguous in the frame, others are copied once
+        pixels = frame[y0:y1, x0:x1]
+        if not pixels.flags.c_contiguous:
+            pixels = np.ascontiguousarray(pixels)
+        self.write(self.ffi.cast("uint8_t *", self.ffi.from_buffer(pixels)), pixels.nbytes)
+        self.rects += 1
+
+    def dirty(self, frame):
+        """Changed (x0, y0, x1, y1) rectangles against the last frame sent.
+        Each band of changed rows is split where the unchanged columns between
+        changes cost more than a window, then pieces are merged.
+        """
+        changed = frame != self.shadow
+        rowStarts, rowEnds = runs(changed.any(axis=1))
+        rects = []
+        for y0, y1 in zip(rowStarts, rowEnds):
+            colStarts, colEnds = runs(changed[y0:y1].any(axis=0))
+            # Join runs whose gap is cheaper than another window
+            gap = self.overhead // (2 * (y1 - y0))
+            keep = np.concatenate(([True], colStarts[1:] - colEnds[:-1] > gap))
+            starts = colStarts[keep]
+            ends = colEnds[np.concatenate((keep[1:], [True]))]
+            for x0, x1 in zip(starts, ends):
+                # Trim each piece to its own changed rows
+                rows = np.flatnonzero(changed[y0:y1, x0:x1].any(axis=1))
+                rects.append((int(x0), int(y0 + rows[0]), int(x1), int(y0 + rows[-1] + 1)))
+        return merge(rects, self.overhead)
+
+    def push(self, frame, full=False):
+        """Send what changed since the last push (everything on the first push
+        or if full). Returns the rectangles sent.
+        """
+        frame = np.asarray(frame, dtype=">u2")
+        if frame.shape != (self.height, self.width):
+            raise ValueError("Frame is %s, display is %s" % (frame.shape, (self.height, self.width)))
+        if full or self.shadow is None:
+            rects = [(0, 0, self.width, self.height)]
+        else:
+            rects = self.dirty(frame)
+        for rect in rects:
+            self.sendRect(frame, rect)
+        if self.shadow is None or full:
+            self.shadow = frame.copy()
+        else:
+            for x0, y0, x1, y1 in rects:
+                self.shadow[y0:y1, x0:x1] = frame[y0:y1, x0:x1]
+        self.frames += 1
+        return rects
+
+    def stats(self):
+        return {"frames": self.frames, "bytes": self.bytes, "transfers": self.transfers, "rects": self.rects}
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2018 Steven P. Goldsmith
+# See LICENSE.md for details.
+
+"""
+Bus transaction timeline tracer
+-------------
+
+Ring buffer of C calls (I2C transfer, SPI transfer, serial read/write, PWM
+writes, etc.) and GPIO events with start/end monotonic timestamps, thread id
+and payload size. Dump to Chrome trace JSON and load in chrome://tracing or
+ui.perfetto.dev to see bus contention and scheduling gaps.
+
+All storage is preallocated arrays and names are interned to small ints, so
+recording does not allocate a dict or object per event and can be left on.
+"""
+
+import array, itertools, json, os, threading, time
+from libperiphery import instrument
+
+
+class tracer:
+
+    def __init__(self, capacity=65536, ops=None):
+        """capacity is number of events kept. ops limits what is traced to a
+        set of C function names (None = all calls).
+        """
+        self.capacity = capacity
+        self.ops = ops
+        self.start = array.array('q', bytes(8 * capacity))
+        self.end = array.array('q', bytes(8 * capacity))
+        self.tid = array.array('Q', bytes(8 * capacity))
+        self.size = array.array('l', bytes(array.array('l').itemsize * capacity))
+        self.name = array.array('H', bytes(2 * capacity))
+        self.device = array.array('H', bytes(2 * capacity))
+        self.error = array.array('B', bytes(capacity))
+        self.names = {}
+        self.lock = threading.Lock()
+        # next() on itertools.count is atomic under the GIL
+        self.counter = itertools.count()
+        self.count = 0
+        self.bindings = []
+
+    def intern(self, value):
+        """Map string to index. Only allocates the first time value is seen.
+        """
+        index = self.names.get(value)
+        if index is None:
+            with self.lock:
+                index = self.names.setdefault(value, len(self.names))
+        return index
+
+    def enable(self, binding):
+        """Trace calls made through binding.lib.
+        """
+        instrument.attach(binding, self)
+        if binding not in self.bindings:
+            self.bindings.append(binding)
+
+    def disable(self, binding=None):
+        """Stop tracing binding or all bindings if None.
+        """
+        if binding is None:
+            bindings = list(self.bindings)
+        else:
+            bindings = [binding]
+        for b in bindings:
+            instrument.detach(b, self)
+            if b in self.bindings:
+                self.bindings.remove(b)
+
+    def record(self, device, op, start, end, size, error):
+        """Sink interface used by instrument.libproxy.
+        """
+        if self.ops is not None and op not in self.ops:
+            return
+        n = next(self.counter)
+        i = n % self.capacity
+        self.start[i] = start
+        self.end[i] = end
+        self.tid[i] = threading.get_ident()
+        self.size[i] = size
+        self.name[i] = self.intern(op)
+        self.device[i] = self.intern(device)
+        self.error[i] = error
+        self.count = n + 1
+
+    def gpioEvent(self, chip, line, start, end):
+        """Record GPIO edge event handling (i.e. event_read) on chip/line.
+        """
+        self.record("%s:%d" % (chip, line), "gpio_event", start, end, 0, False)
+
+    def span(self, device, op, size=0):
+        """Context manager to trace Python code such as a driver method.
+        """
+        return tracespan(self, device, op, size)
+
+    def events(self):
+        """Return ring buffer indexes oldest to newest.
+        """
+        count = self.count
+        if count <= self.capacity:
+            return range(count)
+        first = count % self.capacity
+        return itertools.chain(range(first, self.capacity), range(0, first))
+
+    def reset(self):
+        self.counter = itertools.count()
+        self.count = 0
+
+    def chrome(self):
+        """Return Chrome trace event format dict.
+        """
+        pid = os.getpid()
+        names = {v: k for k, v in self.names.items()}
+        threads = {t.ident: t.name for t in threading.enumerate()}
+        events = []
+        tids = set()
+        for i in self.events():
+            tid = self.tid[i]
+            tids.add(tid)
+            events.append({"name": names[self.name[i]], "cat": names[self.device[i]], "ph": "X",
+                           "ts": self.start[i] / 1000.0, "dur": (self.end[i] - self.start[i]) / 1000.0,
+                           "pid": pid, "tid": tid,
+                           "args": {"device": names[self.device[i]], "bytes": self.size[i], "error": bool(self.error[i])}})
+        for tid in tids:
+            events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid,
+                           "args": {"name": threads.get(tid, "thread-%d" % tid)}})
+        return {"traceEvents": events, "displayTimeUnit": "ns"}
+
+    def dump(self, path):
+        """Write Chrome trace JSON file.
+        """
+        with open(path, "w") as f:
+            json.dump(self.chrome(), f)
+
+
+class tracespan:
+    """Trace a block of Python code.
+    """
+
+    def __init__(self, trace, device, op, size):
+        self.trace = trace
+        self.device = device
+        self.op = op
+        self.size = size
+
+    def __enter__(self):
+        self.begin = time.monotonic_ns()
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.trace.record(self.device, self.op, self.begin, time.monotonic_ns(), self.size, excType is not None)
+        return False
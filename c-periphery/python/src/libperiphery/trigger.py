@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2018 Steven P. Goldsmith
+# See LICENSE.md for details.
+
+"""
+Interrupt driven acquisition
+-------------
+
+Bind a libgpiod edge event (data ready/INT pin) to a prepared I2C or SPI read.
+The read runs on the event thread as soon as the edge is seen and the sample is
+stamped with the kernel edge timestamp in nanoseconds.
+
+Message arrays and buffers are allocated once when the transaction is prepared,
+so each event only costs one transfer call.
+"""
+
+import sys, threading, time, gpiod
+from libperiphery import samples
+
+
+# Prepared I2C register block read, execute() returns the block as bytes
+i2cread = samples.blockreader
+
+
+class spiread:
+    """Prepared SPI read. txdata is sent (i.e. register address with read bit)
+    followed by enough dummy bytes to clock in length bytes.
+    """
+
+    def __init__(self, spi, handle, txdata, length):
+        """spi is a libperipheryspi instance and handle is an open spi_t.
+        """
+        self.spi = spi
+        self.lib = spi.lib
+        self.ffi = spi.ffi
+        self.handle = handle
+        self.skip = len(txdata)
+        self.size = self.skip + length
+        self.txbuf = self.ffi.new("uint8_t[]", self.size)
+        self.txbuf[0:self.skip] = bytes(txdata)
+        self.rxbuf = self.ffi.new("uint8_t[]", self.size)
+
+    def execute(self):
+        """Run transaction and return data following the command bytes.
+        """
+        if self.lib.spi_transfer(self.handle, self.txbuf, self.rxbuf, self.size) < 0:
+            raise RuntimeError(self.ffi.string(self.lib.spi_errmsg(self.handle)).decode('utf-8'))
+        return self.ffi.buffer(self.rxbuf)[self.skip:]
+
+
+class trigger:
+    """Run a transaction on each GPIO edge and pass (timestamp, data) to
+    callback.
+
+    transaction can be any object with an execute() method or a plain callable
+    so drivers can supply their own read sequence. decode (optional) converts
+    the raw data before callback is invoked.
+    """
+
+    def __init__(self, chip, line, transaction, callback, decode=None, edge=gpiod.LINE_REQ_EV_RISING_EDGE, timeout=0.1, tracer=None):
+        """chip is a GPIO chip path such as /dev/gpiochip0. timeout is how often
+        in seconds the event thread checks for stop. tracer (optional) records
+        each event read on the timeline.
+        """
+        self.tracer = tracer
+        self.traceName = "%s:%d" % (chip, line)
+        self.chip = gpiod.Chip(chip, gpiod.Chip.OPEN_BY_PATH)
+        self.line = self.chip.get_line(line)
+        self.line.request(consumer=sys.argv[0][:-3], type=edge)
+        if hasattr(transaction, "execute"):
+            self.execute = transaction.execute
+        else:
+            self.execute = transaction
+        self.callback = callback
+        self.decode = decode
+        self.sec = int(timeout)
+        self.nsec = int((timeout - self.sec) * 1000000000)
+        self.events = 0
+        self.errors = 0
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def run(self):
+        """Event loop. Read is done before anything else to keep latency from
+        edge to bus transfer as low as possible.
+        """
+        line = self.line
+        execute = self.execute
+        decode = self.decode
+        callback = self.callback
+        tracer = self.tracer
+        while not self.stopped.is_set():
+            if line.event_wait(sec=self.sec, nsec=self.nsec):
+                if tracer:
+                    start = time.monotonic_ns()
+                    event = line.event_read()
+                    tracer.record(self.traceName, "gpio_event", start, time.monotonic_ns(), 0, False)
+                else:
+                    event = line.event_read()
+                try:
+                    data = execute()
+                except RuntimeError:
+                    self.errors += 1
+                    continue
+                self.events += 1
+                timestamp = event.sec * 1000000000 + event.nsec
+                if decode:
+                    data = decode(data)
+                callback(timestamp, data)
+
+    def start(self):
+        """Start event thread.
+        """
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop event thread and wait for it to exit.
+        """
+        self.stopped.set()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+    def close(self):
+        """Stop and release GPIO line.
+        """
+        self.stop()
+        self.line.release()
+        self.chip.close()
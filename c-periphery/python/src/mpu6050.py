@@ -11,15 +11,64 @@ This is an example of using the c-periphery I2C bindings.
 import sys, time
 from argparse import *
 from cffi import FFI
-from libperiphery import libperipheryi2c
+from libperiphery import libperipheryi2c, regmap, samples
+
+# LSB per unit for AFS_SEL and FS_SEL 0 - 3
+ACCEL_LSBS = (16384.0, 8192.0, 4096.0, 2048.0)
+GYRO_LSBS = (131.0, 65.5, 32.8, 16.4)
+ACCEL_RANGES = (2, 4, 8, 16)
+GYRO_RANGES = (250, 500, 1000, 2000)
+
+accelScale = regmap.rangescale("ACCEL_CONFIG", "AFS_SEL", ACCEL_LSBS)
+gyroScale = regmap.rangescale("GYRO_CONFIG", "FS_SEL", GYRO_LSBS)
+
+# MPU-6000/MPU-6050 Register Map and Descriptions revision 4.2
+registers = regmap.devicemap("mpu6050", [
+    regmap.register("SMPLRT_DIV", 0x19),
+    regmap.register("CONFIG", 0x1a, fields=[regmap.field("DLPF_CFG", 0, 3)]),
+    regmap.register("GYRO_CONFIG", 0x1b, fields=[regmap.field("FS_SEL", 3, 2)]),
+    regmap.register("ACCEL_CONFIG", 0x1c, fields=[regmap.field("AFS_SEL", 3, 2)]),
+    # 2 mg/LSB, 1 ms/LSB
+    regmap.register("MOT_THR", 0x1f, scale=0.002),
+    regmap.register("MOT_DUR", 0x20),
+    regmap.register("INT_PIN_CFG", 0x37, fields=[regmap.field("INT_RD_CLEAR", 4)]),
+    regmap.register("INT_ENABLE", 0x38, fields=[regmap.field("DATA_RDY_EN", 0), regmap.field("MOT_EN", 6)]),
+    regmap.register("INT_STATUS", 0x3a, readClear=True, fields=[regmap.field("DATA_RDY_INT", 0),
+                                                                regmap.field("MOT_INT", 6)]),
+    regmap.register("ACCEL_XOUT", 0x3b, 2, True, ">", accelScale),
+    regmap.register("ACCEL_YOUT", 0x3d, 2, True, ">", accelScale),
+    regmap.register("ACCEL_ZOUT", 0x3f, 2, True, ">", accelScale),
+    regmap.register("TEMP_OUT", 0x41, 2, True, ">", 1.0 / 340.0, 36.53),
+    regmap.register("GYRO_XOUT", 0x43, 2, True, ">", gyroScale),
+    regmap.register("GYRO_YOUT", 0x45, 2, True, ">", gyroScale),
+    regmap.register("GYRO_ZOUT", 0x47, 2, True, ">", gyroScale),
+    regmap.register("PWR_MGMT_1", 0x6b, fields=[regmap.field("CLKSEL", 0, 3), regmap.field("TEMP_DIS", 3),
+                                                regmap.field("CYCLE", 5), regmap.field("SLEEP", 6)]),
+    regmap.register("PWR_MGMT_2", 0x6c, fields=[regmap.field("STBY_G", 0, 3), regmap.field("STBY_A", 3, 3),
+                                                regmap.field("LP_WAKE_CTRL", 6, 2)]),
+    regmap.register("WHO_AM_I", 0x75),
+])
+
+ACCEL = ("ACCEL_XOUT", "ACCEL_YOUT", "ACCEL_ZOUT")
+GYRO = ("GYRO_XOUT", "GYRO_YOUT", "GYRO_ZOUT")
+# One 14 byte burst from ACCEL_XOUT_H
+SAMPLE = ACCEL + ("TEMP_OUT",) + GYRO
 
 
 class mpu6050:
     
-    def __init__(self):
-        """Create library interface.
+    def __init__(self, i2c=None):
+        """Create library interface. i2c can be any libperipheryi2c compatible
+        object (shared bus client, simulated backend, etc.).
         """    
-        self.i2c = libperipheryi2c.libperipheryi2c()
+        if i2c is None:
+            i2c = libperipheryi2c.libperipheryi2c()
+        self.i2c = i2c
+        # Compiled bursts per (handle, addr)
+        self.regs = regmap.regdriver(registers, i2c)
+        self.bursts = {}
+        # calibration.calibration per (handle, addr)
+        self.calibrations = {}
 
     def getTemp(self, handle, addr):
         """Reads the temperature from the onboard temperature sensor of the
@@ -27,10 +76,8 @@ class mpu6050:
         
         Returns the temperature in degrees Fahrenheit.
         """    
-        # Get the actual temperature using the formula given in the MPU-6050
-        # Register Map and Descriptions revision 4.2, page 30 and convert to
-        # ºF
-        return 1.8 * ((self.i2c.readWord(handle, addr, 0x41) / 340) + 36.53) + 32
+        # Register map scale and offset give ºC (revision 4.2, page 30)
+        return 1.8 * self.regs.read(handle, addr, "TEMP_OUT")[0] + 32
     
     def setAccelRange(self, handle, addr, range):
         """Sets the range of the accelerometer to range.
@@ -39,9 +86,9 @@ class mpu6050:
         range is advised.
         """
         # First change it to 0x00 to make sure we write the correct value later
-        self.i2c.writeReg(handle, addr, 0x1c, 0x00)
+        self.regs.write(handle, addr, "ACCEL_CONFIG", 0x00)
         # Write the new range to the 0x1c register
-        self.i2c.writeReg(handle, addr, 0x1c, range)
+        self.regs.write(handle, addr, "ACCEL_CONFIG", range)
         
     def readAccelRange(self, handle, addr, raw=False):
         """Reads the range the accelerometer is set to.
@@ -50,21 +97,14 @@ class mpu6050:
         is False, it will return an integer: -1, 2, 4, 8 or 16. When it returns -1
         something went wrong.
         """
-        # Get the raw value
-        rawData = self.i2c.readReg(handle, addr, 0x1c)
+        rawData = self.regs.readReg(handle, addr, "ACCEL_CONFIG")
         if raw is True:
             return rawData
-        elif raw is False:
-            if rawData == 0x00:
-                return 2
-            elif rawData == 0x08:
-                return 4
-            elif rawData == 0x10:
-                return 8
-            elif rawData == 0x18:
-                return 16
-            else:
-                return -1
+        afsSel = registers.fieldOf("ACCEL_CONFIG", "AFS_SEL")
+        # Self test bits set
+        if rawData & ~afsSel.mask:
+            return -1
+        return ACCEL_RANGES[rawData >> afsSel.shift]
     
     def getAccelData(self, handle, addr, g=False):
         """Gets and returns the X, Y and Z values from the accelerometer.
@@ -72,32 +112,12 @@ class mpu6050:
         If g is True, it will return the data in g. If g is False, it will return
         the data in m/s^2. Returns a dictionary with the measurement results.
         """
-        # Read the data from the MPU-6050
-        x = self.i2c.readWord(handle, addr, 0x3b) 
-        y = self.i2c.readWord(handle, addr, 0x3d)
-        z = self.i2c.readWord(handle, addr, 0x3f)
-        accelScaleModifier = None
-        accelRange = self.readAccelRange(handle, addr, True)
-        if accelRange == 0x00:
-            accelScaleModifier = 16384.0
-        elif accelRange == 0x08:
-            accelScaleModifier = 8192.0
-        elif accelRange == 0x10:
-            accelScaleModifier = 4096.0
-        elif accelRange == 0x18:
-            accelScaleModifier = 2048.0
-        else:
-            print("Unkown range - accelScaleModifier set to 16384.0")
-            accelScaleModifier = 16384.0
-        x = x / accelScaleModifier
-        y = y / accelScaleModifier
-        z = z / accelScaleModifier
-        if g is True:
-            return {'x': x, 'y': y, 'z': z}
-        elif g is False:
-            x = x * 9.80665
-            y = y * 9.80665
-            z = z * 9.80665
+        # One 6 byte burst scaled by the current AFS_SEL range
+        x, y, z = self.regs.read(handle, addr, *ACCEL)
+        if g is False:
+            x = x * samples.GRAVITY
+            y = y * samples.GRAVITY
+            z = z * samples.GRAVITY
         return {'x': x, 'y': y, 'z': z}
     
     def setGyroRange(self, handle, addr, gyroRange):
@@ -107,9 +127,9 @@ class mpu6050:
         is advised.
         """
         # First change it to 0x00 to make sure we write the correct value later
-        self.i2c.writeReg(handle, addr, 0x1b, 0x00)
+        self.regs.write(handle, addr, "GYRO_CONFIG", 0x00)
         # Write the new range to the 0x1B register
-        self.i2c.writeReg(handle, addr, 0x1b, gyroRange)
+        self.regs.write(handle, addr, "GYRO_CONFIG", gyroRange)
     
     def readGyroRange(self, handle, addr, raw=False):
         """Reads the range the gyroscope is set to.
@@ -118,68 +138,169 @@ class mpu6050:
         is False, it will return 250, 500, 1000, 2000 or -1. If the returned value
         is equal to -1 something went wrong.
         """
-        # Get the raw value
-        rawData = self.i2c.readReg(handle, addr, 0x1b)
+        rawData = self.regs.readReg(handle, addr, "GYRO_CONFIG")
         if raw is True:
             return rawData
-        elif raw is False:
-            if rawData == 0x00:
-                return 250
-            elif rawData == 0x08:
-                return 500
-            elif rawData == 0x10:
-                return 1000
-            elif rawData == 0x18:
-                return 2000
-            else:
-                return -1
+        fsSel = registers.fieldOf("GYRO_CONFIG", "FS_SEL")
+        # Self test bits set
+        if rawData & ~fsSel.mask:
+            return -1
+        return GYRO_RANGES[rawData >> fsSel.shift]
     
     def getGyroData(self, handle, addr):
         """Gets and returns the X, Y and Z values from the gyroscope.
         
         Returns the read values in a dictionary.
         """
-        # Read the raw data from the MPU-6050
-        x = self.i2c.readWord(handle, addr, 0x43)
-        y = self.i2c.readWord(handle, addr, 0x45)
-        z = self.i2c.readWord(handle, addr, 0x47)
-        gyroScaleModifier = None
-        gyroRange = self.readGyroRange(handle, addr, True)
-        if gyroRange == 0x00:
-            gyroScaleModifier = 131.0
-        elif gyroRange == 0x08:
-            gyroScaleModifier = 65.5
-        elif gyroRange == 0x10:
-            gyroScaleModifier = 32.8
-        elif gyroRange == 0x18:
-            gyroScaleModifier = 16.4
-        else:
-            print("Unkown range - gyroScaleModifier set to 131.0")
-            gyroScaleModifier = 131.0
-        x = x / gyroScaleModifier
-        y = y / gyroScaleModifier
-        z = z / gyroScaleModifier
+        # One 6 byte burst scaled by the current FS_SEL range
+        x, y, z = self.regs.read(handle, addr, *GYRO)
         return {'x': x, 'y': y, 'z': z}
     
+    def enableDataReady(self, handle, addr):
+        """Enable data ready interrupt on the INT pin. INT_RD_CLEAR is set so
+        the interrupt status is cleared by any read (see trigger.py).
+        """
+        self.regs.write(handle, addr, "INT_PIN_CFG", registers.fieldOf("INT_PIN_CFG", "INT_RD_CLEAR").mask)
+        self.regs.write(handle, addr, "INT_ENABLE", registers.fieldOf("INT_ENABLE", "DATA_RDY_EN").mask)
+
+    def getGyroRate(self, handle, addr):
+        """Gyro output rate in Hz, 8 kHz with DLPF off and 1 kHz with it on.
+        """
+        if self.regs.getField(handle, addr, "CONFIG", "DLPF_CFG") in (0, 7):
+            return 8000.0
+        return 1000.0
+
+    def getSampleRate(self, handle, addr):
+        """Sample rate in Hz from SMPLRT_DIV and DLPF_CFG.
+        """
+        return self.getGyroRate(handle, addr) / (1 + self.regs.readReg(handle, addr, "SMPLRT_DIV"))
+
+    def setSampleRate(self, handle, addr, div):
+        """Sample rate is gyro output rate / (1 + div).
+        """
+        self.regs.write(handle, addr, "SMPLRT_DIV", div & 0xff)
+
+    def setRate(self, handle, addr, hz):
+        """Nearest sample rate to hz: DLPF on (1 kHz gyro output) from 4 to
+        1000 Hz, DLPF off (8 kHz) above. Returns the rate set.
+        """
+        if hz > 1000:
+            dlpf, gyroRate = 0, 8000.0
+        else:
+            dlpf, gyroRate = 1, 1000.0
+        div = max(0, min(255, int(round(gyroRate / max(hz, 1))) - 1))
+        self.regs.setField(handle, addr, "CONFIG", "DLPF_CFG", dlpf)
+        self.setSampleRate(handle, addr, div)
+        return gyroRate / (1 + div)
+
+    def enableMotionDetect(self, handle, addr, threshold, duration):
+        """Enable motion interrupt. threshold in g (2 mg/LSB) and duration in
+        ms (1 ms/LSB). Other enabled interrupts are kept.
+        """
+        self.regs.write(handle, addr, "MOT_THR", max(1, min(255, int(round(threshold / 0.002)))))
+        self.regs.write(handle, addr, "MOT_DUR", max(1, min(255, int(round(duration)))))
+        self.regs.write(handle, addr, "INT_ENABLE", self.regs.readReg(handle, addr, "INT_ENABLE") |
+                        registers.fieldOf("INT_ENABLE", "MOT_EN").mask)
+
+    def motionDetected(self, handle, addr):
+        """True if motion was detected since INT_STATUS was last read.
+        """
+        return bool(self.regs.readReg(handle, addr, "INT_STATUS") & registers.fieldOf("INT_STATUS", "MOT_INT").mask)
+
+    def setCycleMode(self, handle, addr, wakeCtrl):
+        """Accelerometer only low power mode: gyros in standby, temperature
+        sensor off and the part wakes for one sample at 1.25, 5, 20 or 40 Hz
+        (wakeCtrl 0 - 3).
+        """
+        self.regs.write(handle, addr, "PWR_MGMT_2", (wakeCtrl & 0x03) << 6 | registers.fieldOf("PWR_MGMT_2", "STBY_G").mask)
+        self.regs.write(handle, addr, "PWR_MGMT_1", registers.fieldOf("PWR_MGMT_1", "CYCLE").mask |
+                        registers.fieldOf("PWR_MGMT_1", "TEMP_DIS").mask)
+
+    def setNormalMode(self, handle, addr):
+        """Leave cycle mode, all sensors on.
+        """
+        self.regs.write(handle, addr, "PWR_MGMT_1", 0x00)
+        self.regs.write(handle, addr, "PWR_MGMT_2", 0x00)
+
+    def disableDataReady(self, handle, addr):
+        """Disable all interrupts.
+        """
+        self.regs.write(handle, addr, "INT_ENABLE", 0x00)
+
     def getAllData(self, handle, addr):
         """Reads and returns all the available data.
         """
-        temp = self.getTemp(handle, addr)
-        accel = self.getAccelData(handle, addr)
-        gyro = self.getGyroData(handle, addr)
-        return [accel, gyro, temp]
+        # Accel, temp and gyro in one 14 byte burst
+        ax, ay, az, temp, gx, gy, gz = self.regs.read(handle, addr, *SAMPLE)
+        accel = {'x': ax * samples.GRAVITY, 'y': ay * samples.GRAVITY, 'z': az * samples.GRAVITY}
+        gyro = {'x': gx, 'y': gy, 'z': gz}
+        return [accel, gyro, 1.8 * temp + 32]
+
+    def getScales(self, handle, addr):
+        """Accel and gyro LSB per unit from the current range registers (read
+        every call, readBatch reads them once per batch).
+        """
+        b = self.burst(handle, addr)
+        ranges = dict(zip(b.ranges, b.rangeValues()))
+        return (1.0 / self.regs.scaleOf(handle, addr, registers["ACCEL_XOUT"], ranges),
+                1.0 / self.regs.scaleOf(handle, addr, registers["GYRO_XOUT"], ranges))
+
+    def setCalibration(self, handle, addr, calib):
+        """Correct every scaled read and readBatch with calib
+        (calibration.calibration, None to remove).
+        """
+        if calib is None:
+            self.calibrations.pop((handle, addr), None)
+            self.regs.setAffine(handle, addr, None)
+        else:
+            self.calibrations[(handle, addr)] = calib
+            self.regs.setAffine(handle, addr, calib.corrections(ACCEL, GYRO))
+
+    def getCalibration(self, handle, addr):
+        return self.calibrations.get((handle, addr))
+
+    def burst(self, handle, addr):
+        """Compiled sample burst.
+        """
+        key = (handle, addr)
+        b = self.bursts.get(key)
+        if b is None:
+            b = self.regs.burst(handle, addr, SAMPLE)
+            self.bursts[key] = b
+        return b
+
+    def reader(self, handle, addr):
+        """Block reader of the 14 byte sample burst.
+        """
+        return self.burst(handle, addr).spans[0].reader
+
+    def readSample(self, handle, addr):
+        """Accel (g), temp (ºC) and gyro (º/s) from one 14 byte block read.
+        """
+        ax, ay, az, temp, gx, gy, gz = self.burst(handle, addr).read()
+        return samples.imusample(time.monotonic_ns(), ax, ay, az, temp, gx, gy, gz)
+
+    def readBatch(self, handle, addr, batch, count=None, interval=0.0):
+        """Fill samplebatch (samples.imudtype, block size 14) with count
+        samples (default capacity) and return the decoded samples.
+        """
+        if count is None:
+            count = batch.capacity
+        accelScale, gyroScale = self.getScales(handle, addr)
+        data = batch.data[:count]
+        self.reader(handle, addr).readInto(batch.raw, data["timestamp"], count, interval)
+        samples.decodeMpu6050(batch.raw[:count], accelScale, gyroScale, data, self.calibrations.get((handle, addr)))
+        batch.count = count
+        return data
 
     def main(self, device, address):
         handle = self.i2c.open(device)
         # Wake up the MPU-6050 since it starts in sleep mode
-        self.i2c.writeReg(handle, address, 0x6b, 0x00)
+        self.regs.write(handle, address, "PWR_MGMT_1", 0x00)
         count = 0
         while count < 100:
-            all = self.getAllData(handle, address)
-            accel = all[0]
-            gyro = all[1]
-            temp = all[2]
-            print("%.1f ºF | Accel x: %+5.2f, y: %+5.2f, z: %+5.2f | Gyro  x: %+5.2f, y: %+5.2f, z: %+5.2f" % (temp, accel['x'], accel['y'], accel['z'], gyro['x'], gyro['y'], gyro['z']))
+            sample = self.readSample(handle, address)
+            print("%.1f ºF | Accel x: %+5.2f, y: %+5.2f, z: %+5.2f | Gyro  x: %+5.2f, y: %+5.2f, z: %+5.2f" % (1.8 * sample.temp + 32, sample.ax * samples.GRAVITY, sample.ay * samples.GRAVITY, sample.az * samples.GRAVITY, sample.gx, sample.gy, sample.gz))
             time.sleep(0.5)
             count += 1
         self.i2c.close(handle)
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2018 Steven P. Goldsmith
+# See LICENSE.md for details.
+
+"""
+MPU-6050 interrupt driven acquisition
+-------------
+Wire the MPU-6050 INT pin to a GPIO line. Each data ready edge triggers a 14
+byte burst read of accel, temp and gyro registers stamped with the kernel edge
+timestamp.
+"""
+
+import struct, time
+from argparse import *
+from libperiphery import libperipheryi2c
+from libperiphery import trigger
+from mpu6050 import mpu6050
+
+
+class mpu6050trigger:
+
+    def __init__(self):
+        """Create library interface.
+        """
+        self.i2c = libperipheryi2c.libperipheryi2c()
+        self.mpu = mpu6050(self.i2c)
+        self.samples = []
+        self.block = struct.Struct(">7h")
+
+    def decode(self, data):
+        """Accel x, y, z, temp, gyro x, y, z raw values.
+        """
+        return self.block.unpack(data)
+
+    def sample(self, timestamp, data):
+        """Called on event thread.
+        """
+        self.samples.append((timestamp, data))
+
+    def main(self, device, address, chip, line, rate, secs):
+        # SMPLRT_DIV is 8 bits, so 1 kHz / (1 + 0..249) gives 4 to 1000 Hz
+        if not 4 <= rate <= 1000:
+            raise ValueError("Rate %d Hz outside 4 to 1000 Hz" % rate)
+        handle = self.i2c.open(device)
+        # Wake up the MPU-6050 since it starts in sleep mode
+        self.i2c.writeReg(handle, address, 0x6b, 0x00)
+        # DLPF on (1 kHz gyro output rate) and sample rate = 1 kHz / (1 + SMPLRT_DIV)
+        self.i2c.writeReg(handle, address, 0x1a, 0x01)
+        self.mpu.setSampleRate(handle, address, int(round(1000 / rate)) - 1)
+        read = trigger.i2cread(self.i2c, handle, address, 0x3b, 14)
+        trig = trigger.trigger(chip, line, read, self.sample, self.decode)
+        # Enable data ready interrupt after line is requested
+        self.mpu.enableDataReady(handle, address)
+        trig.start()
+        time.sleep(secs)
+        trig.close()
+        self.mpu.disableDataReady(handle, address)
+        self.i2c.close(handle)
+        print("Events: %d, errors: %d" % (trig.events, trig.errors))
+        if len(self.samples) > 1:
+            elapsed = (self.samples[-1][0] - self.samples[0][0]) / 1000000000
+            print("Sample rate %.1f Hz" % ((len(self.samples) - 1) / elapsed))
+            print("Last sample %s" % (self.samples[-1][1],))
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--device", help="I2C device name (default '/dev/i2c-0')", type=str, default="/dev/i2c-0")
+    parser.add_argument("--address", help="MPU-6050 address (default 0x68)", type=str, default="0x68")
+    parser.add_argument("--chip", help="GPIO chip name for INT pin (default '/dev/gpiochip0')", type=str, default="/dev/gpiochip0")
+    parser.add_argument("--line", help="GPIO line number for INT pin (default 203 IOG11 on NanoPi Duo)", type=int, default=203)
+    parser.add_argument("--rate", help="Sample rate in Hz, 4 to 1000 (default 100)", type=int, default=100)
+    parser.add_argument("--secs", help="Seconds to run (default 10)", type=int, default=10)
+    args = parser.parse_args()
+    obj = mpu6050trigger()
+    # Convert from hex string to int
+    address = int(args.address, 16)
+    obj.main(args.device, address, args.chip, args.line, args.rate, args.secs)
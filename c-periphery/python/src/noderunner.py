@@ -0,0 +1,330 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2018 Steven P. Goldsmith
+# See LICENSE.md for details.
+
+"""
+Config driven sensor node
+-------------
+Runs every device of a sensor node in one process from a JSON config instead
+of one script per device. Devices share I2C handles through i2cbus, periodic
+reads run on one acquisition worker per bus and data ready triggers on their
+GPIO event thread. Samples go to the configured sinks and a report shows each
+device's achieved rate, CPU share and overruns:
+
+    {
+        "sim": false,
+        "report": 5.0,
+        "buses": {"i2c0": "/dev/i2c-0"},
+        "devices": [
+            {"name": "imu", "driver": "mpu6050", "bus": "i2c0", "address": "0x68", "rate": 200, "priority": 0},
+            {"name": "accel", "driver": "adxl345", "bus": "i2c0", "address": "0x53",
+             "trigger": {"chip": "/dev/gpiochip0", "line": 203}}
+        ],
+        "sinks": [
+            {"type": "print", "every": 100},
+            {"type": "shmring", "name": "imu", "devices": ["imu"]},
+            {"type": "recorder", "directory": "/data/accel", "devices": ["accel"], "chunkSecs": 3600}
+        ]
+    }
+
+"rate" is the read rate of periodic devices and the output data rate (so the
+data ready rate) of triggered ones, set to the nearest rate the part has.
+"sim": true runs the same config against simulated devices.
+"""
+
+import collections, heapq, itertools, json, time
+from argparse import *
+from libperiphery import acquisition, i2cbus, libperipheryi2c, samples, sim
+from mpu6050 import mpu6050
+from adxl345 import adxl345
+
+
+def setupMpu6050(driver, handle, addr, rate, triggered):
+    # Wake up, output data rate from config (1 kHz if 0)
+    driver.i2c.writeReg(handle, addr, 0x6b, 0x00)
+    driver.setRate(handle, addr, rate or 1000)
+    if triggered:
+        driver.enableDataReady(handle, addr)
+
+
+def setupAdxl345(driver, handle, addr, rate, triggered):
+    # Measure, full resolution +/- 2g, output data rate from config (100 Hz if 0)
+    driver.i2c.writeReg(handle, addr, 0x2d, 0x08)
+    driver.setRange(handle, addr, 0x00)
+    driver.setRate(handle, addr, rate or 100)
+    if triggered:
+        driver.enableDataReady(handle, addr)
+
+
+# driver name -> class, setup, record dtype, simulated model
+drivers = {
+    "mpu6050": (mpu6050, setupMpu6050, samples.imudtype, sim.mpu6050model),
+    "adxl345": (adxl345, setupAdxl345, samples.acceldtype, sim.adxl345model),
+}
+
+
+def values(sample):
+    """Sample fields after the timestamp as a list.
+    """
+    return [getattr(sample, name) for name in sample.__slots__[1:]]
+
+
+def toRecords(dtype, items):
+    """(timestamp, name, sample) list to structured array.
+    """
+    import numpy as np
+    result = np.zeros(len(items), dtype=dtype)
+    if not items:
+        return result
+    result["timestamp"] = [item[0] for item in items]
+    flat = np.array([values(item[2]) for item in items], dtype=np.float64)
+    column = 0
+    for name in dtype.names[1:]:
+        sub = dtype.fields[name][0]
+        width = int(np.prod(sub.shape)) if sub.shape else 1
+        result[name] = flat[:, column:column + width].reshape((len(items),) + sub.shape)
+        column += width
+    return result
+
+
+class printsink:
+
+    def __init__(self, every=100, devices=None):
+        self.every = every
+        self.devices = devices
+        self.counts = collections.Counter()
+
+    def write(self, items):
+        for timestamp, name, sample in items:
+            if self.devices is None or name in self.devices:
+                self.counts[name] += 1
+                if self.counts[name] % self.every == 0:
+                    print("%s %d %s" % (name, timestamp, sample))
+
+    def close(self):
+        pass
+
+
+class shmringsink:
+    """Publishes device samples as shmring.sampledtype records (values padded
+    to 7).
+    """
+
+    def __init__(self, name, capacity=65536, devices=None):
+        from libperiphery import shmring
+        import numpy as np
+        self.np = np
+        self.producer = shmring.producer(name, capacity)
+        self.devices = devices
+
+    def write(self, items):
+        items = [item for item in items if self.devices is None or item[1] in self.devices]
+        if items:
+            batch = self.np.zeros(len(items), dtype=self.producer.dtype)
+            batch["timestamp"] = [item[0] for item in items]
+            for i, item in enumerate(items):
+                v = values(item[2])
+                batch["values"][i, :len(v)] = v
+            self.producer.write(batch)
+
+    def close(self):
+        self.producer.close()
+
+
+class recordersink:
+    """One columnar recorder per device under directory.
+    """
+
+    def __init__(self, directory, dtypes, devices, chunkRecords=1048576, chunkSecs=None):
+        from libperiphery import recorder
+        import os
+        self.recorders = {name: recorder.recorder(os.path.join(directory, name), dtypes[name], chunkRecords, chunkSecs)
+                          for name in devices}
+        self.dtypes = dtypes
+
+    def write(self, items):
+        perDevice = collections.defaultdict(list)
+        for item in items:
+            if item[1] in self.recorders:
+                perDevice[item[1]].append(item)
+        for name, deviceItems in perDevice.items():
+            self.recorders[name].write(toRecords(self.dtypes[name], deviceItems))
+
+    def close(self):
+        for rec in self.recorders.values():
+            rec.close()
+
+
+class timedread:
+    """Triggered read with CPU accounting (trigger runs it on its own
+    thread).
+    """
+
+    def __init__(self, read):
+        self.read = read
+        self.cpuNs = 0
+
+    def execute(self):
+        start = time.thread_time_ns()
+        try:
+            return self.read()
+        finally:
+            self.cpuNs += time.thread_time_ns() - start
+
+
+class noderunner:
+
+    def __init__(self, config):
+        self.config = config
+        if config.get("sim"):
+            self.simLib = sim.i2clib()
+            i2c = libperipheryi2c.libperipheryi2c(lib=self.simLib)
+        else:
+            self.simLib = None
+            i2c = None
+        self.bus = i2cbus.i2cbus(i2c)
+        self.acq = acquisition.acquisition()
+        self.devices = []
+        self.triggers = []
+        self.triggered = collections.deque()
+        # (timestamp, seq, item) of triggered samples newer than the merged periodic stream
+        self.held = []
+        self.seq = itertools.count()
+        self.dtypes = {}
+        self.sinks = []
+
+    def addDevice(self, spec):
+        name = spec["name"]
+        cls, setup, dtype, model = drivers[spec["driver"]]
+        path = self.config["buses"][spec["bus"]]
+        addr = int(spec["address"], 16)
+        if self.simLib is not None:
+            self.simLib.add(path, addr, model())
+        rate = spec.get("rate", 0)
+        client = self.bus.client(name, spec.get("priority", 10), spec.get("busRate"),
+                                 spec.get("burst"))
+        driver = cls(client)
+        handle = client.open(path)
+        triggerSpec = spec.get("trigger")
+        # Setup writes as one bus transaction
+        client.call(handle, setup, driver, handle, addr, rate, triggerSpec is not None)
+        read = lambda: driver.readSample(handle, addr)
+        self.dtypes[name] = dtype
+        device = {"name": name, "bus": path, "rate": rate, "client": client, "handle": handle}
+        if triggerSpec is None:
+            device["task"] = self.acq.add(path, name, read, rate)
+        else:
+            from libperiphery import trigger
+            timed = timedread(read)
+            trig = trigger.trigger(triggerSpec["chip"], triggerSpec["line"], timed,
+                                   lambda timestamp, sample, name=name: self.triggered.append((timestamp, name, sample)))
+            device["trigger"] = trig
+            device["timed"] = timed
+            self.triggers.append(trig)
+        self.devices.append(device)
+
+    def addSink(self, spec):
+        kind = spec["type"]
+        devices = spec.get("devices")
+        if kind == "print":
+            sink = printsink(spec.get("every", 100), devices)
+        elif kind == "shmring":
+            sink = shmringsink(spec["name"], spec.get("capacity", 65536), devices)
+        elif kind == "recorder":
+            sink = recordersink(spec["directory"], self.dtypes, devices or list(self.dtypes),
+                                spec.get("chunkRecords", 1048576), spec.get("chunkSecs"))
+        else:
+            raise ValueError("Unknown sink type %s" % kind)
+        self.sinks.append(sink)
+
+    def build(self):
+        for spec in self.config["devices"]:
+            self.addDevice(spec)
+        for spec in self.config.get("sinks", []):
+            self.addSink(spec)
+
+    def drain(self, final=False):
+        """Periodic and triggered samples merged in timestamp order (edge
+        timestamps are CLOCK_MONOTONIC like the periodic ones on Linux 5.7 and
+        later). Triggered samples newer than the last periodic one are held
+        for the next drain, so order holds up to one triggered read's latency.
+        """
+        periodic = self.acq.merge(final)
+        while self.triggered:
+            item = self.triggered.popleft()
+            heapq.heappush(self.held, (item[0], next(self.seq), item))
+        if final or not self.acq.workers:
+            cutoff = None
+        elif periodic:
+            cutoff = periodic[-1][0]
+        else:
+            cutoff = -1
+        triggered = []
+        while self.held and (cutoff is None or self.held[0][0] <= cutoff):
+            triggered.append(heapq.heappop(self.held)[2])
+        items = list(heapq.merge(periodic, triggered, key=lambda item: item[0]))
+        if items:
+            for sink in self.sinks:
+                sink.write(items)
+
+    def report(self, elapsedNs, cpuNs):
+        stats = self.acq.stats()
+        print("%-12s %-12s %10s %10s %8s %9s %7s" % ("Device", "Bus", "Target/s", "Rate/s", "CPU %", "Overruns", "Errors"))
+        for device in self.devices:
+            name = device["name"]
+            if "task" in device:
+                s = stats[name]
+                rate, cpu, overruns, errors = s["rate"], s["cpu"], s["overruns"], s["errors"]
+            else:
+                trig = device["trigger"]
+                rate = trig.events / (elapsedNs / 1000000000)
+                cpu = device["timed"].cpuNs / elapsedNs
+                overruns, errors = "-", trig.errors
+            target = device["rate"] or ("max" if "task" in device else "edge")
+            print("%-12s %-12s %10s %10.1f %8.2f %9s %7s" % (name, device["bus"], target, rate, cpu * 100, overruns, errors))
+        for path, u in self.bus.utilization()["buses"].items():
+            print("Bus %s utilization %.1f%%, %d transactions" % (path, u["utilization"] * 100, u["transactions"]))
+        print("Process CPU %.1f%%" % (cpuNs / elapsedNs * 100))
+
+    def run(self, duration=0.0):
+        """Run until duration seconds pass (0 = until Ctrl-C).
+        """
+        reportSecs = self.config.get("report", 5.0)
+        started = time.monotonic_ns()
+        cpuStart = time.process_time_ns()
+        self.acq.start()
+        for trig in self.triggers:
+            trig.start()
+        nextReport = time.monotonic() + reportSecs
+        end = time.monotonic() + duration if duration else None
+        try:
+            while end is None or time.monotonic() < end:
+                time.sleep(0.05)
+                self.drain()
+                if reportSecs and time.monotonic() >= nextReport:
+                    self.report(time.monotonic_ns() - started, time.process_time_ns() - cpuStart)
+                    nextReport += reportSecs
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for trig in self.triggers:
+                trig.close()
+            self.acq.stop()
+            self.drain(True)
+            self.report(time.monotonic_ns() - started, time.process_time_ns() - cpuStart)
+            for sink in self.sinks:
+                sink.close()
+            for device in self.devices:
+                device["client"].close(device["handle"])
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--config", help="JSON node config", type=str, required=True)
+    parser.add_argument("--duration", help="Seconds to run (default 0 = until Ctrl-C)", type=float, default=0.0)
+    args = parser.parse_args()
+    with open(args.config) as f:
+        config = json.load(f)
+    obj = noderunner(config)
+    obj.build()
+    obj.run(args.duration)
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2018 Steven P. Goldsmith
+# See LICENSE.md for details.
+
+"""
+Shared memory sample ring benchmark
+-------------
+One producer process writes timestamped records in batches at a target rate
+and several consumer processes read them with their own cursors. Reports
+samples/sec seen by each consumer and records lost to overrun.
+"""
+
+import multiprocessing, time
+from argparse import *
+import numpy as np
+from libperiphery import shmring
+
+
+def consume(name, secs, results):
+    """Consumer process.
+    """
+    ring = shmring.consumer(name)
+    count = 0
+    checksum = 0.0
+    end = time.monotonic() + secs
+    while time.monotonic() < end:
+        view, lost = ring.read()
+        if len(view):
+            # Touch the data like a real consumer would
+            checksum += float(view["values"][:, 0].sum())
+            count += len(view)
+        else:
+            time.sleep(0.001)
+        del view
+    results.put((count, ring.lost))
+    ring.close()
+
+
+class shmringbench:
+
+    def main(self, readers, rate, batch, secs):
+        name = "shmringbench"
+        ring = shmring.producer(name, capacity=65536)
+        results = multiprocessing.Queue()
+        procs = [multiprocessing.Process(target=consume, args=(name, secs + 0.5, results)) for i in range(readers)]
+        for p in procs:
+            p.start()
+        # Let consumers attach
+        time.sleep(0.5)
+        data = np.zeros(batch, dtype=shmring.sampledtype)
+        data["values"] = 1.0
+        period = batch / rate
+        written = 0
+        start = time.monotonic()
+        due = start
+        while time.monotonic() - start < secs:
+            data["timestamp"] = time.monotonic_ns()
+            ring.write(data)
+            written += batch
+            due += period
+            delay = due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        elapsed = time.monotonic() - start
+        print("Producer: %d records, %.1f samples/sec" % (written, written / elapsed))
+        for i in range(readers):
+            count, lost = results.get()
+            print("Consumer: %d records, %.1f samples/sec, lost %d" % (count, count / elapsed, lost))
+        for p in procs:
+            p.join()
+        ring.close()
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--readers", help="Consumer processes (default 3)", type=int, default=3)
+    parser.add_argument("--rate", help="Producer samples/sec (default 20000)", type=int, default=20000)
+    parser.add_argument("--batch", help="Records per write (default 50)", type=int, default=50)
+    parser.add_argument("--secs", help="Seconds to run (default 5)", type=int, default=5)
+    args = parser.parse_args()
+    obj = shmringbench()
+    obj.main(args.readers, args.rate, args.batch, args.secs)
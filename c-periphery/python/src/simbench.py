@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2018 Steven P. Goldsmith
+# See LICENSE.md for details.
+
+"""
+Hardware free benchmark suite
+-------------
+Runs every driver hot path against the simulated backends in libperiphery.sim
+and reports ops/sec, peak bytes allocated per op and net memory blocks per op
+(leaks). Since the simulated lib replaces only the C side this measures the
+Python overhead of the bindings and drivers, which is what regresses.
+"""
+
+import sys, time, tracemalloc
+from argparse import *
+from libperiphery import libperipheryi2c, libperipheryspi, libperipheryserial, samples, sim
+from libpwmio import libpwmio
+from mpu6050 import mpu6050
+from adxl345 import adxl345
+
+
+class simbench:
+
+    def __init__(self):
+        """Create simulated devices.
+        """
+        self.i2cLib = sim.i2clib()
+        self.i2cLib.add("/dev/i2c-0", 0x68, sim.mpu6050model(seed=1))
+        self.i2cLib.add("/dev/i2c-0", 0x53, sim.adxl345model(seed=1))
+        self.i2c = libperipheryi2c.libperipheryi2c(lib=self.i2cLib)
+        self.spi = libperipheryspi.libperipheryspi(lib=sim.spilib())
+        self.serial = libperipheryserial.libperipheryserial(lib=sim.seriallib())
+        self.pwmLib = sim.pwmlib()
+        self.pwm = libpwmio.libpwmio(lib=self.pwmLib)
+        self.results = []
+
+    def measure(self, name, func, secs):
+        """Run func for secs and record ops/sec, peak bytes/op and net
+        blocks/op.
+        """
+        # Warm up caches
+        for i in range(10):
+            func()
+        count = 0
+        start = time.perf_counter()
+        end = start + secs
+        while time.perf_counter() < end:
+            for i in range(100):
+                func()
+            count += 100
+        rate = count / (time.perf_counter() - start)
+        tracemalloc.start()
+        func()
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        func()
+        peak = tracemalloc.get_traced_memory()[1] - base
+        tracemalloc.stop()
+        blocks = sys.getallocatedblocks()
+        for i in range(1000):
+            func()
+        leaked = (sys.getallocatedblocks() - blocks) / 1000
+        self.results.append((name, rate, peak, leaked))
+        print("%-28s %12.1f ops/sec %8d bytes/op %8.2f blocks/op" % (name, rate, peak, leaked))
+
+    def main(self, secs):
+        handle = self.i2c.open("/dev/i2c-0")
+        mpu = mpu6050(self.i2c)
+        # Wake up the MPU-6050
+        self.i2c.writeReg(handle, 0x68, 0x6b, 0x00)
+        adxl = adxl345(self.i2c)
+        self.i2c.writeReg(handle, 0x53, 0x2d, 0x08)
+        print("%-28s %20s %16s %18s" % ("Hot path", "rate", "peak", "net"))
+        self.measure("i2c.writeReg", lambda: self.i2c.writeReg(handle, 0x68, 0x19, 0x00), secs)
+        self.measure("i2c.readReg", lambda: self.i2c.readReg(handle, 0x68, 0x75), secs)
+        self.measure("i2c.readWord", lambda: self.i2c.readWord(handle, 0x68, 0x3b), secs)
+        self.measure("i2c.readArray 14", lambda: self.i2c.readArray(handle, 0x68, 0x3b, 14), secs)
+        # Same class as trigger.i2cread, without needing gpiod
+        read = samples.blockreader(self.i2c, handle, 0x68, 0x3b, 14)
+        self.measure("blockreader 14", read.execute, secs)
+        self.measure("mpu6050.getTemp", lambda: mpu.getTemp(handle, 0x68), secs)
+        self.measure("mpu6050.getAccelData", lambda: mpu.getAccelData(handle, 0x68), secs)
+        self.measure("mpu6050.getGyroData", lambda: mpu.getGyroData(handle, 0x68), secs)
+        self.measure("mpu6050.getAllData", lambda: mpu.getAllData(handle, 0x68), secs)
+        self.measure("mpu6050.readSample", lambda: mpu.readSample(handle, 0x68), secs)
+        imuBatch = samples.samplebatch(samples.imudtype, 14, 100)
+        self.measure("mpu6050.readBatch 100", lambda: mpu.readBatch(handle, 0x68, imuBatch), secs / 10)
+        self.measure("adxl345.read", lambda: adxl.read(handle, 0x53), secs)
+        self.measure("adxl345.readSample", lambda: adxl.readSample(handle, 0x53), secs)
+        accelBatch = samples.samplebatch(samples.acceldtype, 6, 100)
+        self.measure("adxl345.readBatch 100", lambda: adxl.readBatch(handle, 0x53, accelBatch), secs / 10)
+        self.i2c.close(handle)
+        spiHandle = self.spi.open("/dev/spidev1.0", 0, 500000)
+        txbuf = self.spi.ffi.new("uint8_t[]", 128)
+        rxbuf = self.spi.ffi.new("uint8_t[]", 128)
+        self.measure("spi.transfer 128", lambda: self.spi.transfer(spiHandle, txbuf, rxbuf), secs)
+        self.spi.close(spiHandle)
+        link = sim.ptylink()
+        serialHandle = self.serial.open(link.path, 115200)
+        serialBuf = self.serial.ffi.new("uint8_t[]", 64)
+
+        def serialRoundTrip():
+            self.serial.lib.serial_write(serialHandle, serialBuf, 64)
+            link.write(link.read(64))
+            self.serial.lib.serial_read(serialHandle, serialBuf, 64, 100)
+
+        self.measure("serial write/read 64", serialRoundTrip, secs)
+        self.serial.close(serialHandle)
+        link.close()
+        self.pwm.open(0, 0)
+        self.measure("pwm_set_duty_cycle", lambda: self.pwm.lib.pwm_set_duty_cycle(0, 0, 500), secs)
+        self.pwm.close(0)
+        self.pwmLib.cleanup()
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--secs", help="Seconds per hot path (default 1.0)", type=float, default=1.0)
+    args = parser.parse_args()
+    obj = simbench()
+    obj.main(args.secs)
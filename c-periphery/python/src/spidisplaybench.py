@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2018 Steven P. Goldsmith
+# See LICENSE.md for details.
+
+"""
+SPI display push benchmark
+-------------
+Runs typical UI updates (clock digits, progress bar, scattered widgets, list
+scroll, page change and an idle screen) through libperiphery.spidisplay with
+full frame pushes and with dirty region pushes. Reports bytes on the wire,
+transfers and CPU per frame and frames/sec: measured on hardware, estimated
+from --speed and --transfer_us with --sim (the simulated panel RAM is checked
+against every frame).
+"""
+
+import sys, time
+from argparse import *
+import numpy as np
+from libperiphery import libperipheryspi, sim, spidisplay
+
+# name -> width, height, init sequence
+PANELS = {"st7789": (240, 240, spidisplay.ST7789_INIT), "ili9341": (240, 320, spidisplay.ILI9341_INIT)}
+
+
+def clock(frame, i, rng):
+    """HH:MM:SS digits redrawn each frame.
+    """
+    digits = rng.integers(0, 2, (24, 96)).astype(bool)
+    frame[8:32, 8:104] = np.where(digits, 0xffff, 0x0000)
+
+
+def progress(frame, i, rng):
+    """Bar growing 2 pixels a frame.
+    """
+    width = frame.shape[1] - 40
+    x = 20 + (2 * i) % width
+    frame[-30:-18, 20:20 + width] = 0x2104
+    frame[-30:-18, 20:x + 2] = 0x07e0
+
+
+def widgets(frame, i, rng):
+    """Clock in one corner, status icon in the other and a counter.
+    """
+    clock(frame, i, rng)
+    frame[8:24, -24:-8] = 0xf800 if i % 2 else 0x001f
+    frame[-16:-8, 8:56] = rng.integers(0, 0xffff, (8, 48))
+
+
+def sprites(frame, i, rng):
+    """Twenty small items changing all over the screen.
+    """
+    height, width = frame.shape
+    for y, x in rng.integers(0, (height - 8, width - 8), (20, 2)):
+        frame[y:y + 8, x:x + 8] = rng.integers(0, 0xffff)
+
+
+def scroll(frame, i, rng):
+    """List area scrolled by one line of text.
+    """
+    top, bottom = 40, frame.shape[0] - 40
+    frame[top:bottom] = np.roll(frame[top:bottom], -12, axis=0)
+    frame[bottom - 12:bottom, 8:-8] = rng.integers(0, 0xffff, (12, frame.shape[1] - 16))
+
+
+def page(frame, i, rng):
+    """Whole screen redrawn.
+    """
+    frame[:] = rng.integers(0, 0xffff, frame.shape)
+
+
+def idle(frame, i, rng):
+    pass
+
+
+scenarios = (("clock", clock), ("progress", progress), ("widgets", widgets), ("sprites", sprites),
+             ("scroll", scroll), ("page", page), ("idle", idle))
+
+
+class spidisplaybench:
+
+    def __init__(self, device, panel, speed, simulated, dcChip, dcLine):
+        self.width, self.height, self.initSequence = PANELS[panel]
+        self.simulated = simulated
+        if simulated:
+            spiLib = sim.spilib()
+            self.model = sim.displaymodel(self.width, self.height)
+            spiLib.add(device, self.model)
+            self.spi = libperipheryspi.libperipheryspi(lib=spiLib)
+            self.dc = self.model.dc
+            self.initSequence = [(cmd, params, 0.0) for cmd, params, delay in self.initSequence]
+        else:
+            import gpiod
+            self.spi = libperipheryspi.libperipheryspi()
+            self.chip = gpiod.Chip(dcChip, gpiod.Chip.OPEN_BY_PATH)
+            self.line = self.chip.get_line(dcLine)
+            self.line.request(consumer=sys.argv[0][:-3], type=gpiod.LINE_REQ_DIR_OUT)
+            self.dc = self.line.set_value
+        self.handle = self.spi.open(device, self.spi.lib.SPI_MODE_0, speed)
+
+    def run(self, update, frames, full, chunk):
+        """Push frames updates, return (bytes, transfers, rects, CPU secs,
+        wall secs) per frame.
+        """
+        disp = spidisplay.display(self.spi, self.handle, self.width, self.height, self.dc, chunk)
+        disp.init(self.initSequence)
+        rng = np.random.default_rng(1)
+        frame = spidisplay.rgb565(rng.integers(0, 256, (self.height, self.width, 3)))
+        disp.push(frame)
+        base = disp.stats()
+        cpu = 0.0
+        start = time.perf_counter()
+        for i in range(frames):
+            update(frame, i, rng)
+            cpuStart = time.process_time()
+            disp.push(frame, full)
+            cpu += time.process_time() - cpuStart
+            if self.simulated and bytes(self.model.ram) != frame.tobytes():
+                raise RuntimeError("Panel RAM does not match frame %d" % i)
+        wall = time.perf_counter() - start
+        stats = disp.stats()
+        return [(stats[key] - base[key]) / frames for key in ("bytes", "transfers", "rects")] + [cpu / frames, wall / frames]
+
+    def fps(self, result, speed, transferUs):
+        """Measured frames/sec on hardware, CPU plus estimated wire time in
+        simulation.
+        """
+        bytesPerFrame, transfers, rects, cpu, wall = result
+        if not self.simulated:
+            return 1.0 / wall
+        return 1.0 / max(1e-9, cpu + bytesPerFrame * 8 / speed + transfers * transferUs / 1000000)
+
+    def main(self, frames, speed, chunk, transferUs):
+        print("Panel %dx%d, %d Hz, chunk %d bytes%s" % (self.width, self.height, speed, chunk,
+                                                         ", simulated (%.0f us per transfer)" % transferUs
+                                                         if self.simulated else ""))
+        print("%-9s %-6s %10s %9s %6s %8s %8s %8s" % ("Scenario", "Push", "Bytes", "Transfers", "Rects", "CPU ms",
+                                                      "FPS", "Speedup"))
+        for name, update in scenarios:
+            fullResult = self.run(update, frames, True, chunk)
+            dirtyResult = self.run(update, frames, False, chunk)
+            fullFps = self.fps(fullResult, speed, transferUs)
+            for push, result in (("full", fullResult), ("dirty", dirtyResult)):
+                fps = self.fps(result, speed, transferUs)
+                print("%-9s %-6s %10.0f %9.1f %6.1f %8.3f %8.1f %7.1fx" % (name, push, result[0], result[1], result[2],
+                                                                          result[3] * 1000, fps, fps / fullFps))
+        self.spi.close(self.handle)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--device", help="SPI device name (default '/dev/spidev0.0')", type=str, default="/dev/spidev0.0")
+    parser.add_argument("--panel", help="st7789 (240x240) or ili9341 (240x320) (default ili9341)", type=str, default="ili9341")
+    parser.add_argument("--speed", help="SPI clock Hz (default 40000000)", type=int, default=40000000)
+    parser.add_argument("--chunk", help="Bytes per transfer (default 4096, spidev bufsiz)", type=int, default=4096)
+    parser.add_argument("--frames", help="Frames per scenario (default 100)", type=int, default=100)
+    parser.add_argument("--dc_chip", help="GPIO chip of the D/C line (default '/dev/gpiochip0')", type=str, default="/dev/gpiochip0")
+    parser.add_argument("--dc_line", help="D/C line offset (default 24)", type=int, default=24)
+    parser.add_argument("--sim", help="Use simulated panel", action="store_true")
+    parser.add_argument("--transfer_us", help="Simulated ioctl overhead per transfer in us (default 20)", type=float, default=20.0)
+    args = parser.parse_args()
+    obj = spidisplaybench(args.device, args.panel, args.speed, args.sim, args.dc_chip, args.dc_line)
+    obj.main(args.frames, args.speed, args.chunk, args.transfer_us)
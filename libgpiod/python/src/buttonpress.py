@@ -10,7 +10,7 @@ Should work on any board with a button built in. Just change chip and line
 value as needed.
 """
 
-import sys, time, gpiod
+import sys, time, gpiod, eventlog
 from argparse import *
 
 
@@ -24,12 +24,15 @@ class buttonpress:
             self.chip_led = gpiod.Chip(chip_led, gpiod.Chip.OPEN_BY_PATH)
         else:
             self.chip_led = self.chip_button
+        self.chip_path = chip_button
 
-    def main(self, button, led):
+    def main(self, button, led, log=None):
         """Print edge events for 10 seconds.
         """         
         print("Button name: %s, label: %s, lines: %d" % (self.chip_button.name(), self.chip_button.label(), self.chip_button.num_lines()))
         print("LED name: %s, label: %s, lines: %d" % (self.chip_led.name(), self.chip_led.label(), self.chip_led.num_lines()))
+        if log:
+            chip_number = eventlog.chipNumber(self.chip_path)
         button_line = self.chip_button.get_line(button)
         button_line.request(consumer=sys.argv[0][:-3], type=gpiod.LINE_REQ_EV_BOTH_EDGES)
         if led:
@@ -40,6 +43,8 @@ class buttonpress:
         print("Press and release button, timeout in 10 seconds after last press\n")
         while button_line.event_wait(sec=10):
             event = button_line.event_read()
+            if log:
+                log.appendEvent(chip_number, button, event)
             if event.type == gpiod.LineEvent.RISING_EDGE:
                 print("Rising  edge timestamp %s" % time.strftime('%m/%d/%Y %H:%M:%S', time.localtime(event.sec)))
             elif event.type == gpiod.LineEvent.FALLING_EDGE:
@@ -60,6 +65,15 @@ if __name__ == "__main__":
     parser.add_argument("--button", help="GPIO line number (default 3 button on NanoPi Duo)", type=int, default=3)
     parser.add_argument("--chip_led", help="GPIO chip name (default '/dev/gpiochip0')", type=str, default="/dev/gpiochip0")
     parser.add_argument("--led", help="GPIO line number", type=int)
+    parser.add_argument("--log", help="Append events to binary event log file", type=str)
     args = parser.parse_args()
     obj = buttonpress(args.chip_button, args.chip_led)
-    obj.main(args.button, args.led)
+    if args.log:
+        log = eventlog.eventlog(args.log)
+    else:
+        log = None
+    try:
+        obj.main(args.button, args.led, log)
+    finally:
+        if log:
+            log.close()
@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2018 Steven P. Goldsmith
+# See LICENSE.md for details.
+
+"""
+Append only binary GPIO event log
+-------------
+
+16 byte records (ns timestamp, chip, line, edge) appended through a memory
+mapped file, flushed to disk at most syncSecs after an append (a timer covers
+quiet lines). Months of PIR/door sensor history
+stay small and a time range query is a binary search that returns NumPy
+arrays:
+
+    log = eventlog.eventlog("/var/lib/gpio/events.log")
+    log.appendEvent(1, 11, event)
+
+    reader = eventlog.reader("/var/lib/gpio/events.log")
+    events = reader.query(start, end, chip=1, line=11)
+    buckets, high, rises = reader.duty(1, 11, start, end, 3600 * 1000000000)
+
+Records must be appended in time order (event timestamps are CLOCK_REALTIME, so
+a clock step backwards breaks the binary search until it is past).
+"""
+
+import mmap, os, re, struct, threading, time
+import numpy as np
+
+MAGIC = b"GPIOEVT1"
+# magic, record count
+HEADER = struct.Struct("<8sQ")
+HEADER_SIZE = 64
+FALLING = 0
+RISING = 1
+
+eventdtype = np.dtype([("timestamp", "<i8"), ("chip", "<u2"), ("line", "<u2"), ("edge", "u1"), ("pad", "u1", (3,))])
+
+
+def chipNumber(path):
+    """/dev/gpiochip1 -> 1, symlinks (i.e. by label) are resolved first.
+    """
+    match = re.search(r"(\d+)$", os.path.realpath(path))
+    if match is None:
+        raise ValueError("Cannot tell chip number of %s" % path)
+    return int(match.group(1))
+
+
+class eventlog:
+    """Writer. Only one process should append to a log.
+    """
+
+    def __init__(self, path, syncSecs=5.0, grow=65536):
+        """grow is the number of records the file is extended by when full.
+        """
+        self.path = path
+        self.syncSecs = syncSecs
+        self.grow = grow
+        # Serializes msync from the timer thread with remap and close
+        self.lock = threading.Lock()
+        self.timer = None
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        size = os.fstat(self.fd).st_size
+        if size == 0:
+            os.ftruncate(self.fd, HEADER_SIZE + grow * eventdtype.itemsize)
+            os.pwrite(self.fd, HEADER.pack(MAGIC, 0), 0)
+        self.map()
+        magic, self.count = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            self.close()
+            raise RuntimeError("%s is not an event log" % path)
+        self.lastSync = time.monotonic()
+
+    def map(self):
+        self.mm = mmap.mmap(self.fd, 0)
+        self.capacity = (len(self.mm) - HEADER_SIZE) // eventdtype.itemsize
+        self.records = np.ndarray((self.capacity,), dtype=eventdtype, buffer=self.mm, offset=HEADER_SIZE)
+
+    def extend(self):
+        """Grow file and remap.
+        """
+        with self.lock:
+            del self.records
+            self.mm.flush()
+            self.mm.close()
+            os.ftruncate(self.fd, HEADER_SIZE + (self.capacity + self.grow) * eventdtype.itemsize)
+            self.map()
+
+    def append(self, timestamp, chip, line, edge):
+        """Append one record.
+        """
+        if self.count == self.capacity:
+            self.extend()
+        record = self.records[self.count]
+        record["timestamp"] = timestamp
+        record["chip"] = chip
+        record["line"] = line
+        record["edge"] = edge
+        self.count += 1
+        # Count after the record so readers never see a partial record
+        HEADER.pack_into(self.mm, 0, MAGIC, self.count)
+        self.syncLater()
+
+    def appendEvent(self, chip, line, event):
+        """Append gpiod.LineEvent.
+        """
+        # gpiod.LineEvent.RISING_EDGE, kept numeric so queries work without gpiod
+        if event.type == 1:
+            edge = RISING
+        else:
+            edge = FALLING
+        self.append(event.sec * 1000000000 + event.nsec, chip, line, edge)
+
+    def appendBatch(self, batch):
+        """Append structured array of eventdtype in one copy.
+        """
+        n = len(batch)
+        while self.count + n > self.capacity:
+            self.extend()
+        self.records[self.count:self.count + n] = batch
+        self.count += n
+        HEADER.pack_into(self.mm, 0, MAGIC, self.count)
+        self.syncLater()
+
+    def syncLater(self):
+        """Sync now if syncSecs passed since the last sync, otherwise make sure
+        a timer will.
+        """
+        wait = self.lastSync + self.syncSecs - time.monotonic()
+        if wait <= 0:
+            self.sync()
+        elif self.timer is None:
+            self.timer = threading.Timer(wait, self.sync)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def sync(self):
+        """msync mapped pages to disk.
+        """
+        with self.lock:
+            self.timer = None
+            if hasattr(self, "records"):
+                self.mm.flush()
+            self.lastSync = time.monotonic()
+
+    def close(self):
+        timer = self.timer
+        if timer is not None:
+            timer.cancel()
+        with self.lock:
+            self.timer = None
+            if hasattr(self, "records"):
+                del self.records
+                self.mm.flush()
+                self.mm.close()
+            os.close(self.fd)
+
+
+class reader:
+    """Read only query side. Safe to use while the log is being written.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def records(self):
+        """Memmap of all committed records.
+        """
+        with open(self.path, "rb") as f:
+            magic, count = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC:
+            raise RuntimeError("%s is not an event log" % self.path)
+        if count == 0:
+            return np.empty(0, dtype=eventdtype)
+        return np.memmap(self.path, dtype=eventdtype, mode="r", offset=HEADER_SIZE, shape=(count,))
+
+    def query(self, start=None, end=None, chip=None, line=None):
+        """Records with start <= timestamp < end (optionally one chip/line)
+        as a structured array copy.
+        """
+        records = self.records()
+        timestamps = records["timestamp"]
+        low = 0 if start is None else int(np.searchsorted(timestamps, start))
+        high = len(records) if end is None else int(np.searchsorted(timestamps, end))
+        result = records[low:high]
+        if chip is not None or line is not None:
+            mask = np.ones(len(result), dtype=bool)
+            if chip is not None:
+                mask &= result["chip"] == chip
+            if line is not None:
+                mask &= result["line"] == line
+            return result[mask]
+        return np.array(result)
+
+    def state(self, chip, line, timestamp):
+        """Line level before timestamp from the latest earlier event (0 if
+        none).
+        """
+        records = self.records()
+        high = int(np.searchsorted(records["timestamp"], timestamp))
+        # Walk back in blocks to find the last event for the line
+        block = 4096
+        while high > 0:
+            low = max(0, high - block)
+            part = records[low:high]
+            match = np.flatnonzero((part["chip"] == chip) & (part["line"] == line))
+            if len(match):
+                return int(part["edge"][match[-1]])
+            high = low
+            block *= 2
+        return 0
+
+    def intervals(self, events, initial, start, end):
+        """High (rising to falling) intervals of one line's events clipped to
+        [start, end).
+        """
+        edges = events["edge"].astype(np.int8)
+        timestamps = events["timestamp"]
+        # Drop repeated edges so rises and falls alternate
+        previous = np.concatenate(([initial], edges[:-1]))
+        keep = edges != previous
+        edges = edges[keep]
+        timestamps = timestamps[keep]
+        rises = timestamps[edges == RISING]
+        falls = timestamps[edges == FALLING]
+        if initial == RISING:
+            rises = np.concatenate(([start], rises))
+        if len(rises) > len(falls):
+            falls = np.concatenate((falls, [end]))
+        return rises, falls
+
+    def buckets(self, start, end, bucket):
+        edges = np.arange(start, end + bucket, bucket, dtype=np.int64)
+        edges[-1] = min(edges[-1], end)
+        return edges
+
+    def duty(self, chip, line, start, end, bucket):
+        """Per bucket start times, ns spent high and rising edge count.
+        """
+        events = self.query(start, end, chip, line)
+        rises, falls = self.intervals(events, self.state(chip, line, start), start, end)
+        edges = self.buckets(start, end, bucket)
+        # Cumulative high time H(t) at each bucket edge
+        cum = np.concatenate(([0], np.cumsum(falls - rises)))
+        k = np.searchsorted(rises, edges, side="right")
+        remaining = np.zeros(len(edges), dtype=np.int64)
+        started = k > 0
+        remaining[started] = np.maximum(falls[k[started] - 1] - edges[started], 0)
+        high = cum[k] - remaining
+        counts = np.histogram(events["timestamp"][events["edge"] == RISING], bins=edges)[0]
+        return edges[:-1], np.diff(high), counts
+
+    def occupancy(self, chip, line, start, end, bucket):
+        """Bucket start times and fraction of each bucket the line was high.
+        """
+        starts, high, counts = self.duty(chip, line, start, end, bucket)
+        return starts, high / np.diff(self.buckets(start, end, bucket))
@@ -0,0 +1,389 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2018 Steven P. Goldsmith
+# See LICENSE.md for details.
+
+"""
+GPIO round trip latency and throughput benchmark
+-------------
+Drives an output line that is wired to an input line and measures, for each
+I/O model:
+
+* round trip: drive call to the listener having the edge
+* edge to callback: kernel edge timestamp to the listener having the event
+* edge to output: kernel edge timestamp to the response set_value returning
+  (the buttonpress.py LED case, needs --resp_line)
+* sustained toggle rate and the event rate the listener keeps up with
+
+Models:
+
+* wait - event_wait/event_read loop on the calling thread (buttonpress.py)
+* thread - event thread calling a callback (buttonthread.py)
+* select - line.event_get_fd() in a selectors loop
+* poll - get_value busy loop without edge events
+
+Without a wire use the kernel's simulated chips: gpio-sim (--sim_pull with the
+line's pull attribute, i.e.
+/sys/devices/platform/gpio-sim.0/gpiochip2/sim_gpio0/pull) or gpio-mockup
+(--mockup with the debugfs line file, i.e.
+/sys/kernel/debug/gpio-mockup-event/gpiochip2/0).
+
+Edge timestamps are CLOCK_REALTIME before kernel 5.7 and CLOCK_MONOTONIC after,
+the clock is detected from the first event.
+"""
+
+import selectors, sys, threading, time, gpiod
+from argparse import *
+
+MODELS = ("wait", "thread", "select", "poll")
+
+
+class histogram:
+    """Exact latency recorder with percentiles and log2 buckets (ns).
+    """
+
+    def __init__(self):
+        self.values = []
+        self.max = 0
+
+    def record(self, value):
+        self.values.append(value)
+        if value > self.max:
+            self.max = value
+
+    def buckets(self):
+        """[(upper bound, count)] in powers of two.
+        """
+        counts = {}
+        for value in self.values:
+            bits = max(0, value).bit_length()
+            counts[bits] = counts.get(bits, 0) + 1
+        return [(1 << bits, counts[bits]) for bits in sorted(counts)]
+
+    def snapshot(self):
+        if not self.values:
+            return {"count": 0, "min": 0, "mean": 0, "p50": 0, "p90": 0, "p99": 0, "max": 0}
+        ordered = sorted(self.values)
+        last = len(ordered) - 1
+        return {"count": len(ordered), "min": ordered[0], "mean": sum(ordered) / len(ordered),
+                "p50": ordered[int(last * 0.5)], "p90": ordered[int(last * 0.9)], "p99": ordered[int(last * 0.99)],
+                "max": ordered[last]}
+
+
+class linedriver:
+    """Drive an output line (loopback wire).
+    """
+
+    def __init__(self, chip, line):
+        self.chip = gpiod.Chip(chip, gpiod.Chip.OPEN_BY_PATH)
+        self.line = self.chip.get_line(line)
+        self.line.request(consumer=sys.argv[0][:-3], type=gpiod.LINE_REQ_DIR_OUT)
+        self.write = self.line.set_value
+
+    def close(self):
+        self.line.release()
+
+
+class filedriver:
+    """Drive a simulated line through sysfs or debugfs.
+    """
+
+    def __init__(self, path, low, high):
+        self.file = open(path, "w")
+        self.values = (low, high)
+
+    def write(self, value):
+        self.file.write(self.values[value])
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class latency:
+    """Histograms for one model.
+    """
+
+    def __init__(self):
+        self.roundTrip = histogram()
+        self.edgeCallback = histogram()
+        self.edgeOutput = histogram()
+        self.timeouts = 0
+
+
+class gpiobench:
+
+    def __init__(self, chip, line, driver, respChip=None, respLine=None):
+        self.chip = gpiod.Chip(chip, gpiod.Chip.OPEN_BY_PATH)
+        self.line = self.chip.get_line(line)
+        self.line.request(consumer=sys.argv[0][:-3], type=gpiod.LINE_REQ_EV_BOTH_EDGES)
+        self.driver = driver
+        if respLine is not None:
+            self.respChip = gpiod.Chip(respChip or chip, gpiod.Chip.OPEN_BY_PATH)
+            self.resp = self.respChip.get_line(respLine)
+            self.resp.request(consumer=sys.argv[0][:-3], type=gpiod.LINE_REQ_DIR_OUT)
+        else:
+            self.resp = None
+        self.value = self.line.get_value()
+        # Edge timestamp clock - time.monotonic_ns(), None until first event
+        self.offset = None
+
+    def drain(self):
+        """Discard queued events.
+        """
+        while self.line.event_wait(sec=0, nsec=1000000):
+            self.line.event_read()
+
+    def toggle(self):
+        """Drive the other level and return the drive time.
+        """
+        self.value ^= 1
+        start = time.monotonic_ns()
+        self.driver.write(self.value)
+        return start
+
+    def stampOffset(self, stamp, now):
+        """Detect the edge timestamp clock from the first event.
+        """
+        realtime = time.time_ns() - now
+        if abs(stamp - now) < abs(stamp - now - realtime):
+            self.offset = 0
+        else:
+            self.offset = realtime
+        return self.offset
+
+    def record(self, result, start, event, now):
+        """Record one edge seen at now (monotonic ns) and drive the response.
+        """
+        if self.resp is not None:
+            self.resp.set_value(self.value)
+            done = time.monotonic_ns()
+        result.roundTrip.record(now - start)
+        if event is not None:
+            stamp = event.sec * 1000000000 + event.nsec
+            offset = self.offset
+            if offset is None:
+                offset = self.stampOffset(stamp, now)
+            edge = stamp - offset
+            result.edgeCallback.record(now - edge)
+            if self.resp is not None:
+                result.edgeOutput.record(done - edge)
+
+    def latencyWait(self, count, interval, timeout):
+        result = latency()
+        line = self.line
+        sec = int(timeout)
+        nsec = int((timeout - sec) * 1000000000)
+        for i in range(count):
+            start = self.toggle()
+            if line.event_wait(sec=sec, nsec=nsec):
+                event = line.event_read()
+                self.record(result, start, event, time.monotonic_ns())
+            else:
+                result.timeouts += 1
+            time.sleep(interval)
+        return result
+
+    def latencyThread(self, count, interval, timeout):
+        result = latency()
+        line = self.line
+        seen = threading.Event()
+        stopped = threading.Event()
+        state = {"start": 0}
+
+        def callback(event):
+            self.record(result, state["start"], event, time.monotonic_ns())
+            seen.set()
+
+        def run():
+            while not stopped.is_set():
+                if line.event_wait(sec=0, nsec=100000000):
+                    callback(line.event_read())
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        try:
+            for i in range(count):
+                seen.clear()
+                # Listener reads start after the edge, so set it first
+                state["start"] = time.monotonic_ns()
+                self.value ^= 1
+                self.driver.write(self.value)
+                if not seen.wait(timeout):
+                    result.timeouts += 1
+                time.sleep(interval)
+        finally:
+            stopped.set()
+            thread.join()
+        return result
+
+    def latencySelect(self, count, interval, timeout):
+        result = latency()
+        line = self.line
+        selector = selectors.DefaultSelector()
+        selector.register(line.event_get_fd(), selectors.EVENT_READ)
+        try:
+            for i in range(count):
+                start = self.toggle()
+                if selector.select(timeout):
+                    event = line.event_read()
+                    self.record(result, start, event, time.monotonic_ns())
+                else:
+                    result.timeouts += 1
+                time.sleep(interval)
+        finally:
+            selector.close()
+        return result
+
+    def latencyPoll(self, count, interval, timeout):
+        result = latency()
+        getValue = self.line.get_value
+        clock = time.monotonic_ns
+        timeoutNs = int(timeout * 1000000000)
+        for i in range(count):
+            start = self.toggle()
+            value = self.value
+            now = clock()
+            while getValue() != value:
+                now = clock()
+                if now - start > timeoutNs:
+                    break
+            if getValue() == value:
+                self.record(result, start, None, now)
+            else:
+                result.timeouts += 1
+            time.sleep(interval)
+        # Poll does not read events, throw away what queued up
+        self.drain()
+        return result
+
+    def listenEvents(self, model, stopped, counts):
+        line = self.line
+        if model == "select":
+            selector = selectors.DefaultSelector()
+            selector.register(line.event_get_fd(), selectors.EVENT_READ)
+            while not stopped.is_set():
+                if selector.select(0.1):
+                    line.event_read()
+                    counts[0] += 1
+            selector.close()
+        elif model == "thread":
+            def callback(event):
+                counts[0] += 1
+            while not stopped.is_set():
+                if line.event_wait(sec=0, nsec=100000000):
+                    callback(line.event_read())
+        else:
+            while not stopped.is_set():
+                if line.event_wait(sec=0, nsec=100000000):
+                    line.event_read()
+                    counts[0] += 1
+
+    def listenPoll(self, stopped, counts):
+        getValue = self.line.get_value
+        last = getValue()
+        while not stopped.is_set():
+            value = getValue()
+            if value != last:
+                counts[0] += 1
+                last = value
+
+    def throughput(self, model, seconds):
+        """Toggle as fast as possible for seconds while the model's listener
+        runs on its own thread. Returns (toggles/s, events/s, lost).
+        """
+        stopped = threading.Event()
+        counts = [0]
+        if model == "poll":
+            thread = threading.Thread(target=self.listenPoll, args=(stopped, counts), daemon=True)
+        else:
+            thread = threading.Thread(target=self.listenEvents, args=(model, stopped, counts), daemon=True)
+        thread.start()
+        write = self.driver.write
+        value = self.value
+        toggles = 0
+        start = time.monotonic()
+        end = start + seconds
+        while time.monotonic() < end:
+            for i in range(100):
+                value ^= 1
+                write(value)
+            toggles += 100
+        elapsed = time.monotonic() - start
+        self.value = value
+        # Let the listener catch up
+        time.sleep(0.2)
+        stopped.set()
+        thread.join()
+        if model == "poll":
+            self.drain()
+        return toggles / elapsed, counts[0] / elapsed, toggles - counts[0]
+
+    def run(self, model, count, interval, timeout, seconds):
+        self.drain()
+        result = getattr(self, "latency%s" % model.capitalize())(count, interval, timeout)
+        result.throughput = self.throughput(model, seconds) if seconds else None
+        return result
+
+    def report(self, model, result, buckets):
+        print("\n%s (%d timeouts)" % (model, result.timeouts))
+        print("%-16s %7s %9s %9s %9s %9s %9s %9s" % ("us", "count", "min", "mean", "p50", "p90", "p99", "max"))
+        for name, hist in (("round trip", result.roundTrip), ("edge->callback", result.edgeCallback),
+                           ("edge->output", result.edgeOutput)):
+            s = hist.snapshot()
+            if s["count"]:
+                print("%-16s %7d %9.1f %9.1f %9.1f %9.1f %9.1f %9.1f" % (name, s["count"], s["min"] / 1000,
+                      s["mean"] / 1000, s["p50"] / 1000, s["p90"] / 1000, s["p99"] / 1000, s["max"] / 1000))
+        if buckets:
+            total = max(1, len(result.roundTrip.values))
+            print("round trip histogram")
+            for upper, count in result.roundTrip.buckets():
+                print("  <= %10.1f us %7d %s" % (upper / 1000, count, "#" * int(40 * count / total)))
+        if result.throughput:
+            toggles, events, lost = result.throughput
+            if model == "poll":
+                print("throughput: %.0f toggles/s, %.0f changes seen/s, %d missed" % (toggles, events, lost))
+            else:
+                print("throughput: %.0f toggles/s, %.0f events/s, %d lost" % (toggles, events, lost))
+
+    def close(self):
+        self.line.release()
+        if self.resp is not None:
+            self.resp.release()
+        self.driver.close()
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--chip_in", help="Input GPIO chip name (default '/dev/gpiochip0')", type=str, default="/dev/gpiochip0")
+    parser.add_argument("--line_in", help="Input GPIO line number", type=int, required=True)
+    parser.add_argument("--chip_out", help="Output GPIO chip name (default same as input)", type=str)
+    parser.add_argument("--line_out", help="Output GPIO line number wired to input", type=int)
+    parser.add_argument("--sim_pull", help="gpio-sim pull attribute of the input line instead of a wire", type=str)
+    parser.add_argument("--mockup", help="gpio-mockup debugfs file of the input line instead of a wire", type=str)
+    parser.add_argument("--chip_resp", help="Response GPIO chip name (default same as input)", type=str)
+    parser.add_argument("--resp_line", help="Output line set on each edge (edge->output latency)", type=int)
+    parser.add_argument("--models", help="Comma separated models (default %s)" % ",".join(MODELS), type=str,
+                        default=",".join(MODELS))
+    parser.add_argument("--count", help="Round trips per model (default 1000)", type=int, default=1000)
+    parser.add_argument("--interval", help="Seconds between round trips (default 0.001)", type=float, default=0.001)
+    parser.add_argument("--timeout", help="Seconds to wait for an edge (default 1.0)", type=float, default=1.0)
+    parser.add_argument("--seconds", help="Seconds of throughput test per model, 0 to skip (default 2.0)", type=float,
+                        default=2.0)
+    parser.add_argument("--histogram", help="Print round trip histogram", action="store_true")
+    args = parser.parse_args()
+    if args.sim_pull:
+        driver = filedriver(args.sim_pull, "pull-down", "pull-up")
+    elif args.mockup:
+        driver = filedriver(args.mockup, "0", "1")
+    elif args.line_out is not None:
+        driver = linedriver(args.chip_out or args.chip_in, args.line_out)
+    else:
+        parser.error("one of --line_out, --sim_pull or --mockup is required")
+    obj = gpiobench(args.chip_in, args.line_in, driver, args.chip_resp, args.resp_line)
+    try:
+        for model in args.models.split(","):
+            if model not in MODELS:
+                parser.error("unknown model %s" % model)
+            obj.report(model, obj.run(model, args.count, args.interval, args.timeout, args.seconds), args.histogram)
+    finally:
+        obj.close()
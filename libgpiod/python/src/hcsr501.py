@@ -8,7 +8,7 @@ HC-SR501 sensor example
 Monitor rising edge (motion detected) and falling edge (no motion)
 """
 
-import sys, time, gpiod
+import sys, time, gpiod, eventlog
 from argparse import *
 
 
@@ -22,12 +22,15 @@ class hcsr501:
             self.chip_led = gpiod.Chip(chip_led, gpiod.Chip.OPEN_BY_PATH)
         else:
             self.chip_led = self.chip_sensor
+        self.chip_path = chip_sensor
 
-    def main(self, sensor, led):
+    def main(self, sensor, led, log=None):
         """Show motion for 30 seconds.
         """
         print("Button name: %s, label: %s, lines: %d" % (self.chip_sensor.name(), self.chip_sensor.label(), self.chip_sensor.num_lines()))
         print("LED name: %s, label: %s, lines: %d" % (self.chip_led.name(), self.chip_led.label(), self.chip_led.num_lines()))
+        if log:
+            chip_number = eventlog.chipNumber(self.chip_path)
         sensor_line = self.chip_sensor.get_line(sensor)
         sensor_line.request(consumer=sys.argv[0][:-3], type=gpiod.LINE_REQ_EV_BOTH_EDGES)
         if led:
@@ -38,6 +41,8 @@ class hcsr501:
         print("Program will exit after 60 seconds of no activity\n")
         while sensor_line.event_wait(sec=60):
             event = sensor_line.event_read()
+            if log:
+                log.appendEvent(chip_number, sensor, event)
             if event.type == gpiod.LineEvent.RISING_EDGE:
                 print("Motion detected %s" % time.strftime('%m/%d/%Y %H:%M:%S', time.localtime(event.sec)))
             elif event.type == gpiod.LineEvent.FALLING_EDGE:
@@ -59,6 +64,15 @@ if __name__ == "__main__":
     parser.add_argument("--sensor", help="GPIO line number (default 11 GPIOL11/IR-RX on NanoPi Duo)", type=int, default=11)
     parser.add_argument("--chip_led", help="GPIO chip name (default '/dev/gpiochip0')", type=str, default="/dev/gpiochip0")
     parser.add_argument("--led", help="GPIO line number", type=int)
+    parser.add_argument("--log", help="Append events to binary event log file", type=str)
     args = parser.parse_args()
     obj = hcsr501(args.chip_sensor, args.chip_led)
-    obj.main(args.sensor, args.led)
+    if args.log:
+        log = eventlog.eventlog(args.log)
+    else:
+        log = None
+    try:
+        obj.main(args.sensor, args.led, log)
+    finally:
+        if log:
+            log.close()
@@ -15,7 +15,10 @@ from cffi import FFI
 
 class libpwmio:
 
-    def __init__(self):
+    def __init__(self, lib=None):
+        """lib replaces the shared library, i.e. a simulated backend from
+        libperiphery.sim.
+        """
         self.ffi = FFI()
         # Specify each C function, struct and constant you want a Python binding for
         # Copy-n-paste with minor edits
@@ -34,7 +37,9 @@ class libpwmio:
 
         int pwm_set_duty_cycle(int device, int pwm, int duty_cycle);
         """)
-        self.lib = self.ffi.dlopen("/usr/local/lib/libpwmio.so")
+        if lib is None:
+            lib = self.ffi.dlopen("/usr/local/lib/libpwmio.so")
+        self.lib = lib
 
     def open(self, device, pwm):
         """Open PWM device and return bytes written or error if < 0.